@@ -0,0 +1,297 @@
+"""Offline CPU micro-benchmarks for the hot paths of the models.
+
+The models are built with 'define_models' from representative option-sets (see [CONFIGS]) and are run on synthetic
+tensors, so no data needs to be downloaded. For each option-set and batch-size, the median time of 'train_a_batch',
+'sample', 'classify', 'calculate_contr_loss', 'estimate_fisher', 'update_omega' and 'validate' is measured.
+
+Usage (from the root of the repository):
+    python -m benchmarks.bench_models --out bench.json                         #--> run benchmarks, store results
+    python -m benchmarks.bench_models --out new.json --compare bench.json      #--> ...and flag regressions
+    python -m benchmarks.bench_models --compare bench.json --results new.json  #--> only compare stored results
+"""
+
+import argparse
+import copy
+import json
+import platform
+import sys
+import time
+import numpy as np
+import torch
+from torch.utils.data import TensorDataset
+import options
+import utils
+import define_models as define
+from data.available import DATASET_CONFIGS
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+# Representative option-sets (as they would be given to main_cl.py)
+_BIR = ['--scenario=class', '--replay=generative', '--brain-inspired']
+_CIFAR_BIR_SI = ['--experiment=CIFAR100'] + _BIR + ['--si', '--c=1e8', '--dg-prop=0.6']
+CONFIGS = {
+    'splitMNIST-BIR': ['--experiment=splitMNIST'] + _BIR,
+    'CIFAR100-BIR-SI': _CIFAR_BIR_SI,
+    'CIFAR100-BIR-SI-contr-attn': _CIFAR_BIR_SI + ['--contrastive', '--c-scores', '--simsiam', '--attention',
+                                                   '--c-lr=1e-6', '--wd=1e-1'],
+    'CIFAR100-BIR-SI-reconrep': _CIFAR_BIR_SI + ['--recon-repulsion', '--recon-attraction', '--recon-rep-aver',
+                                                 '--use-rep-f'],
+}
+OPERATIONS = ['train_a_batch', 'sample', 'classify', 'calculate_contr_loss', 'estimate_fisher', 'update_omega',
+              'validate']
+
+
+def parse_model_args(argv):
+    '''Parse [argv] with the options of main_cl.py (with pretrained conv-layers switched off, to avoid any downloads).'''
+    kwargs = {'single_task': False, 'only_MNIST': False, 'generative': True, 'compare_code': 'none'}
+    parser = options.define_args(filename="main_cl", description='Benchmark')
+    for add_options in (options.add_general_options, options.add_eval_options, options.add_task_options,
+                        options.add_model_options, options.add_train_options, options.add_replay_options,
+                        options.add_bir_options, options.add_allocation_options):
+        parser = add_options(parser, **kwargs)
+    args = parser.parse_args(list(argv) + ['--no-gpus'])
+    options.set_defaults(args, **kwargs)
+    args.pre_convE = False
+    return args
+
+
+def build_model(args):
+    '''Define the main model in the same way as main_cl.py (see 'define_models.define_main_model').'''
+    config = dict(DATASET_CONFIGS['mnist28' if args.experiment=="splitMNIST" else 'cifar100'])
+    config['classes'] = 10 if args.experiment=="splitMNIST" else 100
+    config['normalize'] = utils.checkattr(args, "normalize")
+    model = define.define_main_model(args, config, torch.device("cpu"), verbose=False)
+    # -also set the SI- and EWC-settings if these are not selected (so 'update_omega' and 'estimate_fisher' can be timed)
+    model.si_c = args.si_c if utils.checkattr(args, 'si') else 0
+    model.epsilon = args.epsilon
+    # -use online EWC (with only one set of buffers), so repeated calls to 'estimate_fisher' all do the same work
+    model.online = True
+    model.gamma = 1.
+    return model, config
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+def _images(config, n):
+    '''Random images, with pixel-values in [0, 1] (as expected by the BCE-reconstruction loss) unless normalized.'''
+    shape = (n, config['channels'], config['size'], config['size'])
+    return torch.randn(*shape) if config['normalize'] else torch.rand(*shape)
+
+
+def _replay_batch(model, previous_model, args, config, batch_size, classes_per_task, task=2):
+    '''Generate the replayed inputs and targets for [task] with [previous_model], in the same way as 'train_cl' does.'''
+    from train import transform
+    allowed_classes = list(range(classes_per_task*(task-1)))
+    x_temp_ = previous_model.sample(batch_size, allowed_classes=allowed_classes, allowed_domains=list(range(task-1)),
+                                    only_x=False)
+    views = args.contrastive or args.contr_not_hidden
+    x_ = [x_temp_[0], model.convE(transform(x_temp_[3]))] if views else x_temp_[0]
+    with torch.no_grad():
+        scores_ = previous_model.classify(x_[0] if views else x_, not_hidden=False)[:, :(classes_per_task*(task-1))]
+    top_scores_ = top_threshold = None
+    if args.repulsion or args.recon_repulsion or args.recon_attraction:
+        scores_1 = scores_.double()
+        threshold_all = (scores_1.mean(0) + scores_1.std(0)).expand(batch_size, -1)
+        tk = (4 if scores_.size(1)>3 else scores_.size(1)) if args.use_rep_factor else (
+            int(args.n_rep+1) if scores_.size(1)>args.n_rep else scores_.size(1)
+        )
+        top_scores_ = torch.topk(scores_, tk, dim=1)[1]
+        top_threshold = torch.gather(threshold_all, 1, top_scores_[:, :1].clone())
+    return dict(x_=x_, scores_=scores_ if model.replay_targets=="soft" else None,
+                y_=scores_.max(1)[1] if model.replay_targets=="hard" else None, tasks_=x_temp_[2],
+                top_scores_=top_scores_, top_threshold=top_threshold)
+
+
+def make_operations(model, args, config, batch_size, fisher_n=8):
+    '''Return <dict> with for each operation that applies to [model] a function (without arguments) to be timed.
+    NOTE: 'estimate_fisher' always uses batches of size 1 (its cost is set by [fisher_n] rather than [batch_size]).'''
+    from eval import evaluate
+    classes_per_task = 2 if args.experiment=="splitMNIST" else 10
+    task = 2
+    criterion = torch.nn.CosineSimilarity(dim=1)
+    model.fisher_n = fisher_n
+    previous_model = copy.deepcopy(model).eval()
+    x = _images(config, batch_size)
+    y = torch.randint(classes_per_task*(task-1), classes_per_task*task, (batch_size,))
+    dataset = TensorDataset(_images(config, 4*batch_size), torch.randint(0, classes_per_task*task, (4*batch_size,)))
+    # -'estimate_fisher' runs the model's forward pass, which expects features at the "hidden"-level if [model.hidden]
+    with torch.no_grad():
+        fisher_dataset = TensorDataset(*dataset.tensors) if not utils.checkattr(model, 'hidden') else TensorDataset(
+            model.input_to_hidden(dataset.tensors[0]), dataset.tensors[1]
+        )
+    # -register the SI-buffers (as at the start of training), needed for 'update_omega'
+    W = {}
+    for n, p in model.named_parameters():
+        if p.requires_grad:
+            n = n.replace('.', '__')
+            model.register_buffer('{}_SI_prev_task'.format(n), p.detach().clone())
+            W[n] = torch.rand_like(p)
+
+    def train_a_batch():
+        replay = _replay_batch(model, previous_model, args, config, batch_size, classes_per_task, task=task)
+        model.train_a_batch(x, y=y, active_classes=list(range(classes_per_task*task)), task=task, rnt=1./task,
+                            freeze_convE=utils.checkattr(args, "freeze_convE"), replay_not_hidden=False,
+                            batch_size=batch_size, batch_size_replay=batch_size, use_views=args.contrastive,
+                            contrast_current=False, contrast_replayed=True, criterion=criterion, **replay)
+
+    def sample():
+        with torch.no_grad():
+            model.sample(batch_size, allowed_classes=list(range(classes_per_task*task)), only_x=False)
+
+    def classify():
+        with torch.no_grad():
+            model.classify(x, not_hidden=True)
+
+    def calculate_contr_loss():
+        proj_z = torch.nn.functional.normalize(torch.randn(batch_size, 2, 128), dim=2)
+        scores = torch.softmax(torch.randn(batch_size, classes_per_task*task), dim=1)
+        model.calculate_contr_loss(proj_z, y, scores=scores)
+
+    def estimate_fisher():
+        model.estimate_fisher(fisher_dataset, allowed_classes=list(range(classes_per_task*task)))
+
+    def update_omega():
+        model.update_omega(W, model.epsilon)
+
+    def validate():
+        evaluate.validate(model, dataset, batch_size=batch_size, test_size=None, verbose=False)
+
+    operations = dict(train_a_batch=train_a_batch, sample=sample, classify=classify, estimate_fisher=estimate_fisher,
+                      update_omega=update_omega, validate=validate)
+    if utils.checkattr(model, 'contrastive'):
+        operations['calculate_contr_loss'] = calculate_contr_loss
+    if not utils.checkattr(args, 'feedback'):
+        del operations['sample']
+    return operations
+
+
+def time_operation(function, repeats=10, warmup=2):
+    '''Run [function] [warmup] times, then return <list> with the duration (in s) of [repeats] more calls.'''
+    for _ in range(warmup):
+        function()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_benchmarks(configs, batch_sizes, operations=OPERATIONS, repeats=10, warmup=2, fisher_n=8, seed=0,
+                   verbose=True):
+    '''Time all [operations] for all [configs] (names in [CONFIGS]) and [batch_sizes]; return <list> with results.'''
+    results = []
+    for name in configs:
+        for batch_size in batch_sizes:
+            np.random.seed(seed)
+            torch.manual_seed(seed)
+            try:
+                args = parse_model_args(CONFIGS[name])
+                model, config = build_model(args)
+                functions = make_operations(model, args, config, batch_size, fisher_n=fisher_n)
+            except Exception as e:
+                print(" - {} (batch={}): could not build model ({}: {})".format(name, batch_size, type(e).__name__, e))
+                results.append({'config': name, 'batch': batch_size, 'op': None, 'error': repr(e)})
+                continue
+            for op in operations:
+                if op not in functions:
+                    continue
+                # -'update_omega' and 'estimate_fisher' do not depend on the batch-size, so only time them once
+                if op in ("update_omega", "estimate_fisher") and not batch_size==batch_sizes[0]:
+                    continue
+                try:
+                    times = np.array(time_operation(functions[op], repeats=repeats, warmup=warmup))
+                except Exception as e:
+                    print(" - {} (batch={}) {}: failed ({}: {})".format(name, batch_size, op, type(e).__name__, e))
+                    results.append({'config': name, 'batch': batch_size, 'op': op, 'error': repr(e)})
+                    continue
+                result = {'config': name, 'batch': batch_size, 'op': op, 'median_ms': 1000.*float(np.median(times)),
+                          'min_ms': 1000.*float(times.min()), 'std_ms': 1000.*float(times.std()), 'repeats': repeats}
+                results.append(result)
+                if verbose:
+                    print(" - {:<28} batch={:<5} {:<22} {:>10.2f} ms (min {:.2f})".format(
+                        name, batch_size, op, result['median_ms'], result['min_ms']
+                    ))
+    return results
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+def compare(results, baseline, threshold=0.1, verbose=True):
+    '''Compare [results] with [baseline] (both <lists> as returned by 'run_benchmarks'). Return <list> with all
+    entries whose median time is more than a fraction [threshold] slower than in [baseline].'''
+    base = {(r['config'], r['batch'], r['op']): r for r in baseline if 'median_ms' in r}
+    regressions = []
+    if verbose:
+        print("\n {:<28} {:>5} {:<22} {:>10} {:>10} {:>8}".format("config", "batch", "operation", "base (ms)",
+                                                                    "new (ms)", "change"))
+    for r in results:
+        key = (r['config'], r['batch'], r['op'])
+        if (key not in base) or ('median_ms' not in r):
+            continue
+        change = r['median_ms'] / base[key]['median_ms'] - 1.
+        regression = change > threshold
+        if regression:
+            regressions.append(dict(r, baseline_ms=base[key]['median_ms'], change=change))
+        if verbose:
+            print(" {:<28} {:>5} {:<22} {:>10.2f} {:>10.2f} {:>+7.1f}%{}".format(
+                r['config'], r['batch'], r['op'], base[key]['median_ms'], r['median_ms'], 100*change,
+                "  <-- REGRESSION" if regression else ""
+            ))
+    return regressions
+
+
+def _environment():
+    return {'python': platform.python_version(), 'torch': torch.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(), 'threads': torch.get_num_threads(),
+            'time': time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def main():
+    parser = argparse.ArgumentParser('./benchmarks/bench_models.py', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--configs', type=str, nargs='+', default=list(CONFIGS.keys()), choices=list(CONFIGS.keys()))
+    parser.add_argument('--batch', type=int, nargs='+', default=[32, 128], help="batch-sizes to benchmark")
+    parser.add_argument('--ops', type=str, nargs='+', default=OPERATIONS, choices=OPERATIONS)
+    parser.add_argument('--repeats', type=int, default=10, help="# timed calls per operation")
+    parser.add_argument('--warmup', type=int, default=2, help="# untimed calls before timing")
+    parser.add_argument('--fisher-n', type=int, default=8, help="# samples used by 'estimate_fisher'")
+    parser.add_argument('--threads', type=int, default=None, help="# threads used by torch")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', type=str, default=None, help="json-file to store results in")
+    parser.add_argument('--compare', type=str, default=None, metavar="BASELINE", help="json-file with baseline")
+    parser.add_argument('--results', type=str, default=None, help="compare these stored results (instead of running)")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative slow-down flagged as regression")
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    # Run the benchmarks (or load stored results)
+    if args.results is not None:
+        with open(args.results) as f:
+            report = json.load(f)
+    else:
+        print("\nRunning benchmarks...")
+        report = {'environment': _environment(), 'results': run_benchmarks(
+            args.configs, args.batch, operations=args.ops, repeats=args.repeats, warmup=args.warmup,
+            fisher_n=args.fisher_n, seed=args.seed,
+        )}
+        if args.out is not None:
+            with open(args.out, 'w') as f:
+                json.dump(report, f, indent=2)
+            print("\nResults stored in: {}".format(args.out))
+
+    # Compare with baseline (exit with code 1 if there are regressions)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report['results'], baseline['results'], threshold=args.threshold)
+        print("\n{} regression(s) (threshold: {:.0f}%)".format(len(regressions), 100*args.threshold))
+        if len(regressions)>0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
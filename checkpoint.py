@@ -0,0 +1,387 @@
+import hashlib
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import numpy as np
+import torch
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+def _replace_atomic(path, write_fn):
+    '''Write to [path] with [write_fn] (a <function> taking an open binary file) by writing to a temporary file, which is
+    flushed to disk and then renamed to [path]. This way, if the process is killed while saving, [path] still contains
+    the previously saved (complete) file.'''
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write_fn(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    # -also flush the directory-entry of the renamed file (not possible on all platforms)
+    try:
+        fd = os.open(directory or '.', os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+
+def write_atomic(obj, path):
+    '''Save [obj] to [path] with 'torch.save' (see '_replace_atomic').'''
+    _replace_atomic(path, lambda f: torch.save(obj, f))
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+# Model checkpoints are by default stored in a flat format with the same layout as safetensors: the size of the header
+# (8-byte little-endian integer), a json-header with for each tensor its dtype, shape and [begin, end] offsets in the
+# data-buffer, and the data-buffer itself. When loading, the data-buffer is memory-mapped, so the tensors are copied from
+# the file straight into the model (see 'load_into') without first unpickling a copy of the whole checkpoint.
+
+_DTYPES = {torch.float64: "F64", torch.float32: "F32", torch.float16: "F16", torch.bfloat16: "BF16",
+           torch.int64: "I64", torch.int32: "I32", torch.int16: "I16", torch.int8: "I8", torch.uint8: "U8",
+           torch.bool: "BOOL"}
+_DTYPE_NAMES = {name: dtype for dtype, name in _DTYPES.items()}
+# -the data of the tensors is written and memory-mapped with numpy (which has no bfloat16, so those tensors are stored
+#  as the upper 16 bits of their float32-values, which is exactly the bfloat16-format)
+_NUMPY_DTYPES = {torch.float64: np.float64, torch.float32: np.float32, torch.float16: np.float16,
+                 torch.int64: np.int64, torch.int32: np.int32, torch.int16: np.int16, torch.int8: np.int8,
+                 torch.uint8: np.uint8, torch.bool: np.bool_}
+
+
+def write_flat(state_dict, path):
+    '''Save [state_dict] (a <dict> with only <tensors>) to [path] in the flat format (see '_replace_atomic').'''
+    # -tensors with the largest elements first, so that (as the header is padded to a multiple of 8 bytes) each tensor
+    #  is aligned to its element-size in the file
+    tensors = sorted(state_dict.items(), key=lambda item: -item[1].element_size())
+    header, offset = {'__metadata__': {'format': "pt"}}, 0
+    for name, tensor in tensors:
+        n_bytes = tensor.element_size() * tensor.nelement()
+        header[name] = {'dtype': _DTYPES[tensor.dtype], 'shape': list(tensor.shape),
+                        'data_offsets': [offset, offset+n_bytes]}
+        offset += n_bytes
+    header = json.dumps(header).encode('utf-8')
+    header += b' ' * (-len(header) % 8)
+    def write_fn(f):
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for _, tensor in tensors:
+            f.write(_tensor_bytes(tensor).data)
+    _replace_atomic(path, write_fn)
+
+
+def _flat_header_size(path):
+    '''Return size of the header if [path] is in the flat format, otherwise return None.'''
+    with open(path, 'rb') as f:
+        start = f.read(9)
+    if len(start)<9 or start[8:9]!=b'{':
+        return None
+    header_size = struct.unpack('<Q', start[:8])[0]
+    return header_size if 8+header_size<=os.path.getsize(path) else None
+
+
+def read_flat(path):
+    '''Return <dict> with the tensors of the flat-format file at [path], which share the (copy-on-write)
+    memory-mapped data of the file.'''
+    header_size = _flat_header_size(path)
+    with open(path, 'rb') as f:
+        f.seek(8)
+        header = json.loads(f.read(header_size).decode('utf-8'))
+    header.pop('__metadata__', None)
+    start = 8 + header_size
+    return {name: _map_tensor(path, start+info['data_offsets'][0], _DTYPE_NAMES[info['dtype']], info['shape'])
+            for name, info in header.items()}
+
+
+def _tensor_bytes(tensor):
+    '''Return the data of [tensor] as (flat) <np-array> of bytes.'''
+    tensor = tensor.detach().cpu().contiguous()
+    if tensor.dtype==torch.bfloat16:
+        return (tensor.float().numpy().reshape(-1).view(np.uint32) >> 16).astype(np.uint16).view(np.uint8)
+    return tensor.numpy().reshape(-1).view(np.uint8)
+
+
+def _map_tensor(path, offset, dtype, shape):
+    '''Return <tensor> with [dtype] and [shape] whose data is memory-mapped (copy-on-write) from the file at [path],
+    starting at byte [offset] (for bfloat16-tensors, the data is copied).'''
+    n = int(np.prod(shape))
+    if n==0:
+        return torch.empty(shape, dtype=dtype)
+    if dtype==torch.bfloat16:
+        bits = np.memmap(path, mode='r', dtype=np.uint16, offset=offset, shape=(n,))
+        return torch.from_numpy((bits.astype(np.uint32) << 16).view(np.float32)).to(torch.bfloat16).reshape(shape)
+    return torch.from_numpy(np.memmap(path, mode='c', dtype=_NUMPY_DTYPES[dtype], offset=offset, shape=(n,))).reshape(
+        shape
+    )
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+# Checkpoints can also be stored as a small json-manifest, with the data of each tensor in a separate "blob"-file that is
+# named after the hash of its content. Blobs are shared by all checkpoints using the same blob-directory, so tensors that
+# are the same in many checkpoints (e.g., frozen pretrained layers, or SI-buffers equal to the parameters they were
+# copied from) are stored only once.
+
+MANIFEST_FORMAT = "blobs-v1"
+
+
+def _blob_path(blob_dir, digest):
+    return os.path.join(blob_dir, digest[:2], digest)
+
+
+def _write_blob(tensor, blob_dir):
+    '''Store data of [tensor] in [blob_dir] (if not there yet) and return the name (=hash) of its blob.'''
+    data = _tensor_bytes(tensor)
+    digest = hashlib.blake2b(data, digest_size=20).hexdigest()
+    path = _blob_path(blob_dir, digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "{}.tmp{}-{}".format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(data.data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)    #--> if another process wrote the same blob in the meantime, content is the same
+    return digest
+
+
+def _to_manifest(obj, blob_dir):
+    if isinstance(obj, torch.Tensor):
+        return {'__tensor__': _write_blob(obj, blob_dir), 'dtype': str(obj.dtype).replace("torch.", ""),
+                'shape': list(obj.shape)}
+    if isinstance(obj, dict):
+        return {key: _to_manifest(value, blob_dir) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_to_manifest(value, blob_dir) for value in obj]
+    return obj
+
+
+def _from_manifest(obj, blob_dir, read_tensor):
+    if isinstance(obj, dict):
+        if '__tensor__' in obj:
+            return read_tensor(_blob_path(blob_dir, obj['__tensor__']), getattr(torch, obj['dtype']), obj['shape'])
+        return {key: _from_manifest(value, blob_dir, read_tensor) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_from_manifest(value, blob_dir, read_tensor) for value in obj]
+    return obj
+
+
+def _read_tensor(path, dtype, shape):
+    return _map_tensor(path, 0, dtype, shape)
+
+
+def write_manifest(obj, path, blob_dir):
+    '''Save [obj] (a (nested) <dict> or <list> with <tensors> and json-serializable values) as json-manifest at [path],
+    with the data of its tensors in (shared) content-addressed blobs in [blob_dir].'''
+    manifest = {'format': MANIFEST_FORMAT, 'blob_dir': os.path.relpath(blob_dir, os.path.dirname(path) or '.'),
+                'content': _to_manifest(obj, blob_dir)}
+    _replace_atomic(path, lambda f: f.write(json.dumps(manifest).encode('utf-8')))
+
+
+def is_manifest(path):
+    with open(path, 'rb') as f:
+        return f.read(1)==b'{'
+
+
+def read_manifest(path):
+    '''Return <dict> with "blob_dir" (absolute path) and "content" (with references to the blobs) of manifest [path].'''
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('format')!=MANIFEST_FORMAT:
+        raise ValueError("Unknown checkpoint-format in '{}': {}".format(path, manifest.get('format')))
+    manifest['blob_dir'] = os.path.join(os.path.dirname(os.path.abspath(path)), manifest['blob_dir'])
+    return manifest
+
+
+def load(path):
+    '''Load checkpoint at [path], which is saved in the flat format (see 'write_flat'), as manifest (see
+    'write_manifest') or with 'torch.save'. The tensors of the first two are memory-mapped.'''
+    if _flat_header_size(path) is not None:
+        return {'state': read_flat(path)}
+    if is_manifest(path):
+        manifest = read_manifest(path)
+        return _from_manifest(manifest['content'], manifest['blob_dir'], _read_tensor)
+    return torch.load(path)
+
+
+def load_into(model, path):
+    '''Copy the 'state' of the checkpoint at [path] into the parameters and buffers of [model].
+
+    As the tensors of flat and manifest checkpoints are memory-mapped, they are copied directly from the file into the
+    existing storage of [model]. Buffers that are in the checkpoint but not yet in [model] (e.g., the SI- or EWC-buffers
+    that are added to the model after each task) are created with the shape and dtype stored in the checkpoint.'''
+    state = load(path)['state']
+    own_state = model.state_dict(keep_vars=True)
+    missing = [key for key in own_state if key not in state]
+    unexpected = [key for key in state if (key not in own_state) and ("." in key)]
+    mismatched = [key for key in state if (key in own_state) and (own_state[key].shape!=state[key].shape)]
+    if len(missing)>0 or len(unexpected)>0 or len(mismatched)>0:
+        raise RuntimeError("Error(s) in loading checkpoint '{}' into {}: missing keys {}, unexpected keys {}, size "
+                           "mismatch for {}".format(path, model.__class__.__name__, missing, unexpected, mismatched))
+    device = next(iter(own_state.values())).device if len(own_state)>0 else torch.device('cpu')
+    with torch.no_grad():
+        for key, value in state.items():
+            if key in own_state:
+                own_state[key].copy_(value)
+            else:
+                model.register_buffer(key, torch.empty(value.shape, dtype=value.dtype, device=device).copy_(value))
+
+
+def _referenced_blobs(obj):
+    if isinstance(obj, dict):
+        if '__tensor__' in obj:
+            return {obj['__tensor__']}
+        return set().union(*[_referenced_blobs(value) for value in obj.values()])
+    if isinstance(obj, list):
+        return set().union(*[_referenced_blobs(value) for value in obj])
+    return set()
+
+
+def remove_unreferenced_blobs(manifest_dir, blob_dir=None, dry_run=False):
+    '''Delete all blobs in [blob_dir] (default: "[manifest_dir]/blobs") that are not referenced by any manifest in
+    [manifest_dir]. Only run this when no checkpoints are being saved into these directories!'''
+    blob_dir = os.path.join(manifest_dir, 'blobs') if blob_dir is None else blob_dir
+    referenced = set()
+    for name in os.listdir(manifest_dir):
+        path = os.path.join(manifest_dir, name)
+        if os.path.isfile(path) and is_manifest(path):
+            manifest = read_manifest(path)
+            if os.path.samefile(manifest['blob_dir'], blob_dir):
+                referenced |= _referenced_blobs(manifest['content'])
+    removed = removed_bytes = 0
+    for sub_dir in os.listdir(blob_dir):
+        for digest in os.listdir(os.path.join(blob_dir, sub_dir)):
+            if digest not in referenced:
+                path = os.path.join(blob_dir, sub_dir, digest)
+                removed += 1
+                removed_bytes += os.path.getsize(path)
+                if not dry_run:
+                    os.remove(path)
+    print(" --> {} {} unreferenced blobs ({:.1f} MB) from {}".format(
+        "found" if dry_run else "removed", removed, removed_bytes/1024.**2, blob_dir
+    ))
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+class CheckpointWriter(object):
+    '''Saves checkpoints on a separate thread, so training does not have to wait while they are written to disk.
+
+    When a checkpoint is submitted, a copy of all its tensors is made on the cpu (for tensors on the GPU into pinned
+    buffers, which are reused for subsequent checkpoints), after which training can continue. The copy is then written
+    to disk with 'write_atomic'. Checkpoints can be part of a [series] (e.g., the checkpoints of one model at different
+    iterations), of which only the last [keep_last] files are kept.
+
+    Errors while writing a checkpoint are raised (on the training thread) at the next call of 'save', 'wait' or
+    'close'.'''
+
+    def __init__(self, keep_last=None, max_pending=2, blob_dir=None):
+        '''[keep_last]      None or <int>, for each series only keep the [keep_last] most recently saved files
+        [max_pending]    <int>, max # of checkpoints waiting to be written (if reached, 'save' blocks until one is
+                                written; this bounds the memory used by the copies)
+        [blob_dir]       None or <str>, if provided, checkpoints are saved as manifest (see 'write_manifest'); note
+                                that the blobs of removed checkpoints are not deleted (see 'remove_unreferenced_blobs')'''
+        self.keep_last = keep_last
+        self.blob_dir = blob_dir
+        self.jobs = queue.Queue(maxsize=max_pending)
+        self.pinned = {}
+        self.series = {}
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _copy(self, obj, key=()):
+        '''Return copy of [obj] (a (nested) <dict>, <list> or <tuple> with <tensors>) with all tensors on the cpu.'''
+        if isinstance(obj, torch.Tensor):
+            obj = obj.detach()
+            if not obj.is_cuda:
+                return obj.clone()
+            buffer = self.pinned.get(key)
+            if (buffer is None) or (buffer.shape!=obj.shape) or (buffer.dtype!=obj.dtype):
+                buffer = torch.empty(obj.shape, dtype=obj.dtype, pin_memory=True)
+                self.pinned[key] = buffer
+            buffer.copy_(obj, non_blocking=True)
+            return buffer
+        if isinstance(obj, dict):
+            return type(obj)((k, self._copy(v, key+(k,))) for k, v in obj.items())
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._copy(v, key+(i,)) for i, v in enumerate(obj))
+        return obj
+
+    def save(self, obj, path, series=None, flat=False):
+        '''Write [obj] (e.g., a <dict> with a 'state_dict') to [path] in the background.
+
+        [series]        None or <str>, name of the series this checkpoint belongs to (see [keep_last])
+        [flat]          <bool>, write [obj] (which then should be a 'state_dict') in the flat format (unless the
+                                checkpoints are saved as manifests)'''
+        self._raise_error()
+        if len(self.pinned)>0:
+            self.wait()    #--> pinned buffers can only be reused once the previous checkpoint has been written
+        obj = self._copy(obj)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        self.jobs.put((obj, path, series, flat))
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                break
+            obj, path, series, flat = job
+            try:
+                if self.blob_dir is not None:
+                    write_manifest({'state': obj} if flat else obj, path, self.blob_dir)
+                elif flat:
+                    write_flat(obj, path)
+                else:
+                    write_atomic(obj, path)
+                if series is not None:
+                    self._apply_retention(series, path)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.jobs.task_done()
+
+    def _apply_retention(self, series, path):
+        paths = [p for p in self.series.get(series, []) if p!=path] + [path]
+        if self.keep_last is not None:
+            while len(paths)>self.keep_last:
+                old_path = paths.pop(0)
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+        self.series[series] = paths
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def wait(self):
+        '''Block until all submitted checkpoints are written.'''
+        self.jobs.join()
+        self._raise_error()
+
+    def close(self):
+        '''Write all submitted checkpoints and stop the writing thread.'''
+        self.jobs.put(None)
+        self.thread.join()
+        self._raise_error()
+
+
+if __name__ == '__main__':
+    # Delete unreferenced blobs (usage: python checkpoint.py gc MODEL_DIR [BLOB_DIR] [--dry-run])
+    if len(sys.argv)<3 or sys.argv[1]!="gc":
+        print("usage: python checkpoint.py gc MODEL_DIR [BLOB_DIR] [--dry-run]")
+        sys.exit(1)
+    dirs = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+    remove_unreferenced_blobs(dirs[0], blob_dir=dirs[1] if len(dirs)>1 else None, dry_run="--dry-run" in sys.argv)
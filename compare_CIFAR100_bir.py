@@ -5,6 +5,7 @@ from param_stamp import get_param_stamp_from_args
 import options
 from visual import plt
 import main_cl
+from runner import ExperimentRunner
 
 
 
@@ -105,10 +106,11 @@ def collect_all(method_dict, seed_list, args, name=None, no_gen=False):
     # -print name of method on screen
     if name is not None:
         print("\n------{}------".format(name))
-    # -run method for all random seeds
+    # -run (or, with multiple workers, queue) method for all random seeds
     for seed in seed_list:
         args.seed = seed
-        method_dict[seed] = get_results(args) if no_gen else get_gen_results(args)
+        experiment_runner.submit(get_results if no_gen else get_gen_results, args, method_dict, seed,
+                                 result_file="prec-{}.txt" if no_gen else None)
     # -return updated dictionary with results
     return method_dict
 
@@ -196,6 +198,9 @@ if __name__ == '__main__':
     ## Load input-arguments & set default values
     args = handle_inputs()
 
+    ## Set up the runner of the experiments (which with multiple workers are run in parallel)
+    experiment_runner = ExperimentRunner(workers=args.workers, threads_per_job=args.threads_per_job)
+
     # --------------------------------------------------------------------------------#
 
     # Hard-coded, selected hyper-parameter values (obtained by running `./compare_CIFAR100_hyperParams --per-bir-comp`)
@@ -359,6 +364,10 @@ if __name__ == '__main__':
     args.distill = False
 
 
+    ## Wait until all experiments are finished
+    experiment_runner.finish()
+
+
     #-------------------------------------------------------------------------------------------------#
 
     #---------------------------#
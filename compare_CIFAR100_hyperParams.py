@@ -6,6 +6,7 @@ import options
 from visual import plt as my_plt
 from matplotlib.pyplot import get_cmap
 import main_cl
+from runner import ExperimentRunner
 
 
 
@@ -66,6 +67,9 @@ if __name__ == '__main__':
     ## Load input-arguments & set default values
     args = handle_inputs()
 
+    ## Set up the runner of the experiments (which with multiple workers are run in parallel)
+    experiment_runner = ExperimentRunner(workers=args.workers, threads_per_job=args.threads_per_job)
+
     ## Add default arguments (will be different for different runs)
     args.ewc = False
     args.online = False
@@ -90,14 +94,15 @@ if __name__ == '__main__':
     #--------------------------#
 
     ## Baselline
-    BASE = get_result(args)
+    BASE = {}
+    experiment_runner.submit(get_result, args, BASE, 'base', result_file="prec-{}.txt")
 
     ## EWC
     EWC = {}
     args.ewc = True
     for ewc_lambda in lamda_list:
         args.ewc_lambda=ewc_lambda
-        EWC[ewc_lambda] = get_result(args)
+        experiment_runner.submit(get_result, args, EWC, ewc_lambda, result_file="prec-{}.txt")
     args.ewc = False
 
     ## Online EWC
@@ -109,7 +114,7 @@ if __name__ == '__main__':
         args.gamma = gamma
         for ewc_lambda in lamda_list:
             args.ewc_lambda = ewc_lambda
-            OEWC[gamma][ewc_lambda] = get_result(args)
+            experiment_runner.submit(get_result, args, OEWC[gamma], ewc_lambda, result_file="prec-{}.txt")
     args.ewc = False
     args.online = False
 
@@ -118,7 +123,7 @@ if __name__ == '__main__':
     args.si = True
     for si_c in c_list:
         args.si_c = si_c
-        SI[si_c] = get_result(args)
+        experiment_runner.submit(get_result, args, SI, si_c, result_file="prec-{}.txt")
     args.si = False
 
     ## XdG
@@ -127,7 +132,7 @@ if __name__ == '__main__':
         args.xdg = True
         for xdg in xdg_list:
             args.xdg_prop = xdg
-            XDG[xdg] = get_result(args)
+            experiment_runner.submit(get_result, args, XDG, xdg, result_file="prec-{}.txt")
         args.xdg = False
 
     ## Brain-inspired Replay
@@ -142,7 +147,7 @@ if __name__ == '__main__':
     args.freeze_convE = True
     for dg_prop in dg_prop_list_onlybir:
         args.dg_prop = dg_prop
-        BIR[dg_prop] = get_result(args)
+        experiment_runner.submit(get_result, args, BIR, dg_prop, result_file="prec-{}.txt")
 
     ## Brain-inspired Replay with SI
     BIR_SI = {}
@@ -152,7 +157,7 @@ if __name__ == '__main__':
         for si_c in [0]+c_list:
             args.si_c = si_c
             args.si = True if si_c>0 else False
-            BIR_SI[dg_prop][si_c] = get_result(args)
+            experiment_runner.submit(get_result, args, BIR_SI[dg_prop], si_c, result_file="prec-{}.txt")
 
 
     ## If requested, also perform gridsearch for addition- and ablation-experiments
@@ -164,7 +169,7 @@ if __name__ == '__main__':
         args.feedback = False
         for dg_prop in dg_prop_list_onlybir:
             args.dg_prop = dg_prop
-            BIR_no_RTF[dg_prop] = get_result(args)
+            experiment_runner.submit(get_result, args, BIR_no_RTF, dg_prop, result_file="prec-{}.txt")
         args.feedback = True
 
         ## BI-R without conditional replay
@@ -173,7 +178,7 @@ if __name__ == '__main__':
         args.per_class = False
         for dg_prop in dg_prop_list_onlybir:
             args.dg_prop = dg_prop
-            BIR_no_CON[dg_prop] = get_result(args)
+            experiment_runner.submit(get_result, args, BIR_no_CON, dg_prop, result_file="prec-{}.txt")
         args.prior = "GMM"
         args.per_class = True
 
@@ -182,7 +187,7 @@ if __name__ == '__main__':
         args.hidden = False
         for dg_prop in dg_prop_list_onlybir:
             args.dg_prop = dg_prop
-            BIR_no_INT[dg_prop] = get_result(args)
+            experiment_runner.submit(get_result, args, BIR_no_INT, dg_prop, result_file="prec-{}.txt")
         args.hidden = True
 
         ## BI-R without distillation
@@ -190,7 +195,7 @@ if __name__ == '__main__':
         args.distill = False
         for dg_prop in dg_prop_list_onlybir:
             args.dg_prop = dg_prop
-            BIR_no_DIS[dg_prop] = get_result(args)
+            experiment_runner.submit(get_result, args, BIR_no_DIS, dg_prop, result_file="prec-{}.txt")
         args.distill = False
 
 
@@ -205,8 +210,12 @@ if __name__ == '__main__':
         args.freeze_convE = False
         for dg_prop in dg_prop_list_onlybir:
             args.dg_prop = dg_prop
-            GR_plus_GAT[dg_prop] = get_result(args)
+            experiment_runner.submit(get_result, args, GR_plus_GAT, dg_prop, result_file="prec-{}.txt")
+
 
+    ## Wait until all experiments are finished
+    experiment_runner.finish()
+    BASE = BASE['base']
 
 
     #-------------------------------------------------------------------------------------------------#
@@ -6,6 +6,7 @@ import options
 from visual import plt as my_plt
 from matplotlib.pyplot import get_cmap
 import main_cl
+from runner import ExperimentRunner
 
 
 ## Parameter-values to compare
@@ -61,6 +62,9 @@ if __name__ == '__main__':
     ## Load input-arguments & set default values
     args = handle_inputs()
 
+    ## Set up the runner of the experiments (which with multiple workers are run in parallel)
+    experiment_runner = ExperimentRunner(workers=args.workers, threads_per_job=args.threads_per_job)
+
     ## Add default arguments (will be different for different runs)
     args.ewc = False
     args.online = False
@@ -82,14 +86,15 @@ if __name__ == '__main__':
     #--------------------------#
 
     ## Baselline
-    BASE = get_result(args)
+    BASE = {}
+    experiment_runner.submit(get_result, args, BASE, 'base', result_file="prec-{}.txt")
 
     ## EWC
     EWC = {}
     args.ewc = True
     for ewc_lambda in lamda_list:
         args.ewc_lambda=ewc_lambda
-        EWC[ewc_lambda] = get_result(args)
+        experiment_runner.submit(get_result, args, EWC, ewc_lambda, result_file="prec-{}.txt")
     args.ewc = False
 
     ## Online EWC
@@ -101,7 +106,7 @@ if __name__ == '__main__':
         args.gamma = gamma
         for ewc_lambda in lamda_list:
             args.ewc_lambda = ewc_lambda
-            OEWC[gamma][ewc_lambda] = get_result(args)
+            experiment_runner.submit(get_result, args, OEWC[gamma], ewc_lambda, result_file="prec-{}.txt")
     args.ewc = False
     args.online = False
 
@@ -110,7 +115,7 @@ if __name__ == '__main__':
     args.si = True
     for si_c in c_list:
         args.si_c = si_c
-        SI[si_c] = get_result(args)
+        experiment_runner.submit(get_result, args, SI, si_c, result_file="prec-{}.txt")
     args.si = False
 
     ## XdG
@@ -119,9 +124,15 @@ if __name__ == '__main__':
         args.xdg = True
         for xdg in xdg_list:
             args.xdg_prop = xdg
-            XDG[xdg] = get_result(args)
+            experiment_runner.submit(get_result, args, XDG, xdg, result_file="prec-{}.txt")
         args.xdg_prop = 0.
 
+
+    ## Wait until all experiments are finished
+    experiment_runner.finish()
+    BASE = BASE['base']
+
+
     #-------------------------------------------------------------------------------------------------#
 
     #-----------------------------------------#
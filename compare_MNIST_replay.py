@@ -5,6 +5,7 @@ from param_stamp import get_param_stamp_from_args
 import options
 from visual import plt
 import main_cl
+from runner import ExperimentRunner
 
 
 ## Function for specifying input-options and organizing / checking them
@@ -56,10 +57,10 @@ def collect_all(method_dict, seed_list, args, name=None):
     # -print name of method on screen
     if name is not None:
         print("\n------{}------".format(name))
-    # -run method for all random seeds
+    # -run (or, with multiple workers, queue) method for all random seeds
     for seed in seed_list:
         args.seed = seed
-        method_dict[seed] = get_result(args)
+        experiment_runner.submit(get_result, args, method_dict, seed, result_file="prec-{}.txt")
     # -return updated dictionary with results
     return method_dict
 
@@ -70,6 +71,9 @@ if __name__ == '__main__':
     ## Load input-arguments & set default values
     args = handle_inputs()
 
+    ## Set up the runner of the experiments (which with multiple workers are run in parallel)
+    experiment_runner = ExperimentRunner(workers=args.workers, threads_per_job=args.threads_per_job)
+
     ## Add default arguments (will be different for different runs)
     args.replay = "generatie"
     args.reinit = False
@@ -178,6 +182,10 @@ if __name__ == '__main__':
 
 
 
+    ## Wait until all experiments are finished
+    experiment_runner.finish()
+
+
     #-------------------------------------------------------------------------------------------------#
 
     #--------------------#
@@ -6,6 +6,7 @@ from param_stamp import get_param_stamp_from_args
 import utils
 from visual import plt
 import main_cl
+from runner import ExperimentRunner
 
 
 
@@ -58,10 +59,10 @@ def collect_all(method_dict, seed_list, args, name=None):
     # -print name of method on screen
     if name is not None:
         print("\n------{}------".format(name))
-    # -run method for all random seeds
+    # -run (or, with multiple workers, queue) method for all random seeds
     for seed in seed_list:
         args.seed = seed
-        method_dict[seed] = get_results(args)
+        experiment_runner.submit(get_results, args, method_dict, seed, result_file="dict-{}.pkl")
     # -return updated dictionary with results
     return method_dict
 
@@ -72,6 +73,9 @@ if __name__ == '__main__':
     ## Load input-arguments & set default values
     args = handle_inputs()
 
+    ## Set up the runner of the experiments (which with multiple workers are run in parallel)
+    experiment_runner = ExperimentRunner(workers=args.workers, threads_per_job=args.threads_per_job)
+
     ## Store gating proportion for decoder-gates
     gating_prop = args.dg_prop
     args.dg_prop = 0
@@ -174,6 +178,10 @@ if __name__ == '__main__':
     BIRpSI = collect_all(BIRpSI, seed_list, args, name="BI-R + SI")
 
 
+    ## Wait until all experiments are finished
+    experiment_runner.finish()
+
+
     #-------------------------------------------------------------------------------------------------#
 
     #---------------------------#
@@ -6,6 +6,7 @@ import options
 import utils
 from visual import plt
 import main_cl
+from runner import ExperimentRunner
 
 
 ## Function for specifying input-options and organizing / checking them
@@ -53,10 +54,10 @@ def collect_all(method_dict, seed_list, args, name=None):
     # -print name of method on screen
     if name is not None:
         print("\n------{}------".format(name))
-    # -run method for all random seeds
+    # -run (or, with multiple workers, queue) method for all random seeds
     for seed in seed_list:
         args.seed = seed
-        method_dict[seed] = get_results(args)
+        experiment_runner.submit(get_results, args, method_dict, seed, result_file="prec-{}.txt")
     # -return updated dictionary with results
     return method_dict
 
@@ -118,6 +119,9 @@ if __name__ == '__main__':
     ## Load input-arguments & set default values
     args = handle_inputs()
 
+    ## Set up the runner of the experiments (which with multiple workers are run in parallel)
+    experiment_runner = ExperimentRunner(workers=args.workers, threads_per_job=args.threads_per_job)
+
     # --------------------------------------------------------------------------------#
 
     # Selected hyper-parameter values (obtained by running `./compare_permMNIST100_hyperParams --per-bir-comp`)
@@ -250,6 +254,10 @@ if __name__ == '__main__':
     args.distill = False
 
 
+    ## Wait until all experiments are finished
+    experiment_runner.finish()
+
+
     #-------------------------------------------------------------------------------------------------#
 
     #---------------------------#
@@ -6,6 +6,7 @@ import options
 from visual import plt as my_plt
 from matplotlib.pyplot import get_cmap
 import main_cl
+from runner import ExperimentRunner
 
 
 ## Parameter-values to compare
@@ -62,6 +63,9 @@ if __name__ == '__main__':
     ## Load input-arguments & set default values
     args = handle_inputs()
 
+    ## Set up the runner of the experiments (which with multiple workers are run in parallel)
+    experiment_runner = ExperimentRunner(workers=args.workers, threads_per_job=args.threads_per_job)
+
     ## Add default arguments (will be different for different runs)
     args.ewc = False
     args.online = False
@@ -81,14 +85,15 @@ if __name__ == '__main__':
 
 
     ## Baselline
-    BASE = get_result(args)
+    BASE = {}
+    experiment_runner.submit(get_result, args, BASE, 'base', result_file="prec-{}.txt")
 
     ## EWC
     EWC = {}
     args.ewc = True
     for ewc_lambda in lamda_list:
         args.ewc_lambda=ewc_lambda
-        EWC[ewc_lambda] = get_result(args)
+        experiment_runner.submit(get_result, args, EWC, ewc_lambda, result_file="prec-{}.txt")
     args.ewc = False
 
     ## Online EWC
@@ -100,7 +105,7 @@ if __name__ == '__main__':
         args.gamma = gamma
         for ewc_lambda in lamda_list:
             args.ewc_lambda = ewc_lambda
-            OEWC[gamma][ewc_lambda] = get_result(args)
+            experiment_runner.submit(get_result, args, OEWC[gamma], ewc_lambda, result_file="prec-{}.txt")
     args.ewc = False
     args.online = False
 
@@ -109,7 +114,7 @@ if __name__ == '__main__':
     args.si = True
     for si_c in c_list:
         args.si_c = si_c
-        SI[si_c] = get_result(args)
+        experiment_runner.submit(get_result, args, SI, si_c, result_file="prec-{}.txt")
     args.si = False
 
     ## Brain-inspired Replay (both with & without SI)
@@ -126,7 +131,7 @@ if __name__ == '__main__':
         for si_c in [0]+c_list:
             args.si_c = si_c
             args.si = True if si_c>0 else False
-            BIR[dg_prop][si_c] = get_result(args)
+            experiment_runner.submit(get_result, args, BIR[dg_prop], si_c, result_file="prec-{}.txt")
 
     ## If requested, also perform gridsearch for addition- and ablation-experiments
     if args.per_bir_comp:
@@ -137,7 +142,7 @@ if __name__ == '__main__':
         args.feedback = False
         for dg_prop in gating_list:
             args.dg_prop = dg_prop
-            BIR_no_RTF[dg_prop] = get_result(args)
+            experiment_runner.submit(get_result, args, BIR_no_RTF, dg_prop, result_file="prec-{}.txt")
 
         ## BI-R without conditional replay
         BIR_no_CON = {}
@@ -146,7 +151,7 @@ if __name__ == '__main__':
         args.per_class = False
         for dg_prop in gating_list:
             args.dg_prop = dg_prop
-            BIR_no_CON[dg_prop] = get_result(args)
+            experiment_runner.submit(get_result, args, BIR_no_CON, dg_prop, result_file="prec-{}.txt")
 
         ## BI-R without distillation
         BIR_no_DIS = {}
@@ -155,7 +160,7 @@ if __name__ == '__main__':
         args.distill = False
         for dg_prop in gating_list:
             args.dg_prop = dg_prop
-            BIR_no_DIS[dg_prop] = get_result(args)
+            experiment_runner.submit(get_result, args, BIR_no_DIS, dg_prop, result_file="prec-{}.txt")
 
         ## Standard Generative Replay (GR) plus gating based on internal context
         GR_plus_GAT = {}
@@ -166,7 +171,12 @@ if __name__ == '__main__':
         args.dg_gates = True
         for dg_prop in gating_list:
             args.dg_prop = dg_prop
-            GR_plus_GAT[dg_prop] = get_result(args)
+            experiment_runner.submit(get_result, args, GR_plus_GAT, dg_prop, result_file="prec-{}.txt")
+
+
+    ## Wait until all experiments are finished
+    experiment_runner.finish()
+    BASE = BASE['base']
 
 
     #-------------------------------------------------------------------------------------------------#
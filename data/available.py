@@ -1,5 +1,6 @@
 from torchvision import datasets, transforms
 from data.manipulate import UnNormalize
+from data.synthetic import SynthMNIST, SynthCIFAR10, SynthCIFAR100
 
 
 # Specify available data-sets
@@ -7,6 +8,10 @@ AVAILABLE_DATASETS = {
     'mnist': datasets.MNIST,
     'cifar10': datasets.CIFAR10,
     'cifar100': datasets.CIFAR100,
+    # -synthetic substitutes (generated on the fly, so no download needed)
+    'synthmnist': SynthMNIST,
+    'synthcifar10': SynthCIFAR10,
+    'synthcifar100': SynthCIFAR100,
 }
 
 
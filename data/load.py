@@ -6,11 +6,11 @@ from data.available import AVAILABLE_DATASETS, AVAILABLE_TRANSFORMS, DATASET_CON
 from data.manipulate import ReducedDataset, SubDataset, TransformedDataset, permutate_image_pixels
 
 def get_dataset(name, type='train', download=True, capacity=None, permutation=None, dir='./store/datasets',
-                verbose=False, augment=False, normalize=False, target_transform=None, valid_prop=0.):
-    '''Create [train|valid|test]-dataset.'''
+                verbose=False, augment=False, normalize=False, target_transform=None, valid_prop=0., synthetic=False):
+    '''Create [train|valid|test]-dataset (if [synthetic], with synthetic images of the same shape; see data/synthetic.py).'''
 
     data_name = 'mnist' if name in ('mnist28') else name
-    dataset_class = AVAILABLE_DATASETS[data_name]
+    dataset_class = AVAILABLE_DATASETS["synth"+data_name if synthetic else data_name]
 
     # specify image-transformations to be applied
     transforms_list = [*AVAILABLE_TRANSFORMS['augment']] if augment else []
@@ -40,7 +40,9 @@ def get_dataset(name, type='train', download=True, capacity=None, permutation=No
 
     # print information about dataset on the screen
     if verbose:
-        print(" --> {}: '{}'-dataset consisting of {} samples".format(name, type, len(dataset)))
+        print(" --> {}{}: '{}'-dataset consisting of {} samples".format(
+            "synthetic " if synthetic else "", name, type, len(dataset)
+        ))
 
     # if dataset is (possibly) not large enough, create copies until it is.
     if capacity is not None and len(dataset) < capacity:
@@ -53,7 +55,8 @@ def get_dataset(name, type='train', download=True, capacity=None, permutation=No
 ##-------------------------------------------------------------------------------------------------------------------##
 
 
-def get_singletask_experiment(name, data_dir="./store/datasets", normalize=False, augment=False, verbose=False):
+def get_singletask_experiment(name, data_dir="./store/datasets", normalize=False, augment=False, verbose=False,
+                              synthetic=False):
     '''Load, organize and return train- and test-dataset for requested single-task experiment.'''
 
     # Define data-type
@@ -73,16 +76,18 @@ def get_singletask_experiment(name, data_dir="./store/datasets", normalize=False
     config['normalize'] = normalize
     if normalize:
         config['denormalize'] = AVAILABLE_TRANSFORMS[data_type+"_denorm"]
-    trainset = get_dataset(data_type, type='train', dir=data_dir, verbose=verbose, normalize=normalize, augment=augment)
-    testset = get_dataset(data_type, type='test', dir=data_dir, verbose=verbose, normalize=normalize)
+    trainset = get_dataset(data_type, type='train', dir=data_dir, verbose=verbose, normalize=normalize, augment=augment,
+                           synthetic=synthetic)
+    testset = get_dataset(data_type, type='test', dir=data_dir, verbose=verbose, normalize=normalize, synthetic=synthetic)
 
     # Return tuple of data-sets and config-dictionary
     return (trainset, testset), config
 
 
 def get_multitask_experiment(name, scenario, tasks, data_dir="./store/datasets", normalize=False, augment=False,
-                             only_config=False, verbose=False, exception=False, only_test=False):
-    '''Load, organize and return train- and test-dataset for requested multi-task experiment.'''
+                             only_config=False, verbose=False, exception=False, only_test=False, synthetic=False):
+    '''Load, organize and return train- and test-dataset for requested multi-task experiment.
+    If [synthetic], synthetic images with the same shapes and number of classes are used (see data/synthetic.py).'''
 
     ## NOTE: option 'normalize' and 'augment' only implemented for CIFAR-based experiments.
 
@@ -95,9 +100,9 @@ def get_multitask_experiment(name, scenario, tasks, data_dir="./store/datasets",
             # prepare dataset
             if not only_test:
                 train_dataset = get_dataset('mnist', type="train", permutation=None, dir=data_dir,
-                                            target_transform=None, verbose=verbose)
+                                            target_transform=None, verbose=verbose, synthetic=synthetic)
             test_dataset = get_dataset('mnist', type="test", permutation=None, dir=data_dir,
-                                       target_transform=None, verbose=verbose)
+                                       target_transform=None, verbose=verbose, synthetic=synthetic)
             # generate permutations
             if exception:
                 permutations = [None] + [np.random.permutation(config['size']**2) for _ in range(tasks-1)]
@@ -133,9 +138,9 @@ def get_multitask_experiment(name, scenario, tasks, data_dir="./store/datasets",
             # prepare train and test datasets with all classes
             if not only_test:
                 mnist_train = get_dataset('mnist28', type="train", dir=data_dir, target_transform=target_transform,
-                                          verbose=verbose)
+                                          verbose=verbose, synthetic=synthetic)
             mnist_test = get_dataset('mnist28', type="test", dir=data_dir, target_transform=target_transform,
-                                     verbose=verbose)
+                                     verbose=verbose, synthetic=synthetic)
             # generate labels-per-task
             labels_per_task = [
                 list(np.array(range(classes_per_task)) + classes_per_task * task_id) for task_id in range(tasks)
@@ -164,9 +169,10 @@ def get_multitask_experiment(name, scenario, tasks, data_dir="./store/datasets",
             # prepare train and test datasets with all classes
             if not only_test:
                 cifar100_train = get_dataset('cifar100', type="train", dir=data_dir, normalize=normalize,
-                                             augment=augment, target_transform=target_transform, verbose=verbose)
+                                             augment=augment, target_transform=target_transform, verbose=verbose,
+                                             synthetic=synthetic)
             cifar100_test = get_dataset('cifar100', type="test", dir=data_dir, normalize=normalize,
-                                        target_transform=target_transform, verbose=verbose)
+                                        target_transform=target_transform, verbose=verbose, synthetic=synthetic)
             # generate labels-per-task
             labels_per_task = [
                 list(np.array(range(classes_per_task)) + classes_per_task * task_id) for task_id in range(tasks)
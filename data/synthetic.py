@@ -0,0 +1,94 @@
+import numpy as np
+from PIL import Image
+from torch.utils.data import Dataset
+
+
+class SyntheticImages(Dataset):
+    '''Dataset with class-structured synthetic images, which can be used instead of the torchvision-datasets (with the
+    same arguments) when the real data is not available (e.g., for tests and benchmarks on nodes without internet).
+
+    For each class, a prototype image is made from a few random Gaussian blobs. Each image is its class's prototype,
+    randomly shifted and scaled in intensity, plus pixel-noise. Everything is generated deterministically from [seed];
+    the prototypes and labels are made when the dataset is created, the images only when they are requested.'''
+
+    size = 32
+    channels = 1
+    classes = 10
+    train_samples = 60000
+    test_samples = 10000
+
+    def __init__(self, root=None, train=True, download=False, transform=None, target_transform=None, seed=0,
+                 n_samples=None):
+        '''[root] and [download] are ignored (they are only there to have the same signature as torchvision-datasets)
+
+        [seed]          <int>, seed from which the prototypes, labels and images are generated
+        [n_samples]     None or <int>, number of images (if None, as many as in the real dataset)'''
+        super().__init__()
+        self.train = train
+        self.transform = transform
+        self.target_transform = target_transform
+        self.seed = seed
+        n_samples = (self.train_samples if train else self.test_samples) if n_samples is None else n_samples
+        # -class-prototypes (shared by the train- and test-set)
+        self.prototypes = self._make_prototypes(np.random.RandomState(seed))
+        # -balanced labels in random order (different for the train- and test-set)
+        targets = np.arange(n_samples) % self.classes
+        np.random.RandomState([seed, 1 if train else 2]).shuffle(targets)
+        self.targets = targets.tolist()
+
+    def _make_prototypes(self, rng, n_blobs=4):
+        '''Return <np-array> [classes]x[size]x[size]x[channels] with values in [0,1].'''
+        grid = np.arange(self.size, dtype=np.float32)
+        centers = rng.uniform(0.2*self.size, 0.8*self.size, size=(self.classes, n_blobs, 2, 1, 1))
+        widths = rng.uniform(0.05*self.size, 0.15*self.size, size=(self.classes, n_blobs, 1, 1))
+        colors = rng.uniform(0.3, 1., size=(self.classes, n_blobs, 1, 1, self.channels))
+        blobs = np.exp(-((grid[:, None]-centers[:, :, 0])**2 + (grid[None, :]-centers[:, :, 1])**2) / (2*widths**2))
+        prototypes = (blobs[..., None] * colors).sum(axis=1)
+        if self.channels>1:
+            prototypes += rng.uniform(0., 0.5, size=(self.classes, 1, 1, self.channels))   #--> background color
+        return (prototypes / prototypes.max(axis=(1, 2, 3), keepdims=True)).astype(np.float32)
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        rng = np.random.default_rng([self.seed, 1 if self.train else 2, index])
+        target = self.targets[index]
+        shift = rng.integers(-2, 3, size=2)
+        image = np.roll(self.prototypes[target], shift=tuple(shift), axis=(0, 1)) * rng.uniform(0.8, 1.2)
+        image = image + rng.normal(0., 0.1, size=image.shape)
+        # -a 2D uint8-array becomes a grey-scale ("L") image and a 3D uint8-array with 3 channels an "RGB" image
+        image = (np.clip(image, 0., 1.)*255).astype(np.uint8)
+        image = Image.fromarray(image[:, :, 0] if self.channels==1 else image)
+        if self.transform is not None:
+            image = self.transform(image)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return image, target
+
+
+class SynthMNIST(SyntheticImages):
+    '''Synthetic substitute for MNIST (28x28 grey-scale images, 10 classes).'''
+    size = 28
+    channels = 1
+    classes = 10
+    train_samples = 60000
+    test_samples = 10000
+
+
+class SynthCIFAR10(SyntheticImages):
+    '''Synthetic substitute for CIFAR-10 (32x32 colour images, 10 classes).'''
+    size = 32
+    channels = 3
+    classes = 10
+    train_samples = 50000
+    test_samples = 10000
+
+
+class SynthCIFAR100(SyntheticImages):
+    '''Synthetic substitute for CIFAR-100 (32x32 colour images, 100 classes).'''
+    size = 32
+    channels = 3
+    classes = 100
+    train_samples = 50000
+    test_samples = 10000
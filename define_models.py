@@ -179,3 +179,85 @@ def init_params(model, args):
     return model
 
 ##-------------------------------------------------------------------------------------------------------------------##
+
+## Function for defining the main model of a continual learning experiment (as used by main_cl.py)
+def define_main_model(args, config, device, verbose=True):
+    '''Define main model (i.e., classifier, if requested with feedback connections) and initialize its parameters, set
+    its optimizer(s) and the settings of the chosen regularization-, allocation- and replay-based CL-strategies.'''
+    # -import required libraries
+    from itertools import chain
+    from torch import optim
+    from models.cl.continual_learner import ContinualLearner
+
+    # Define main model
+    if checkattr(args, 'feedback'):
+        model = define_autoencoder(args=args, config=config, device=device)
+    else:
+        model = define_classifier(args=args, config=config, device=device)
+
+    # Initialize / use pre-trained / freeze model-parameters
+    # - initialize (pre-trained) parameters
+    model = init_params(model, args)
+    # - freeze weights of conv-layers?
+    if checkattr(args, "freeze_convE"):
+        for param in model.convE.parameters():
+            param.requires_grad = False
+    if checkattr(args, 'feedback') and checkattr(args, "freeze_convD"):
+        for param in model.convD.parameters():
+            param.requires_grad = False
+    ####
+    use_views = checkattr(args, 'contrastive')
+    use_attention = checkattr(args, 'attention')
+
+    if use_views:
+        for param in model.fcProj.parameters():
+            param.requires_grad = False
+
+    # Define optimizer (only optimize parameters that "requires_grad")
+    model.optim_list = [
+        {'params': filter(lambda p: p.requires_grad, model.parameters()), 'lr': args.lr},
+    ]
+    model.optimizer = optim.Adam(model.optim_list, betas=(0.9, 0.999))
+
+    #### Define encoder optimizer (only optimize the encoder & MLP parameters)...
+    if use_views:
+        if use_attention:
+            attn_lr = args.contr_lr*(10**(-args.iters/1000))
+            model.E_optim_list = [
+                {'params': chain(model.fcE.parameters(), model.fcProj.parameters(), model.predictor.parameters(), model.multihead_attn.parameters(), model.E_attn.parameters()),
+                 'lr': attn_lr},
+                ]
+
+        else:
+            model.E_optim_list = [
+                {'params': chain(model.fcE.parameters(), model.fcProj.parameters(), model.predictor.parameters()), 'lr': args.contr_lr},
+                ]
+        if verbose:
+            print(' Contrastive LR =', args.contr_lr)
+        model.E_optimizer = optim.Adam(model.E_optim_list, betas=(0.9, 0.999), weight_decay=args.weight_decay)
+
+    # Elastic Weight Consolidation (EWC)
+    if isinstance(model, ContinualLearner) and checkattr(args, 'ewc'):
+        model.ewc_lambda = args.ewc_lambda if args.ewc else 0
+        model.fisher_n = args.fisher_n
+        model.online = checkattr(args, 'online')
+        if model.online:
+            model.gamma = args.gamma
+
+    # Synpatic Intelligence (SI)
+    if isinstance(model, ContinualLearner) and checkattr(args, 'si'):
+        model.si_c = args.si_c if args.si else 0
+        model.epsilon = args.epsilon
+
+    # XdG: create for every task a "mask" for each hidden fully connected layer
+    if isinstance(model, ContinualLearner) and checkattr(args, 'xdg') and args.xdg_prop>0:
+        model.define_XdGmask(gating_prop=args.xdg_prop, n_tasks=args.tasks)
+
+    # Use distillation loss (i.e., soft targets) for replayed data? (and set temperature)
+    if isinstance(model, ContinualLearner) and hasattr(args, 'replay') and not args.replay=="none":
+        model.replay_targets = "soft" if args.distill else "hard"
+        model.KD_temp = args.temp
+
+    return model
+
+##-------------------------------------------------------------------------------------------------------------------##
@@ -0,0 +1,105 @@
+import copy
+import queue
+import threading
+import torch
+
+
+class AsyncEvaluator(object):
+    '''Runs evaluation callbacks on a separate thread, on a replica of the model into which a snapshot of the model's
+    weights (taken at the iteration at which the callbacks were triggered) is loaded. This way training does not have to
+    wait while the model is being evaluated. Jobs are processed one by one in the order in which they were submitted, so
+    results are added to [precision_dict] and sent to the loggers in iteration order.
+
+    NOTE: only callbacks with an "is_due"-attribute (see eval/callbacks.py) are run asynchronously, and only if they
+          are due at the current iteration; other callbacks are simply called with the model being trained.
+          Callbacks with a "plot_finished"-attribute (e.g., the latent-space callback) do not plot on the evaluation
+          thread; their 'plot_finished' is instead called on the training thread by 'submit' and 'wait'.
+
+    Errors raised by a callback are raised (on the training thread) at the next call of 'submit', 'wait' or 'close'.
+
+    The evaluation does not use the global random number generators, which are shared with the training thread (so
+    that with a given seed, training gives the same result with or without asynchronous evaluation): the callbacks get
+    the evaluator's own <torch.Generator> as [rng] to select test-samples with, and each replica gets its own seeded
+    sampling-generator (which in eval()-mode is also used for the reparameterization, see 'AutoEncoder.reparameterize').
+    The evaluation does share the device with training, so on a GPU both run at the same time on the same device.'''
+
+    def __init__(self, max_pending=2, seed=0):
+        '''[max_pending]    <int>, max # of submitted jobs waiting to be run (if reached, submitting blocks until
+                                    a job is finished; this bounds the memory used by the weight-snapshots)
+        [seed]          <int>, seed for the random number generators used for evaluation'''
+        self.seed = seed
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed)
+        self.jobs = queue.Queue(maxsize=max_pending)
+        self.replicas = {}
+        self.plotting = {}    #--> callbacks whose results are plotted on the training thread (see 'plot_finished')
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _snapshot(self, model):
+        '''Return replica of [model] and a CPU-copy of its current state.'''
+        state = {key: value.detach().to('cpu', copy=True) for key, value in model.state_dict().items()}
+        replica = self.replicas.get(id(model))
+        # -(re)create the replica if needed (e.g., if SI-buffers have been added to [model] since last time)
+        if (replica is None) or (set(replica.state_dict().keys()) != set(state.keys())):
+            # -the optimizers (e.g., 'optimizer' and 'E_optimizer') and their states are not needed for evaluation
+            memo = {id(value): None for value in vars(model).values() if isinstance(value, torch.optim.Optimizer)}
+            replica = copy.deepcopy(model, memo)
+            if hasattr(replica, 'sample_generator'):
+                replica.sample_generator = torch.Generator(device=replica._device())
+                replica.sample_generator.manual_seed(self.seed + len(self.replicas) + 1)
+            self.replicas[id(model)] = replica
+        return replica, state
+
+    def submit(self, model, callbacks, batch, **kwargs):
+        '''Evaluate all [callbacks] that are due at iteration [batch] on a snapshot of [model].'''
+        self._raise_error()
+        callbacks = [cb for cb in callbacks if cb is not None]
+        due = [cb for cb in callbacks if hasattr(cb, 'is_due') and cb.is_due(batch, **kwargs)]
+        for cb in callbacks:
+            if not hasattr(cb, 'is_due'):
+                cb(model, batch, **kwargs)
+            elif hasattr(cb, 'plot_finished'):
+                self.plotting[id(cb)] = cb
+        self._plot_finished()
+        if len(due)>0:
+            replica, state = self._snapshot(model)
+            self.jobs.put((replica, state, due, batch, kwargs))
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                break
+            replica, state, callbacks, batch, kwargs = job
+            try:
+                replica.load_state_dict(state)
+                for cb in callbacks:
+                    cb(replica, batch, rng=self.generator, **kwargs)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.jobs.task_done()
+
+    def _plot_finished(self):
+        for cb in self.plotting.values():
+            cb.plot_finished()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def wait(self):
+        '''Block until all submitted jobs are finished.'''
+        self.jobs.join()
+        self._plot_finished()
+        self._raise_error()
+
+    def close(self):
+        '''Finish all submitted jobs and stop the evaluation thread.'''
+        self.jobs.put(None)
+        self.thread.join()
+        self._raise_error()
@@ -1,3 +1,7 @@
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+import torch
 import visual.visdom
 from . import evaluate
 from torch.utils.data import ConcatDataset
@@ -13,12 +17,17 @@ def _sample_cb(log, config, visdom=None, pdf=None, test_datasets=None, sample_si
 
     [test_datasets]     None or <list> of <Datasets> (if provided, also reconstructions are shown)'''
 
-    def sample_cb(generator, batch, task=1, epoch=None, allowed_classes=None, **kwargs):
-        '''Callback-function, to evaluate sample (and reconstruction) ability of the model.'''
-
+    def is_due(batch, task=1, **kwargs):
+        '''Whether the callback-function should be evaluated at this iteration.'''
         iteration = batch if task==1 else (task-1)*iters_per_task + batch
+        return iteration % log == 0
+
+    def sample_cb(generator, batch, task=1, epoch=None, allowed_classes=None, rng=None, **kwargs):
+        '''Callback-function, to evaluate sample (and reconstruction) ability of the model.
+
+        [rng]   None or <torch.Generator> to select the examples to reconstruct with (if None, the global one is used)'''
 
-        if iteration % log == 0:
+        if is_due(batch, task=task):
             statement = " after {} iters{}{}".format(batch, "" if epoch is None else " (epoch {})".format(epoch),
                                                      "" if iters_per_task is None else " in task {}".format(task))
 
@@ -26,7 +35,7 @@ def _sample_cb(log, config, visdom=None, pdf=None, test_datasets=None, sample_si
             if test_datasets is not None:
                 # Reconstruct samples from current task
                 evaluate.show_reconstruction(generator, test_datasets[task-1], config, size=int(sample_size/2),
-                                             pdf=pdf, visdom=visdom, epoch=epoch, task=task)
+                                             pdf=pdf, visdom=visdom, epoch=epoch, task=task, generator=rng)
 
             # Generate samples
             evaluate.show_samples(generator, config, pdf=pdf, visdom=visdom, size=sample_size,
@@ -34,30 +43,40 @@ def _sample_cb(log, config, visdom=None, pdf=None, test_datasets=None, sample_si
                                   title="Generated images{}".format(statement))
 
     # Return the callback-function (except if neither visdom or pdf is selected!)
+    sample_cb.is_due = is_due
     return sample_cb if ((visdom is not None) or (pdf is not None)) else None
 
 
 
 def _eval_cb(log, test_datasets, visdom=None, precision_dict=None, iters_per_task=None, test_size=None,
-             classes_per_task=None, scenario="none"):
+             classes_per_task=None, scenario="none", test_cache=None):
     '''Initiates function for evaluating performance of classifier (in terms of precision).
 
     [test_datasets]     <list> of <Datasets>; also if only 1 task, it should be presented as a list!
     [classes_per_task]  <int> number of "active" classes per task
-    [scenario]          <str> how to decide which classes to include during evaluating precision'''
+    [scenario]          <str> how to decide which classes to include during evaluating precision
+    [test_cache]        None or <dict> with cached test-data (see 'evaluate.cache_test_sets') to evaluate on'''
+
+    def is_due(batch, task=1, **kwargs):
+        '''Whether the callback-function should be evaluated at this iteration.'''
+        iteration = batch if task==1 else (task-1)*iters_per_task + batch
+        return iteration % log == 0
+
+    def eval_cb(classifier, batch, task=1, rng=None, **kwargs):
+        '''Callback-function, to evaluate performance of classifier.
 
-    def eval_cb(classifier, batch, task=1, **kwargs):
-        '''Callback-function, to evaluate performance of classifier.'''
+        [rng]   None or <torch.Generator> to select the test-samples with (if None, the global one is used)'''
 
         iteration = batch if task==1 else (task-1)*iters_per_task + batch
 
         # evaluate the solver on multiple tasks (and log to visdom)
-        if iteration % log == 0:
+        if is_due(batch, task=task):
             evaluate.precision(classifier, test_datasets, task, iteration,
                                classes_per_task=classes_per_task, scenario=scenario, precision_dict=precision_dict,
-                               test_size=test_size, visdom=visdom)
+                               test_size=test_size, visdom=visdom, cache=test_cache, generator=rng)
 
     ## Return the callback-function (except if neither visdom or [precision_dict] is selected!)
+    eval_cb.is_due = is_due
     return eval_cb if ((visdom is not None) or (precision_dict is not None)) else None
 
 
@@ -68,25 +87,107 @@ def _eval_cb(log, test_datasets, visdom=None, precision_dict=None, iters_per_tas
 ## Callback-functions for visualing statistics of the model ##
 ##############################################################
 
-def _latent_space_cb(log, datasets, visdom=None, pdf=None, sample_size=400, iters_per_task=None):
+class _InlineExecutor(object):
+    '''Executor that runs submitted functions immediately on the calling thread (and returns their result as <Future>).'''
+
+    def submit(self, function, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def _latent_space_cb(log, datasets, visdom=None, pdf=None, sample_size=400, iters_per_task=None, per_class=None,
+                     method="tsne", background=True):
     '''Initiates function for visualizing final layer features of a classifier or VAE.
 
     [log]          <int>, indicating after how many iterations the callback-function should be evaluated
-    [datasets]     <list> of <Datasets>'''
+    [datasets]     <list> of <Datasets>
+    [per_class]    None or <int>, max number of points to show per class
+    [method]       <str>, how to project features to 2 dimensions ("tsne", "pca" or "random")
+    [background]   <bool>, if True, the projection is done in a background process, so that training is not blocked
+                     (if the previous projection is not yet finished, this one is skipped); its result is plotted by
+                     the next call of the callback-function after it finished, or by 'latent_space_cb.plot_finished()'
+                     or 'latent_space_cb.close()' (which should be called before [pdf] is closed)
+
+    NOTE: plotting only happens on the thread that created the callback-function (i.e., the training thread). If the
+          callback-function is run on another thread (e.g., by the <AsyncEvaluator> of eval/async_eval.py, which calls
+          'latent_space_cb.plot_finished()' on the training thread), it only computes the projection.'''
+
+    pool = None
+    pending = None     #--> <tuple> (<Future>, labels) of the projection running in the background (if any)
+    owner = threading.current_thread()
+    lock = threading.Lock()
+
+    def plot_finished(wait=False):
+        '''Plot the projection running in the background if it is finished (or, if [wait], once it is finished).'''
+        nonlocal pending
+        if threading.current_thread() is not owner:
+            return
+        with lock:
+            if pending is None or not (wait or pending[0].done()):
+                return
+            future, y = pending
+            pending = None
+        try:
+            z_2d = future.result()
+        except Exception as e:
+            print("Projection of latent space failed ({}: {})".format(type(e).__name__, e))
+            return
+        evaluate.plot_latent_space(z_2d, y=y, visdom=visdom, pdf=pdf)
+
+    def close():
+        '''Wait for the projection running in the background (if any), plot it and shut down the background process.'''
+        nonlocal pool
+        plot_finished(wait=True)
+        if pool is not None:
+            pool.shutdown()
+            pool = None
+
+    def is_due(batch, task=1, **kwargs):
+        '''Whether the callback-function should be evaluated at this iteration.'''
+        iteration = batch if task==1 else (task-1)*iters_per_task + batch
+        return iteration % log == 0
 
-    def latent_space_cb(model, batch, task=1, **kwargs):
-        '''Callback-function, to visualize latent space of the model.'''
+    def latent_space_cb(model, batch, task=1, rng=None, **kwargs):
+        '''Callback-function, to visualize latent space of the model.
 
-        iteration = batch if task==1 else (task-1)*iters_per_task + batch
+        [rng]   None or <torch.Generator> to select the samples to show with (if None, the global one is used)'''
+        nonlocal pool, pending
+
+        # -plot the previous projection, if it has finished in the meantime
+        plot_finished()
 
-        if iteration % log == 0:
+        if is_due(batch, task=task):
+            # -never queue up projections: if the previous one is still running, skip this one
+            if pending is not None:
+                return
             dataset = ConcatDataset(datasets[:task])
-            loader = utils.get_data_loader(dataset, batch_size=sample_size, cuda=model._is_on_cuda(), drop_last=True)
+            loader = utils.get_data_loader(dataset, batch_size=sample_size, cuda=model._is_on_cuda(), drop_last=True,
+                                           generator=rng)
             X,y = next(iter(loader))
-            evaluate.visualize_latent_space(model, X.to(model._device()), y=y.to(model._device()), visdom=visdom,
-                                            pdf=pdf)
+            # -if requested, only keep (at most) [per_class] points of each class
+            if per_class is not None:
+                keep = torch.zeros_like(y, dtype=torch.bool)
+                for class_id in y.unique():
+                    keep[(y==class_id).nonzero().view(-1)[:per_class]] = True
+                X, y = X[keep], y[keep]
+            if background and pool is None:
+                pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+            # -if not in the background and not on the training thread, compute the projection here but plot it later
+            executor = pool if (background or threading.current_thread() is owner) else _InlineExecutor()
+            future = evaluate.visualize_latent_space(model, X.to(model._device()), y=y.to(model._device()),
+                                                     visdom=visdom, pdf=pdf, method=method, pool=executor)
+            if future is not None:
+                with lock:
+                    pending = (future, y.numpy())
 
     # Return the callback-function (except if neither visdom or pdf is selected!)
+    latent_space_cb.is_due = is_due
+    latent_space_cb.plot_finished = plot_finished
+    latent_space_cb.close = close
     return latent_space_cb if ((visdom is not None) or (pdf is not None)) else None
 
 
@@ -101,7 +202,7 @@ def _solver_loss_cb(log, visdom, model=None, tasks=None, iters_per_task=None, ep
                     progress_bar=True):
     '''Initiates function for keeping track of, and reporting on, the progress of the solver's training.'''
 
-    def cb(bar, iter, loss_dict, task=1, epoch=None):
+    def loss_cb(bar, iter, loss_dict, task=1, epoch=None):
         '''Callback-function, to call on every iteration to keep track of training progress.'''
 
         iteration = iter if task==1 else (task-1)*iters_per_task + iter
@@ -147,7 +248,7 @@ def _solver_loss_cb(log, visdom, model=None, tasks=None, iters_per_task=None, ep
             )
 
     # Return the callback-function.
-    return cb
+    return loss_cb
 
 
 
@@ -155,7 +256,7 @@ def _VAE_loss_cb(log, visdom, model, tasks=None, iters_per_task=None, epochs=Non
                  progress_bar=True):
     '''Initiates functions for keeping track of, and reporting on, the progress of the generator's training.'''
 
-    def cb(bar, iter, loss_dict, task=1, epoch=None):
+    def loss_cb(bar, iter, loss_dict, task=1, epoch=None):
         '''Callback-function, to perform on every iteration to keep track of training progress.'''
 
         iteration = iter if task==1 else (task-1)*iters_per_task + iter
@@ -219,4 +320,4 @@ def _VAE_loss_cb(log, visdom, model, tasks=None, iters_per_task=None, epochs=Non
             )
 
     # Return the callback-function
-    return cb
\ No newline at end of file
+    return loss_cb
\ No newline at end of file
@@ -13,11 +13,12 @@ import utils
 ####-----------------------------####
 
 def validate(model, dataset, batch_size=128, test_size=1024, verbose=True, allowed_classes=None,
-             no_task_mask=False, task=None):
+             no_task_mask=False, task=None, generator=None):
     '''Evaluate precision (= accuracy or proportion correct) of a classifier ([model]) on [dataset].
 
     [allowed_classes]   None or <list> containing all "active classes" between which should be chosen
-                            (these "active classes" are assumed to be contiguous)'''
+                            (these "active classes" are assumed to be contiguous)
+    [generator]         None or <torch.Generator> to select the test-samples with (see 'utils.get_data_loader')'''
 
     # Get device-type / using cuda?
     device = model._device()
@@ -34,7 +35,7 @@ def validate(model, dataset, batch_size=128, test_size=1024, verbose=True, allow
             model.apply_XdGmask(task=task)
 
     # Loop over batches in [dataset]
-    data_loader = utils.get_data_loader(dataset, batch_size, cuda=cuda)
+    data_loader = utils.get_data_loader(dataset, batch_size, cuda=cuda, generator=generator)
     total_tested = total_correct = 0
     for data, labels in data_loader:
         # -break on [test_size] (if "None", full dataset is used)
@@ -59,6 +60,118 @@ def validate(model, dataset, batch_size=128, test_size=1024, verbose=True, allow
     return precision
 
 
+def cache_test_sets(datasets, pin_memory=False, batch_size=128):
+    '''Make a single pass over each <Dataset> in [datasets] and cache them as (concatenated) in-memory tensors. The
+    cache is kept in CPU-memory (if [pin_memory], in page-locked memory for fast copies to the GPU); the batches are
+    moved to the device of the model when evaluating (see 'precision_per_task').
+
+    OUTPUT: <dict> with [X] and [y] (inputs and labels of all tasks), [task_ids] (task of each datapoint, starting
+            from 0), [n_per_task] (<tensor> with # of datapoints per task) and [start] (<list> with index where each
+            task starts, with one extra entry for the end of the last task)'''
+    X, y, task_ids, start = [], [], [], [0]
+    for task_id, dataset in enumerate(datasets):
+        X_task, y_task = utils.cache_dataset(dataset, batch_size=batch_size)
+        X.append(X_task)
+        y.append(y_task)
+        task_ids.append(torch.full((len(y_task),), task_id, dtype=torch.long))
+        start.append(start[-1] + len(y_task))
+    task_ids = torch.cat(task_ids)
+    return {'X': _pin(torch.cat(X), pin_memory), 'y': _pin(torch.cat(y), pin_memory),
+            'task_ids': _pin(task_ids, pin_memory), 'n_per_task': torch.bincount(task_ids, minlength=len(datasets)),
+            'start': start}
+
+
+def _pin(tensor, pin_memory):
+    '''Return [tensor] in page-locked memory if [pin_memory] is True (and otherwise unchanged).'''
+    return tensor.pin_memory() if pin_memory else tensor
+
+
+def stratified_indices(labels, n, seed=0):
+    '''Select a fixed subset of [n] indices of [labels], stratified by class (using a generator seeded with [seed]).'''
+    generator = torch.Generator().manual_seed(seed)
+    labels = labels.cpu()
+    classes, counts = labels.unique(return_counts=True)
+    # -number of indices per class, proportional to frequency of that class (with largest remainders rounded up)
+    quota = counts.double() * n / len(labels)
+    n_per_class = quota.floor().long()
+    n_per_class[torch.argsort(quota - n_per_class, descending=True)[:(n - n_per_class.sum().item())]] += 1
+    indices = []
+    for class_id, n_class in zip(classes, n_per_class):
+        class_indices = (labels==class_id).nonzero().view(-1)
+        indices.append(class_indices[torch.randperm(len(class_indices), generator=generator)[:n_class]])
+    return torch.cat(indices).sort()[0]
+
+
+def subsample_test_cache(cache, test_size, seed=0):
+    '''Return a copy of [cache] (see 'cache_test_sets') with for each task a fixed, class-stratified subset of (at
+    most) [test_size] datapoints. As this subset is selected only once, successive evaluations are comparable.'''
+    indices, start = [], [0]
+    for task_id in range(len(cache['start'])-1):
+        first, last = cache['start'][task_id], cache['start'][task_id+1]
+        task_indices = torch.arange(first, last) if (last-first)<=test_size else first + stratified_indices(
+            cache['y'][first:last], test_size, seed=seed+task_id
+        )
+        indices.append(task_indices)
+        start.append(start[-1] + len(task_indices))
+    indices = torch.cat(indices)
+    pin_memory = cache['X'].is_pinned()
+    task_ids = cache['task_ids'][indices]
+    return {'X': _pin(cache['X'][indices], pin_memory), 'y': _pin(cache['y'][indices], pin_memory),
+            'task_ids': _pin(task_ids, pin_memory), 'n_per_task': torch.bincount(task_ids, minlength=len(start)-1),
+            'start': start}
+
+
+def precision_per_task(model, cache, current_task, classes_per_task=None, scenario="none", batch_size=512,
+                       no_task_mask=False):
+    '''Evaluate precision of a classifier ([model]) on all tasks so far (= up to [current_task]) using [cache] (as
+    returned by 'cache_test_sets'). Unless task-specific XdG-masks are needed, all tasks so far are evaluated together
+    in large batches, with the "active classes" for each datapoint selected via a precomputed mask.
+
+    OUTPUT: <list> with for each task so far its precision'''
+
+    # Set model to eval()-mode, and get the device to which the cached batches are to be moved
+    model.eval()
+    device = model._device()
+
+    # Precompute, for each task, which classes are allowed to be chosen between (if None, all classes are allowed)
+    n_classes = None
+    if scenario in ('task', 'class'):
+        n_classes = classes_per_task * (len(cache['start']) - 1)
+        allowed = torch.zeros(current_task, n_classes, dtype=torch.bool, device=device)
+        for i in range(current_task):
+            if scenario=='task':
+                allowed[i, (classes_per_task*i):(classes_per_task*(i+1))] = True
+            else:
+                allowed[i, :(classes_per_task*current_task)] = True
+
+    # Evaluate all tasks so far together (or, if a task-specific XdG-mask is to be used, each task separately)
+    if (model.mask_dict is not None) and (not no_task_mask):
+        chunks = [(i+1, cache['start'][i], cache['start'][i+1]) for i in range(current_task)]
+    else:
+        if model.mask_dict is not None:
+            model.reset_XdGmask()
+        chunks = [(None, 0, cache['start'][current_task])]
+
+    correct = []
+    for task, first, last in chunks:
+        if task is not None:
+            model.apply_XdGmask(task=task)
+        for index in range(first, last, batch_size):
+            data = cache['X'][index:min(index+batch_size, last)].to(device, non_blocking=True)
+            labels = cache['y'][index:min(index+batch_size, last)].to(device, non_blocking=True)
+            task_ids = cache['task_ids'][index:min(index+batch_size, last)].to(device, non_blocking=True)
+            with torch.no_grad():
+                scores = model.classify(data, not_hidden=True)
+                if n_classes is not None:
+                    scores = scores[:, :n_classes].masked_fill(~allowed[task_ids], -float('inf'))
+                _, predicted = torch.max(scores, 1)
+            correct.append(task_ids[predicted == labels])
+
+    # Count for each task the number of correctly classified datapoints
+    n_correct = torch.bincount(torch.cat(correct), minlength=current_task)[:current_task].cpu()
+    return (n_correct.double() / cache['n_per_task'][:current_task].double()).tolist()
+
+
 def initiate_precision_dict(n_tasks):
     '''Initiate <dict> with all precision-measures to keep track of.'''
     precision = {}
@@ -70,29 +183,38 @@ def initiate_precision_dict(n_tasks):
 
 
 def precision(model, datasets, current_task, iteration, classes_per_task=None, scenario="none",
-              precision_dict=None, test_size=None, visdom=None, verbose=False, no_task_mask=False):
+              precision_dict=None, test_size=None, visdom=None, verbose=False, no_task_mask=False, cache=None,
+              generator=None):
     '''Evaluate precision of a classifier (=[model]) on all tasks so far (= up to [current_task]) using [datasets].
 
     [precision_dict]    None or <dict> of all measures to keep track of, to which results will be appended to
     [classes_per_task]  <int> number of active classes er task
     [scenario]          <str> how to decide which classes to include during evaluating precision
-    [visdom]            None or <dict> with name of "graph" and "env" (if None, no visdom-plots are made)'''
+    [visdom]            None or <dict> with name of "graph" and "env" (if None, no visdom-plots are made)
+    [cache]             None or <dict> with cached test-data (see 'cache_test_sets'); if provided, this is used
+                            instead of [datasets] and [test_size]
+    [generator]         None or <torch.Generator> to select the test-samples with (see 'validate')'''
 
     # Evaluate accuracy of model predictions for all tasks so far (reporting "0" for future tasks)
     n_tasks = len(datasets)
-    precs = []
-    for i in range(n_tasks):
-        if i+1 <= current_task:
-            if scenario=='task':
-                allowed_classes = list(range(classes_per_task*i, classes_per_task*(i+1)))
-            elif scenario=='class':
-                allowed_classes = list(range(classes_per_task*(current_task)))
+    if cache is not None:
+        precs = precision_per_task(model, cache, current_task, classes_per_task=classes_per_task, scenario=scenario,
+                                   no_task_mask=no_task_mask) + [0] * (n_tasks - current_task)
+    else:
+        precs = []
+        for i in range(n_tasks):
+            if i+1 <= current_task:
+                if scenario=='task':
+                    allowed_classes = list(range(classes_per_task*i, classes_per_task*(i+1)))
+                elif scenario=='class':
+                    allowed_classes = list(range(classes_per_task*(current_task)))
+                else:
+                    allowed_classes = None
+                precs.append(validate(model, datasets[i], test_size=test_size, verbose=verbose,
+                                      allowed_classes=allowed_classes, no_task_mask=no_task_mask, task=i+1,
+                                      generator=generator))
             else:
-                allowed_classes = None
-            precs.append(validate(model, datasets[i], test_size=test_size, verbose=verbose,
-                                  allowed_classes=allowed_classes, no_task_mask=no_task_mask, task=i+1))
-        else:
-            precs.append(0)
+                precs.append(0)
     average_precs = sum(
         [precs[task_id] if task_id==0 else precs[task_id] for task_id in range(current_task)]
     ) / (current_task)
@@ -131,8 +253,37 @@ def precision(model, datasets, current_task, iteration, classes_per_task=None, s
 ####----VISUALIZE EXTRACTED REPRESENTATION----####
 ####------------------------------------------####
 
-def visualize_latent_space(model, X, y=None, visdom=None, pdf=None, verbose=False):
-    '''Show T-sne projection of feature representation used to classify from (with each class in different color).'''
+def embed_2d(features, method="tsne", seed=0):
+    '''Project [features] (<np-array>) to 2 dimensions, using t-SNE ("tsne"), PCA ("pca") or random projection ("random").
+    The latter two are cheap alternatives to t-SNE.'''
+    if features.shape[1]==2:
+        return features
+    if method=="tsne":
+        return manifold.TSNE(n_components=2, init='pca', random_state=seed).fit_transform(features)
+    centered = features - features.mean(axis=0)
+    if method=="pca":
+        _, _, components = np.linalg.svd(centered, full_matrices=False)
+        return centered.dot(components[:2].T)
+    return centered.dot(np.random.RandomState(seed).randn(features.shape[1], 2) / np.sqrt(2))
+
+
+def plot_latent_space(z_2d, y=None, visdom=None, pdf=None):
+    '''Plot 2D-embedding [z_2d] of feature representation (with each class in different color).'''
+    if pdf is not None:
+        visual.plt.add_to_pdf(pdf, 'plot_scatter', z_2d[:, 0], z_2d[:, 1], colors=y)
+    if visdom is not None:
+        message = ("Visualization of extracted representation")
+        visual.visdom.scatter_plot(z_2d, title="{} ({})".format(message, visdom["graph"]),
+                                   colors=y+1 if y is not None else y, env=visdom["env"])
+
+
+def visualize_latent_space(model, X, y=None, visdom=None, pdf=None, verbose=False, method="tsne", pool=None):
+    '''Show T-sne projection of feature representation used to classify from (with each class in different color).
+
+    [method]    <str> how to project to 2 dimensions (see 'embed_2d')
+    [pool]      None or <Executor>; if provided, only the feature representation is computed here and the projection
+                    is done by [pool], in which case the <Future> is returned and the caller should plot its result
+                    (using 'plot_latent_space') once it is finished'''
 
     # Set model to eval()-mode
     model.eval()
@@ -141,25 +292,18 @@ def visualize_latent_space(model, X, y=None, visdom=None, pdf=None, verbose=Fals
     if verbose:
         print("Computing feature space...")
     with torch.no_grad():
-        z_mean = model.feature_extractor(X)
+        z_mean = model.feature_extractor(X).cpu().numpy()
+    y = y.cpu().numpy() if (y is not None and hasattr(y, 'cpu')) else y
 
-    # Compute t-SNE embedding of latent space (unless z has 2 dimensions!)
-    if z_mean.size()[1]==2:
-        z_tsne = z_mean.cpu().numpy()
-    else:
-        if verbose:
-            print("Computing t-SNE embedding...")
-        tsne = manifold.TSNE(n_components=2, init='pca', random_state=0)
-        z_tsne = tsne.fit_transform(z_mean.cpu())
+    # Compute t-SNE embedding of latent space (unless z has 2 dimensions!), if requested in the background
+    if pool is not None:
+        return pool.submit(embed_2d, z_mean, method)
+    if verbose and z_mean.shape[1]>2:
+        print("Computing {} embedding...".format("t-SNE" if method=="tsne" else method))
+    z_2d = embed_2d(z_mean, method=method)
 
     # Plot images according to t-sne embedding
-    if pdf is not None:
-        figure = visual.plt.plot_scatter(z_tsne[:, 0], z_tsne[:, 1], colors=y)
-        pdf.savefig(figure)
-    if visdom is not None:
-        message = ("Visualization of extracted representation")
-        visual.visdom.scatter_plot(z_tsne, title="{} ({})".format(message, visdom["graph"]),
-                                   colors=y+1 if y is not None else y, env=visdom["env"])
+    plot_latent_space(z_2d, y=y, visdom=visdom, pdf=pdf)
 
 
 
@@ -207,8 +351,10 @@ def show_samples(model, config, pdf=None, visdom=None, size=32, sample_mode=None
 ####--------------------------------####
 
 def show_reconstruction(model, dataset, config, pdf=None, visdom=None, size=32, epoch=None, task=None,
-                        no_task_mask=False):
-    '''Plot reconstructed examples by an auto-encoder [model] on [dataset], either in [pdf] and/or in [visdom].'''
+                        no_task_mask=False, generator=None):
+    '''Plot reconstructed examples by an auto-encoder [model] on [dataset], either in [pdf] and/or in [visdom].
+
+    [generator]     None or <torch.Generator> to select the examples with (see 'utils.get_data_loader')'''
 
     # Get device-type / using cuda?
     cuda = model._is_on_cuda()
@@ -218,7 +364,7 @@ def show_reconstruction(model, dataset, config, pdf=None, visdom=None, size=32,
     model.eval()
 
     # Get data
-    data_loader = utils.get_data_loader(dataset, size, cuda=cuda)
+    data_loader = utils.get_data_loader(dataset, size, cuda=cuda, generator=generator)
     (data, labels) = next(iter(data_loader))
 
     # If needed, apply correct specific task-mask (for fully-connected hidden layers in encoder)
@@ -3,6 +3,8 @@
 """Calculates the Frechet Inception Distance (FID) to evalulate generative models.
 The FID metric calculates the distance (in a perceptual feature space) between two distributions of samples."""
 
+import hashlib
+import os
 import numpy as np
 from scipy import linalg
 
@@ -30,27 +32,95 @@ def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
 
     diff = mu1 - mu2
 
-    # Product might be almost singular
-    covmean, _ = linalg.sqrtm(sigma1.dot(sigma2), disp=False)
-    if not np.isfinite(covmean).all():
+    # Tr(sqrt(C_1*C_2)) equals Tr(sqrt(sqrt(C_1)*C_2*sqrt(C_1))), whereby the latter matrix is symmetric positive
+    # semi-definite; so rather than a general matrix square root, only two symmetric eigendecompositions are needed
+    tr_covmean = _trace_sqrt_product(sigma1, sigma2)
+    if not np.isfinite(tr_covmean):
         msg = ('fid calculation produces singular product; adding %s to diagonal of cov estimates') % eps
         print(msg)
         offset = np.eye(sigma1.shape[0]) * eps
-        covmean = linalg.sqrtm((sigma1 + offset).dot(sigma2 + offset))
-
-    # Numerical error might give slight imaginary component
-    if np.iscomplexobj(covmean):
-        if not np.allclose(np.diagonal(covmean).imag, 0, atol=1e-3):
-            m = np.max(np.abs(covmean.imag))
-            raise ValueError('Imaginary component {}'.format(m))
-        covmean = covmean.real
+        tr_covmean = _trace_sqrt_product(sigma1 + offset, sigma2 + offset)
 
     # Calculate and return the Frechet Distance
-    tr_covmean = np.trace(covmean)
     fd = diff.dot(diff) + np.trace(sigma1) + np.trace(sigma2) - 2*tr_covmean
     return fd
 
 
+def _trace_sqrt_product(sigma1, sigma2):
+    """Computes Tr(sqrt(sigma1*sigma2)) for symmetric positive semi-definite [sigma1] and [sigma2]."""
+    eigval, eigvec = linalg.eigh(sigma1)
+    sqrt_sigma1 = (eigvec * np.sqrt(np.clip(eigval, 0, None))).dot(eigvec.T)
+    eigval = linalg.eigvalsh(sqrt_sigma1.dot(sigma2).dot(sqrt_sigma1))
+    # -small negative eigenvalues are due to numerical error
+    return np.sum(np.sqrt(np.clip(eigval, 0, None)))
+
+
+class RunningStatistics(object):
+    """Keeps track of mean and covariance of embeddings that are provided in batches (using float64 and Welford's
+    algorithm, with each batch merged in at once), such that not all embeddings need to be kept in memory."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self.M2 = None
+
+    def update(self, batch):
+        n = len(batch)
+        if n==0:
+            return
+        batch = np.asarray(batch, dtype=np.float64).reshape(n, -1)
+        batch_mean = batch.mean(axis=0)
+        centered = batch - batch_mean
+        batch_M2 = centered.T.dot(centered)
+        if self.n==0:
+            self.mean, self.M2 = batch_mean, batch_M2
+        else:
+            delta = batch_mean - self.mean
+            total = self.n + n
+            self.mean = self.mean + delta * (n / total)
+            self.M2 += batch_M2 + np.outer(delta, delta) * (self.n * n / total)
+        self.n += n
+
+    @property
+    def cov(self):
+        return self.M2 / (self.n - 1)
+
+
+def reference_file(cache_dir, classifier_checkpoint, ref_data):
+    """Returns path of file for caching the statistics (and embeddings) of the reference data. Its name is based on the
+    content of the checkpoint of the classifier used for the embeddings and on a fingerprint of the reference data.
+
+    Args:
+      classifier_checkpoint: path to the checkpoint of the classifier used to embed the data.
+      ref_data: NumPy array (or CPU tensor) with the (non-embedded) reference data."""
+
+    checkpoint_hash = hashlib.sha1()
+    with open(classifier_checkpoint, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            checkpoint_hash.update(block)
+    data_hash = hashlib.sha1(np.ascontiguousarray(ref_data))
+    return os.path.join(cache_dir, "fid-ref-{}-{}.npz".format(checkpoint_hash.hexdigest()[:16],
+                                                              data_hash.hexdigest()[:16]))
+
+
+def load_reference(path):
+    """Returns (mean, covariance, embeddings) of the reference data cached in [path], or None if not available."""
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as ref:
+        return ref['mu'], ref['sigma'], ref['emb']
+
+
+def save_reference(path, stats, embeddings):
+    """Caches the [stats] (<RunningStatistics>) and [embeddings] of the reference data in [path]."""
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    # -write to temporary file first, so a partially written file is never used
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, mu=stats.mean, sigma=stats.cov, emb=embeddings.astype(np.float32))
+    os.replace(tmp_path, path)
+
+
 def calculate_fid_from_embedding(eval_data, ref_data):
     """Calculates the FID for provided embeddings of the generated data ('eval_data') & of the test data ('ref-data').
     
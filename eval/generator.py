@@ -0,0 +1,52 @@
+"""Functions for evaluating generative models using the embeddings and predictions of a pretrained classifier (which is
+used as substitute for the InceptionNet), as needed for the Inception Score (IS), the Frechet Inception Distance (FID)
+and Precision & Recall (PRD)."""
+
+import numpy as np
+from scipy.special import rel_entr
+import torch
+from torch.nn import functional as F
+from eval.fid import RunningStatistics
+
+
+def embed_batches(classifier, batches, total_n, from_hidden=False, with_probs=True):
+    '''Make a single pass of [classifier] over all batches in [batches], whereby for each batch the features and the
+    predicted class-probabilities are computed together (i.e., the logits are computed from the same features).
+
+    [batches]       <iterable> of <tensors> on the device of [classifier] (e.g., chunks from 'AutoEncoder.sample_iter')
+    [total_n]       <int> total number of datapoints in [batches] (used to preallocate the output)
+    [from_hidden]   <bool> whether the batches contain hidden feature representations (see 'feature_extractor')
+    [with_probs]    <bool> whether to also compute the predicted class-probabilities
+
+    OUTPUT: - [features]  <np-array> [total_n] x [feature_dim] (float32)
+            - [probs]     <np-array> [total_n] x [classes] (float32), or None if [with_probs] is False
+            - [stats]     <RunningStatistics> with mean and covariance of [features] (e.g., for FID)'''
+
+    features = probs = None
+    stats = RunningStatistics()
+    n_done = 0
+    for x in batches:
+        with torch.no_grad():
+            batch_features = classifier.feature_extractor(x, from_hidden=from_hidden)
+            batch_probs = F.softmax(classifier.classifier(batch_features), dim=1) if with_probs else None
+        n = batch_features.size(0)
+        # -preallocate the outputs once the dimensions are known
+        if features is None:
+            features = np.empty((total_n, batch_features.size(1)), dtype=np.float32)
+            if with_probs:
+                probs = np.empty((total_n, batch_probs.size(1)), dtype=np.float32)
+        features[n_done:(n_done+n)] = batch_features.cpu().numpy()
+        if with_probs:
+            probs[n_done:(n_done+n)] = batch_probs.cpu().numpy()
+        stats.update(features[n_done:(n_done+n)])
+        n_done += n
+    return features[:n_done], (probs[:n_done] if with_probs else None), stats
+
+
+def inception_score(probs):
+    '''Calculate the "Inception Score" (IS) from the predicted class-probabilities [probs] (<np-array> [n] x [classes])
+    of the generated samples, as exp(E_x[KL(p(y|x) || p(y))]), with the KL-divergences of all samples computed at once.'''
+    probs = np.asarray(probs, dtype=np.float64)
+    probs = probs / probs.sum(axis=1, keepdims=True)
+    py = probs.mean(axis=0, keepdims=True)
+    return np.exp(np.mean(rel_entr(probs, py).sum(axis=1)))
@@ -4,6 +4,10 @@
 Given a set of generated samples and samples from the test set, both embedded in some feature space (say, embeddings of
 Inception Net), it computes the precision and recall via the algorithm presented in [arxiv.org/abs/1806.00035]."""
 
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from matplotlib import pyplot as plt
 import numpy as np
 import sklearn.cluster
@@ -57,30 +61,68 @@ def compute_prd(eval_dist, ref_dist, num_angles=1001, epsilon=1e-10):
     return precision, recall
 
 
-def _cluster_into_bins(eval_data, ref_data, num_clusters):
-    """Clusters the union of the data points and returns the cluster distribution.
-    Clusters the union of [eval_data] and [ref_data] into [num_clusters] using minibatch k-means.
-    Then, for each cluster, it computes the number of points from [eval_data] and [ref_data].
-    Args:
-      eval_data:    NumPy array of data points from the distribution to be evaluated.
-      ref_data:     NumPy array of data points from the reference distribution.
-      num_clusters: Number of cluster centers to fit.
+def _fit_kmeans(data, num_clusters, seed):
+    """Fits minibatch k-means with [num_clusters] to [data] (a NumPy array, or path to .npy-file which is then memory-
+    mapped so that it is shared between processes rather than copied to each of them).
     Returns:
-      Two NumPy arrays, each of size [num_clusters], where i-th entry is number of points assigned to i-th cluster."""
+      Tuple with NumPy arrays of the cluster labels of the data points and of the cluster centers."""
+
+    data = np.load(data, mmap_mode='r') if isinstance(data, str) else data
+    kmeans = sklearn.cluster.MiniBatchKMeans(n_clusters=num_clusters, n_init=10, random_state=seed).fit(data)
+    return kmeans.labels_, kmeans.cluster_centers_
+
+
+def _run_kmeans(data, num_clusters, num_runs, n_workers=1):
+    """Runs [num_runs] independent instances of '_fit_kmeans' on [data], if [n_workers]>1 in a pool of processes.
+    Returns:
+      List with for each run the tuple returned by '_fit_kmeans'."""
+
+    seeds = [int(seed) for seed in np.random.randint(np.iinfo(np.int32).max, size=num_runs)]
+    if n_workers<=1:
+        return [_fit_kmeans(data, num_clusters, seed) for seed in seeds]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        data_file = os.path.join(tmp_dir, 'data.npy')
+        np.save(data_file, data)
+        with ProcessPoolExecutor(max_workers=min(n_workers, num_runs)) as pool:
+            return list(pool.map(_fit_kmeans, [data_file]*num_runs, [num_clusters]*num_runs, seeds))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
 
-    cluster_data = np.vstack([eval_data, ref_data])
-    kmeans = sklearn.cluster.MiniBatchKMeans(n_clusters=num_clusters, n_init=10)
-    labels = kmeans.fit(cluster_data).labels_
+def _to_bins(labels, num_clusters):
+    """Returns the (normalized) histogram of cluster [labels]."""
+    return np.histogram(labels, bins=num_clusters, range=[0, num_clusters], density=True)[0]
 
-    eval_labels = labels[:len(eval_data)]
-    ref_labels = labels[len(eval_data):]
 
-    eval_bins = np.histogram(eval_labels, bins=num_clusters, range=[0, num_clusters], density=True)[0]
-    ref_bins = np.histogram(ref_labels, bins=num_clusters, range=[0, num_clusters], density=True)[0]
-    return eval_bins, ref_bins
+def _assign_to_clusters(data, centers, batch_size=4096):
+    """Returns for each data point in [data] the index of the nearest of the cluster [centers]."""
+    centers_sq = (centers.astype(np.float64)**2).sum(axis=1)
+    labels = []
+    for i in range(0, len(data), batch_size):
+        batch = np.asarray(data[i:(i+batch_size)], dtype=np.float64)
+        labels.append(np.argmin(centers_sq[None, :] - 2*batch.dot(centers.T.astype(np.float64)), axis=1))
+    return np.concatenate(labels)
 
 
-def compute_prd_from_embedding(eval_data, ref_data, num_clusters=20, num_angles=1001, num_runs=10,enforce_balance=True):
+def _as_float_array(data):
+    """Returns [data] as NumPy array, keeping float32 data in float32 (other data is converted to float64)."""
+    data = np.asarray(data)
+    return data if data.dtype==np.float32 else data.astype(np.float64)
+
+
+def fit_reference_clusters(ref_data, num_clusters=20, num_runs=10, n_workers=1):
+    """Clusters [ref_data] (only) into [num_clusters], in [num_runs] independent runs. The resulting cluster centers can
+    be reused (see [ref_centers] in 'compute_prd_from_embedding') for repeated evaluations against the same reference.
+    Returns:
+      NumPy array of shape [num_runs, num_clusters, dim] with cluster centers of each run."""
+
+    runs = _run_kmeans(_as_float_array(ref_data), num_clusters, num_runs, n_workers=n_workers)
+    return np.stack([centers for _, centers in runs])
+
+
+def compute_prd_from_embedding(eval_data, ref_data, num_clusters=20, num_angles=1001, num_runs=10,enforce_balance=True,
+                               n_workers=1, ref_centers=None):
     """Computes PRD data from sample embeddings.
     The points from both distributions are mixed and then clustered. This leads to a pair of histograms of discrete
     distributions over the cluster centers on which the PRD algorithm is executed.
@@ -93,6 +135,9 @@ def compute_prd_from_embedding(eval_data, ref_data, num_clusters=20, num_angles=
       num_angles:   Number of angles for which to compute PRD. Must be in [3, 1e6]. The default value is 1001.
       num_runs:     Number of independent runs over which to average the PRD data.
       enforce_balance: If enabled, throws exception if [eval_data] and [ref_data] do not have the same length.
+      n_workers:    Number of processes over which the independent clustering runs are divided.
+      ref_centers:  None or NumPy array of cluster centers per run (from 'fit_reference_clusters'). If provided, no
+                    clustering is done, but all points are assigned to these (fixed) reference clusters.
     Returns:
       precision: NumPy array of shape [num_angles] with the precision for the different ratios.
       recall:    NumPy array of shape [num_angles] with the recall for the different ratios.
@@ -105,12 +150,23 @@ def compute_prd_from_embedding(eval_data, ref_data, num_clusters=20, num_angles=
             'exception, set enforce_balance to False (not recommended).' % (len(eval_data), len(ref_data))
         )
 
-    eval_data = np.array(eval_data, dtype=np.float64)
-    ref_data = np.array(ref_data, dtype=np.float64)
+    eval_data = _as_float_array(eval_data)
+    ref_data = _as_float_array(ref_data)
+
+    # Get for each run the cluster labels of all data points
+    if ref_centers is None:
+        cluster_data = np.vstack([eval_data, ref_data.astype(eval_data.dtype)])
+        labels = [labels for labels, _ in _run_kmeans(cluster_data, num_clusters, num_runs, n_workers=n_workers)]
+    else:
+        num_clusters = ref_centers.shape[1]
+        labels = [np.concatenate([_assign_to_clusters(eval_data, centers), _assign_to_clusters(ref_data, centers)])
+                  for centers in ref_centers]
+
     precisions = []
     recalls = []
-    for _ in range(num_runs):
-        eval_dist, ref_dist = _cluster_into_bins(eval_data, ref_data, num_clusters)
+    for run_labels in labels:
+        eval_dist = _to_bins(run_labels[:len(eval_data)], num_clusters)
+        ref_dist = _to_bins(run_labels[len(eval_data):], num_clusters)
         precision, recall = compute_prd(eval_dist, ref_dist, num_angles)
         precisions.append(precision)
         recalls.append(recall)
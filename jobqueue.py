@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+# Local job-queue for sweeps of 'main_cl.py'-runs. The queue is stored in a SQLite-database, so it survives restarts
+# of the workers (and of the node): jobs that were running when their worker died are put back in the queue when a
+# worker is started again (and, if they save a resumable training-state with --checkpoint, they continue from there).
+#
+# usage:  ./jobqueue.py add -- --experiment=splitMNIST --scenario=class ...   (add a run of main_cl.py to the queue)
+#         ./jobqueue.py work --workers 4 --threads-per-job 2 --max-mem-mb 8000  (run all queued jobs)
+#         ./jobqueue.py status                                                 (overview of all jobs)
+#         ./jobqueue.py inspect ID                                             (details and log of a job)
+#         ./jobqueue.py retry [ID ...]                                         (put failed jobs back in the queue)
+
+DEFAULT_DB = "./store/jobs.db"
+STATES = ("queued", "running", "done", "failed")
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    argv TEXT NOT NULL UNIQUE,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 2,
+    host TEXT,
+    boot_id TEXT,
+    worker_pid INTEGER,
+    job_pid INTEGER,
+    created REAL,
+    started REAL,
+    finished REAL,
+    returncode INTEGER,
+    error TEXT,
+    log_file TEXT
+)'''
+
+
+def connect(db_file=DEFAULT_DB):
+    '''Return connection to the job-database [db_file] (which is created if it does not exist yet).'''
+    directory = os.path.dirname(db_file)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(db_file, timeout=60, isolation_level=None)    #--> transactions are started explicitly
+    db.row_factory = sqlite3.Row
+    db.execute(SCHEMA)
+    return db
+
+
+def _boot_id():
+    '''Return id of the current boot of this node (or None if it cannot be determined).'''
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _is_job_process(pid):
+    '''Whether [pid] is (still) a running 'main_cl.py'-job (and not, e.g., a new process that reused the pid).'''
+    try:
+        with open('/proc/{}/cmdline'.format(pid), 'rb') as f:
+            return b"main_cl.py" in f.read()
+    except OSError:
+        return False
+
+
+def _rss_mb(pid):
+    '''Return current resident set size (in MB) of process [pid] (or None if it cannot be determined).'''
+    try:
+        with open('/proc/{}/statm'.format(pid)) as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024.**2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+def add_job(db, argv, max_attempts=2):
+    '''Add a run of 'main_cl.py' with arguments [argv] (<list> of <str>) to the queue, unless the same run was added
+    before. Return the id of the job.'''
+    db.execute("INSERT OR IGNORE INTO jobs (argv, max_attempts, created) VALUES (?, ?, ?)",
+               (json.dumps(list(argv)), max_attempts, time.time()))
+    return db.execute("SELECT id FROM jobs WHERE argv=?", (json.dumps(list(argv)),)).fetchone()['id']
+
+
+def requeue_orphans(db):
+    '''Put jobs back in the queue that are marked as running on this node, but whose worker no longer exists (e.g.,
+    because it was killed or the node was rebooted); interrupted attempts are not counted. If the worker was killed
+    but its job is still running, the job is stopped first. Return the number of requeued jobs.'''
+    host, boot_id = socket.gethostname(), _boot_id()
+    db.execute("BEGIN IMMEDIATE")
+    orphans = [row for row in db.execute("SELECT * FROM jobs WHERE state='running' AND host=?", (host,)) if (
+        row['boot_id']!=boot_id or not _alive(row['worker_pid'])
+    )]
+    for row in orphans:
+        if row['boot_id']==boot_id and row['job_pid'] is not None and _is_job_process(row['job_pid']):
+            os.kill(row['job_pid'], signal.SIGTERM)
+        db.execute("UPDATE jobs SET state='queued', attempts=attempts-1, worker_pid=NULL, job_pid=NULL, "
+                   "error='interrupted' WHERE id=?", (row['id'],))
+    db.execute("COMMIT")
+    return len(orphans)
+
+
+def claim_job(db):
+    '''Mark the oldest queued job as running by this worker and return it (or None if the queue is empty).'''
+    db.execute("BEGIN IMMEDIATE")
+    row = db.execute("SELECT * FROM jobs WHERE state='queued' ORDER BY id LIMIT 1").fetchone()
+    if row is not None:
+        db.execute("UPDATE jobs SET state='running', attempts=attempts+1, host=?, boot_id=?, worker_pid=?, started=?, "
+                   "finished=NULL, returncode=NULL WHERE id=?",
+                   (socket.gethostname(), _boot_id(), os.getpid(), time.time(), row['id']))
+    db.execute("COMMIT")
+    return row
+
+
+def finish_job(db, job_id, returncode, error=None):
+    '''Record the outcome of a job; failed jobs are put back in the queue if they have attempts left.'''
+    row = db.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+    if returncode==0:
+        state = "done"
+    else:
+        state = "queued" if row['attempts']<row['max_attempts'] else "failed"
+    db.execute("UPDATE jobs SET state=?, finished=?, returncode=?, error=?, job_pid=NULL WHERE id=?",
+               (state, time.time(), returncode, error, job_id))
+    return state
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+def _job_argv(row):
+    '''Return command for [row]; runs that were started before and save their training-state continue from it.'''
+    argv = json.loads(row['argv'])
+    checkpointing = any(arg=="--checkpoint" or arg.startswith("--checkpoint-every") for arg in argv)
+    if checkpointing and row['started'] is not None and "--resume" not in argv:
+        argv = argv + ["--resume"]
+    return [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main_cl.py")] + argv
+
+
+def work(db, workers=1, threads_per_job=None, max_mem_mb=None, log_dir="./store/jobs", poll_interval=1.):
+    '''Run queued jobs with up to [workers] at the same time, until the queue is empty.
+
+    [threads_per_job]   None or <int>, # of threads per job (default: # of cores / [workers]); each job is also
+                          restricted to its own set of cores (if possible)
+    [max_mem_mb]        None or <float>, a job whose RSS exceeds this is killed (and counts as failed)'''
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir, exist_ok=True)
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    threads = max(1, len(cpus)//workers) if threads_per_job is None else threads_per_job
+    n_requeued = requeue_orphans(db)
+    if n_requeued>0:
+        print(" --> put {} interrupted job(s) back in the queue".format(n_requeued))
+    print("Running queued jobs with {} workers ({} threads each)...".format(workers, threads))
+
+    running = {}    #--> for each slot: (job-id, process, log-file)
+    stopping = []
+    def stop(signum, frame):
+        stopping.append(signum)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    try:
+        while not stopping:
+            # -check running jobs
+            for slot, (job_id, process, log) in list(running.items()):
+                error = None
+                if process.poll() is None:
+                    rss = _rss_mb(process.pid)
+                    if max_mem_mb is None or rss is None or rss<=max_mem_mb:
+                        continue
+                    process.kill()
+                    process.wait()
+                    error = "memory cap exceeded ({:.0f} MB > {:.0f} MB)".format(rss, max_mem_mb)
+                log.close()
+                state = finish_job(db, job_id, process.returncode, error=error)
+                print(" --> job {}: {} (exit code {}){}".format(
+                    job_id, "finished" if state=="done" else ("failed, requeued" if state=="queued" else "failed"),
+                    process.returncode, "" if error is None else ", "+error
+                ))
+                del running[slot]
+            # -start new jobs in the free slots
+            for slot in [slot for slot in range(workers) if slot not in running]:
+                row = claim_job(db)
+                if row is None:
+                    break
+                log_file = os.path.join(log_dir, "job-{}.log".format(row['id']))
+                log = open(log_file, 'a')
+                log.write("\n##### attempt {} started at {} on {}\n".format(row['attempts']+1, time.ctime(),
+                                                                          socket.gethostname()))
+                log.flush()
+                env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+                slot_cpus = cpus[(slot*threads) % len(cpus):][:threads]
+                preexec_fn = (lambda: os.sched_setaffinity(0, slot_cpus)) if (
+                    hasattr(os, 'sched_setaffinity') and threads*workers<=len(cpus)
+                ) else None
+                process = subprocess.Popen(_job_argv(row), stdout=log, stderr=subprocess.STDOUT, env=env,
+                                           preexec_fn=preexec_fn)
+                db.execute("UPDATE jobs SET job_pid=?, log_file=? WHERE id=?", (process.pid, log_file, row['id']))
+                running[slot] = (row['id'], process, log)
+                print(" --> job {}: started (attempt {}, log: {})".format(row['id'], row['attempts']+1, log_file))
+            if len(running)==0:
+                break
+            time.sleep(poll_interval)
+    finally:
+        # -if stopped before all jobs are done, put the running jobs back in the queue
+        for job_id, process, log in running.values():
+            process.terminate()
+            process.wait()
+            log.close()
+            db.execute("UPDATE jobs SET state='queued', attempts=attempts-1, job_pid=NULL, error='interrupted' "
+                       "WHERE id=?", (job_id,))
+            print(" --> job {}: interrupted, put back in the queue".format(job_id))
+    print_status(db)
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+def print_status(db):
+    '''Print the number of jobs per state and an overview of all jobs.'''
+    rows = db.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+    counts = {state: sum(row['state']==state for row in rows) for state in STATES}
+    print("\nJobs: " + ", ".join("{} {}".format(counts[state], state) for state in STATES))
+    if len(rows)>0:
+        print(" {:>5}  {:<8} {:>8} {:>9}  {}".format("id", "state", "attempts", "time (s)", "arguments"))
+    for row in rows:
+        seconds = None if (row['state']=="queued" or row['started'] is None) else (
+            (row['finished'] or time.time()) - row['started']
+        )
+        print(" {:>5}  {:<8} {:>8} {:>9}  {}".format(
+            row['id'], row['state'], "{}/{}".format(row['attempts'], row['max_attempts']),
+            "" if seconds is None else "{:.0f}".format(seconds), " ".join(json.loads(row['argv']))
+        ))
+
+
+def inspect_job(db, job_id, n_lines=20):
+    '''Print all information on job [job_id] and the last [n_lines] lines of its log.'''
+    row = db.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+    if row is None:
+        print("No job with id {}".format(job_id))
+        return
+    for key in row.keys():
+        value = row[key]
+        if key in ('created', 'started', 'finished') and value is not None:
+            value = time.ctime(value)
+        print(" {:<14} {}".format(key, value))
+    if row['log_file'] is not None and os.path.isfile(row['log_file']):
+        print("\n----- last {} lines of {} -----".format(n_lines, row['log_file']))
+        with open(row['log_file']) as f:
+            print("".join(f.readlines()[-n_lines:]), end="")
+
+
+def retry_jobs(db, job_ids=None):
+    '''Put failed jobs (all, or those in [job_ids]) back in the queue with a fresh set of attempts.'''
+    query = "UPDATE jobs SET state='queued', attempts=0, error=NULL WHERE state='failed'"
+    if job_ids:
+        query += " AND id IN ({})".format(",".join("?"*len(job_ids)))
+    n_jobs = db.execute(query, tuple(job_ids or ())).rowcount
+    print(" --> put {} failed job(s) back in the queue".format(n_jobs))
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('./jobqueue.py', description="Local job-queue for runs of main_cl.py.")
+    parser.add_argument('--db', type=str, default=DEFAULT_DB, help="job-database (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    add_parser = commands.add_parser('add', help="add run of main_cl.py (arguments after '--') to the queue")
+    add_parser.add_argument('--max-attempts', type=int, default=2, help="# of times to try the run (default: 2)")
+    add_parser.add_argument('argv', nargs=argparse.REMAINDER, help="arguments for main_cl.py")
+    work_parser = commands.add_parser('work', help="run all queued jobs")
+    work_parser.add_argument('--workers', type=int, default=1, help="# of jobs to run at the same time")
+    work_parser.add_argument('--threads-per-job', type=int, default=None, metavar='N',
+                             help="# of threads per job (default: # of cores / workers)")
+    work_parser.add_argument('--max-mem-mb', type=float, default=None, metavar='MB',
+                             help="kill jobs whose memory usage exceeds this")
+    work_parser.add_argument('--log-dir', type=str, default="./store/jobs", help="default: %(default)s")
+    commands.add_parser('status', help="print overview of all jobs")
+    inspect_parser = commands.add_parser('inspect', help="print details and log of a job")
+    inspect_parser.add_argument('id', type=int)
+    inspect_parser.add_argument('--lines', type=int, default=20, help="# of lines of the log to print")
+    retry_parser = commands.add_parser('retry', help="put failed jobs back in the queue")
+    retry_parser.add_argument('ids', type=int, nargs='*', help="ids of jobs to retry (default: all failed jobs)")
+    args = parser.parse_args()
+
+    db = connect(args.db)
+    if args.command=="add":
+        argv = args.argv[1:] if args.argv[:1]==["--"] else args.argv
+        print(" --> job {}: {}".format(add_job(db, argv, max_attempts=args.max_attempts), " ".join(argv)))
+    elif args.command=="work":
+        work(db, workers=args.workers, threads_per_job=args.threads_per_job, max_mem_mb=args.max_mem_mb,
+             log_dir=args.log_dir)
+    elif args.command=="status":
+        print_status(db)
+    elif args.command=="inspect":
+        inspect_job(db, args.id, n_lines=args.lines)
+    elif args.command=="retry":
+        retry_jobs(db, args.ids)
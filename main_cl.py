@@ -1,12 +1,9 @@
 #!/usr/bin/env python3
 import numpy as np
 import os
-from scipy.stats import entropy
 import torch
 from torch import optim
-from torch.utils.data import ConcatDataset
-from torch.nn import functional as F
-from itertools import chain
+from torch.utils.data import TensorDataset
 
 # -custom-written libraries
 import options
@@ -17,9 +14,13 @@ from eval import evaluate
 from eval import callbacks as cb
 import eval.precision_recall as pr
 import eval.fid as fid
+import eval.generator as gen_metrics
+import visual.visdom
+from visual.report import ReportWriter
 from train import train_cl
+import profiling
+import memory
 from param_stamp import get_param_stamp
-from models.cl.continual_learner import ContinualLearner
 from torch import nn
 
 
@@ -85,7 +86,8 @@ def run(args, verbose=True):
         name=args.experiment, scenario=args.scenario, tasks=args.tasks, data_dir=args.d_dir,
         normalize=True if utils.checkattr(args, "normalize") else False,
         augment=True if utils.checkattr(args, "augment") else False,
-        verbose=verbose, exception=True if args.seed<10 else False, only_test=(not args.train)
+        verbose=verbose, exception=True if args.seed<10 else False, only_test=(not args.train),
+        synthetic=utils.checkattr(args, 'synthetic'),
     )
 
 
@@ -95,77 +97,12 @@ def run(args, verbose=True):
     #----- MAIN MODEL -----#
     #----------------------#
 
-    # Define main model (i.e., classifier, if requested with feedback connections)
+    # Define main model (i.e., classifier, if requested with feedback connections), including its optimizer(s) and the
+    # settings of the chosen CL-strategies (regularization / allocation / replay)
     if verbose and (utils.checkattr(args, "pre_convE") or utils.checkattr(args, "pre_convD")) and \
             (hasattr(args, "depth") and args.depth>0):
         print("\nDefining the model...")
-    if utils.checkattr(args, 'feedback'):
-        model = define.define_autoencoder(args=args, config=config, device=device)
-    else:
-        model = define.define_classifier(args=args, config=config, device=device)
-
-    # Initialize / use pre-trained / freeze model-parameters
-    # - initialize (pre-trained) parameters
-    model = define.init_params(model, args)
-    # - freeze weights of conv-layers? True
-    if utils.checkattr(args, "freeze_convE"):
-        for param in model.convE.parameters():
-            param.requires_grad = False
-    if utils.checkattr(args, 'feedback') and utils.checkattr(args, "freeze_convD"):
-        for param in model.convD.parameters():
-            param.requires_grad = False
-    ####
-    use_views = args.contrastive
-    use_attention = args.attention
-
-    if use_views:
-        for param in model.fcProj.parameters():
-            param.requires_grad = False
-
-    # Define optimizer (only optimize parameters that "requires_grad")
-    model.optim_list = [
-        {'params': filter(lambda p: p.requires_grad, model.parameters()), 'lr': args.lr},
-    ]
-    model.optimizer = optim.Adam(model.optim_list, betas=(0.9, 0.999))
-
-    #### Define encoder optimizer (only optimize the encoder & MLP parameters)...
-    if use_views:
-        if use_attention:
-            attn_lr = args.contr_lr*(10**(-args.iters/1000))
-            model.E_optim_list = [
-                {'params': chain(model.fcE.parameters(), model.fcProj.parameters(), model.predictor.parameters(), model.multihead_attn.parameters(), model.E_attn.parameters()),
-                 'lr': attn_lr},
-                ]
-
-        else:
-            model.E_optim_list = [
-                {'params': chain(model.fcE.parameters(), model.fcProj.parameters(), model.predictor.parameters()), 'lr': args.contr_lr},
-                ]
-        print(' Contrastive LR =', args.contr_lr)
-        model.E_optimizer = optim.Adam(model.E_optim_list, betas=(0.9, 0.999), weight_decay=args.weight_decay)
-
-    #-------------------------------------------------------------------------------------------------#
-
-    #----------------------------------------------------#
-    #----- CL-STRATEGY: REGULARIZATION / ALLOCATION -----#
-    #----------------------------------------------------#
-
-    # Elastic Weight Consolidation (EWC)
-    if isinstance(model, ContinualLearner) and utils.checkattr(args, 'ewc'):
-        model.ewc_lambda = args.ewc_lambda if args.ewc else 0
-        model.fisher_n = args.fisher_n
-        model.online = utils.checkattr(args, 'online')
-        if model.online:
-            model.gamma = args.gamma
-
-    # Synpatic Intelligence (SI)
-    if isinstance(model, ContinualLearner) and utils.checkattr(args, 'si'):
-        model.si_c = args.si_c if args.si else 0
-        model.epsilon = args.epsilon
-
-    # XdG: create for every task a "mask" for each hidden fully connected layer
-    if isinstance(model, ContinualLearner) and utils.checkattr(args, 'xdg') and args.xdg_prop>0:
-        model.define_XdGmask(gating_prop=args.xdg_prop, n_tasks=args.tasks)
+    model = define.define_main_model(args, config, device, verbose=verbose)
 
 
     #-------------------------------------------------------------------------------------------------#
@@ -174,11 +111,6 @@ def run(args, verbose=True):
     #----- CL-STRATEGY: REPLAY -----#
     #-------------------------------#
 
-    # Use distillation loss (i.e., soft targets) for replayed data? (and set temperature)
-    if isinstance(model, ContinualLearner) and hasattr(args, 'replay') and not args.replay=="none":
-        model.replay_targets = "soft" if args.distill else "hard"
-        model.KD_temp = args.temp
-
     # If needed, specify separate model for the generator
     train_gen = (hasattr(args, 'replay') and args.replay=="generative" and not utils.checkattr(args, 'feedback'))
     if train_gen:
@@ -258,6 +190,8 @@ def run(args, verbose=True):
             xdg="" if (not utils.checkattr(args, 'xdg')) or args.xdg_prop==0 else "-XdG{}".format(args.xdg_prop),
         )
         visdom = {'env': env_name, 'graph': graph_name}
+        if args.visdom_log is not None:
+            visual.visdom.configure(offline_file=args.visdom_log)
 
 
     #-------------------------------------------------------------------------------------------------#
@@ -288,16 +222,23 @@ def run(args, verbose=True):
                       sample_size=args.sample_n, iters_per_task=g_iters)
     ] if ((train_gen or utils.checkattr(args, 'feedback')) and not no_samples) else [None]
 
+    # Cache the test-data of all tasks once (full test-sets, and fixed stratified subsets of [prec_n] datapoints per
+    # task for the visdom-plots, such that successive evaluations are done on the same datapoints)
+    test_cache = evaluate.cache_test_sets(test_datasets, pin_memory=cuda, batch_size=args.batch)
+    test_cache_sub = evaluate.subsample_test_cache(test_cache, test_size=args.prec_n, seed=args.seed) if (
+        args.visdom
+    ) else None
+
     # Callbacks for reporting and visualizing accuracy, and visualizing representation extracted by main model
     # -visdom (i.e., after each [prec_log]
     eval_cb = cb._eval_cb(
         log=args.prec_log, test_datasets=test_datasets, visdom=visdom, precision_dict=None, iters_per_task=args.iters,
-        test_size=args.prec_n, classes_per_task=classes_per_task, scenario=args.scenario,
+        test_size=args.prec_n, classes_per_task=classes_per_task, scenario=args.scenario, test_cache=test_cache_sub,
     )
     # -pdf / reporting: summary plots (i.e, only after each task)
     eval_cb_full = cb._eval_cb(
         log=args.iters, test_datasets=test_datasets, precision_dict=precision_dict,
-        iters_per_task=args.iters, classes_per_task=classes_per_task, scenario=args.scenario,
+        iters_per_task=args.iters, classes_per_task=classes_per_task, scenario=args.scenario, test_cache=test_cache,
     )
     # -visualize feature space
     latent_space_cb = cb._latent_space_cb(
@@ -319,6 +260,16 @@ def run(args, verbose=True):
 
         criterion = nn.CosineSimilarity(dim=1).cuda(args.cuda)
 
+        # If requested, time the different phases of training
+        if utils.checkattr(args, 'profile'):
+            profiling.start(sync_cuda=cuda, trace=utils.checkattr(args, 'profile_trace'))
+
+        # If requested, track the memory usage (and check it against the budget) during training
+        if utils.checkattr(args, 'memory'):
+            memory.start(interval=args.memory_log, budget_mb=args.memory_budget,
+                         file_name="{}/memory-{}.json".format(args.r_dir, param_stamp))
+            memory.add_component('test_cache', [test_cache, test_cache_sub])
+
         # Train model
         precision_train = train_cl(
             model, train_datasets, replay_mode=args.replay if hasattr(args, 'replay') else "none",
@@ -327,23 +278,36 @@ def run(args, verbose=True):
             generator=generator, gen_iters=g_iters, gen_loss_cbs=generator_loss_cbs,
             feedback=utils.checkattr(args, 'feedback'), sample_cbs=sample_cbs, eval_cbs=eval_cbs,
             loss_cbs=generator_loss_cbs if utils.checkattr(args, 'feedback') else solver_loss_cbs,
-            args=args, reinit=utils.checkattr(args, 'reinit'), only_last=utils.checkattr(args, 'only_last'), criterion=criterion
+            args=args, reinit=utils.checkattr(args, 'reinit'), only_last=utils.checkattr(args, 'only_last'), criterion=criterion,
+            profile_file="{}/profile-{}".format(args.r_dir, param_stamp),
+            checkpoint_file="{}/state-{}".format(args.m_dir, param_stamp) if (
+                    utils.checkattr(args, 'checkpoint') or utils.checkattr(args, 'resume') or
+                    getattr(args, 'checkpoint_every', None) is not None
+            ) else None,
+            checkpoint_every=getattr(args, 'checkpoint_every', None), resume=utils.checkattr(args, 'resume'),
+            extra_state={'precision_dict': precision_dict},
         )
+        if utils.checkattr(args, 'profile'):
+            if utils.checkattr(args, 'profile_trace'):
+                profiling.save_trace("{}/trace-{}.json".format(args.r_dir, param_stamp))
+            profiling.stop()
+        memory.stop()
         # Save evaluation metrics measured throughout training
         file_name = "{}/dict-{}".format(args.r_dir, param_stamp)
         utils.save_object(precision_dict, file_name)
         # print(model.state_dict().keys())
         # Save trained model(s), if requested
         if args.save:
+            blob_dir = os.path.join(args.m_dir, 'blobs') if utils.checkattr(args, 'blob_store') else None
             save_name = "mM-{}".format(param_stamp) if (
                 not hasattr(args, 'full_stag') or args.full_stag == "none"
             ) else "{}-{}".format(model.name, args.full_stag)
-            utils.save_checkpoint(model, args.m_dir, name=save_name, verbose=verbose)
+            utils.save_checkpoint(model, args.m_dir, name=save_name, verbose=verbose, blob_dir=blob_dir)
             if generator is not None:
                 save_name = "gM-{}".format(param_stamp) if (
                     not hasattr(args, 'full_stag') or args.full_stag == "none"
                 ) else "{}-{}".format(generator.name, args.full_stag)
-                utils.save_checkpoint(generator, args.m_dir, name=save_name, verbose=verbose)
+                utils.save_checkpoint(generator, args.m_dir, name=save_name, verbose=verbose, blob_dir=blob_dir)
 
     else:
         # Load previously trained model(s) (if goal is to only evaluate previously trained model)
@@ -352,8 +316,7 @@ def run(args, verbose=True):
         load_name = "mM-{}".format(param_stamp) if (
             not hasattr(args, 'full_ltag') or args.full_ltag == "none"
         ) else "{}-{}".format(model.name, args.full_ltag)
-        utils.load_checkpoint(model, args.m_dir, name=load_name, verbose=verbose,
-                              add_si_buffers=(isinstance(model, ContinualLearner) and utils.checkattr(args, 'si')))
+        utils.load_checkpoint(model, args.m_dir, name=load_name, verbose=verbose)
         if generator is not None:
             load_name = "gM-{}".format(param_stamp) if (
                 not hasattr(args, 'full_ltag') or args.full_ltag == "none"
@@ -371,10 +334,8 @@ def run(args, verbose=True):
         print("\n\nEVALUATION RESULTS:")
 
     # Evaluate precision of final model on full test-set
-    precs = [evaluate.validate(
-        model, test_datasets[i], verbose=False, test_size=None, task=i+1,
-        allowed_classes=list(range(classes_per_task*i, classes_per_task*(i+1))) if args.scenario=="task" else None
-    ) for i in range(args.tasks)]
+    precs = evaluate.precision_per_task(model, test_cache, current_task=args.tasks, classes_per_task=classes_per_task,
+                                        scenario="task" if args.scenario=="task" else "none")
     average_precs = sum(precs)/args.tasks
     # -print on screen
     if verbose:
@@ -429,13 +390,22 @@ def run(args, verbose=True):
 
     if (utils.checkattr(args, 'feedback') or train_gen) and args.experiment=="CIFAR100" and args.scenario=="class":
 
-        # Dataset and model to be used
-        test_set = ConcatDataset(test_datasets)
+        # Model to be used
         gen_model = model if utils.checkattr(args, 'feedback') else generator
         gen_model.eval()
 
+        # Use the test-data of all tasks that were cached at the start (see 'evaluate.cache_test_sets'), which is
+        # shared by all generator evaluation metrics below
+        test_x, test_y = test_cache['X'], test_cache['y']
+        # -if internal replay, convert inputs to hidden feature representations only once
+        if gen_model.hidden:
+            with torch.no_grad():
+                test_h = torch.cat([gen_model.input_to_hidden(x.to(device)).cpu() for x in test_x.split(args.batch)])
+        gen_test_set = TensorDataset(test_h if gen_model.hidden else test_x, test_y)
+
         # Evaluate log-likelihood of generative model on combined test-set (with S=100 importance samples per datapoint)
-        ll_per_datapoint = gen_model.estimate_loglikelihood(test_set, S=100, batch_size=args.batch)
+        ll_per_datapoint = gen_model.estimate_loglikelihood(gen_test_set, S=100, batch_size=args.batch,
+                                                            from_hidden=True, verbose=verbose)
         if verbose:
             print('=> Log-likelihood on test set: {:.4f} +/- {:.4f}\n'.format(
                 np.mean(ll_per_datapoint), np.sqrt(np.var(ll_per_datapoint))
@@ -446,14 +416,13 @@ def run(args, verbose=True):
         output_file.close()
 
         # Evaluate reconstruction error (averaged over number of input units)
-        re_per_datapoint = gen_model.calculate_recon_error(test_set, batch_size=args.batch, average=True)
+        re_mean, re_std = gen_model.calculate_recon_error(gen_test_set, batch_size=args.batch, average=True,
+                                                          from_hidden=True, summary=True)
         if verbose:
-            print('=> Reconstruction error (per input unit) on test set: {:.4f} +/- {:.4f}\n'.format(
-                np.mean(re_per_datapoint), np.sqrt(np.var(re_per_datapoint))
-            ))
+            print('=> Reconstruction error (per input unit) on test set: {:.4f} +/- {:.4f}\n'.format(re_mean, re_std))
         # -write out to text file
         output_file = open("{}/re-{}.txt".format(args.r_dir, param_stamp), 'w')
-        output_file.write('{}\n'.format(np.mean(re_per_datapoint)))
+        output_file.write('{}\n'.format(re_mean))
         output_file.close()
 
         # Try loading the classifier (our substitute for InceptionNet) for calculating IS, FID and Recall & Precision
@@ -477,42 +446,29 @@ def run(args, verbose=True):
         # Only continue with computing these measures if the requested classifier network (using --eval-tag) was found
         if FileFound:
             # Preparations
-            total_n = len(test_set)
-            n_repeats = int(np.ceil(total_n/args.batch))
-            # -sample data from generator (for IS, FID and Precision & Recall)
-            gen_x = gen_model.sample(size=total_n, only_x=True)
-            # -generate predictions for generated data (for IS)
-            gen_pred = []
-            for i in range(n_repeats):
-                x = gen_x[(i*args.batch): int(min(((i+1)*args.batch), total_n))]
-                with torch.no_grad():
-                    gen_pred.append(F.softmax(
-                        pretrained_classifier.hidden_to_output(x) if args.hidden else pretrained_classifier(x), dim=1
-                    ).cpu().numpy())
-            gen_pred = np.concatenate(gen_pred)
-            # -generate embeddings for generated data (for FID and Precision & Recall)
-            gen_emb = []
-            for i in range(n_repeats):
-                with torch.no_grad():
-                    gen_emb.append(pretrained_classifier.feature_extractor(
-                        gen_x[(i*args.batch):int(min(((i+1)*args.batch), total_n))], from_hidden=args.hidden
-                    ).cpu().numpy())
-            gen_emb = np.concatenate(gen_emb)
-            # -generate embeddings for test data (for FID and Precision & Recall)
-            data_loader = utils.get_data_loader(test_set, batch_size=args.batch, cuda=cuda)
-            real_emb = []
-            for real_x, _ in data_loader:
-                with torch.no_grad():
-                    real_emb.append(pretrained_classifier.feature_extractor(real_x.to(device)).cpu().numpy())
-            real_emb = np.concatenate(real_emb)
+            total_n = len(test_x)
+            # -sample data from generator in chunks, and make a single pass of the classifier over these chunks to get
+            #  both the predictions (for IS) and the embeddings (for FID and Precision & Recall) of the generated data
+            gen_emb, gen_pred, gen_stats = gen_metrics.embed_batches(pretrained_classifier, (
+                x for x, _, _ in gen_model.sample_iter(total_n, chunk_size=args.batch)
+            ), total_n, from_hidden=args.hidden)
+            # -generate embeddings (and their statistics) for test data (for FID and Precision & Recall), unless these
+            #  are already cached for this evaluation-classifier and test-set
+            ref_file = fid.reference_file(args.m_dir, os.path.join(
+                args.m_dir, "{}{}".format(pretrained_classifier.name, eval_tag)
+            ), test_x)
+            ref = fid.load_reference(ref_file)
+            if ref is None:
+                real_emb, _, real_stats = gen_metrics.embed_batches(pretrained_classifier, (
+                    real_x.to(device) for real_x in test_x.split(args.batch)
+                ), len(test_x), with_probs=False)
+                fid.save_reference(ref_file, real_stats, real_emb)
+                real_mu, real_sigma = real_stats.mean, real_stats.cov
+            else:
+                real_mu, real_sigma, real_emb = ref
 
             # Calculate "Inception Score" (IS)
-            py = gen_pred.mean(axis=0)
-            is_per_datapoint = []
-            for i in range(len(gen_pred)):
-                pyx = gen_pred[i, :]
-                is_per_datapoint.append(entropy(pyx, py))
-            IS = np.exp(np.mean(is_per_datapoint))
+            IS = gen_metrics.inception_score(gen_pred)
             if verbose:
                 print('=> Inception Score = {:.4f}\n'.format(IS))
             # -write out to text file
@@ -521,7 +477,7 @@ def run(args, verbose=True):
             output_file.close()
 
             ## Calculate "Frechet Inception Distance" (FID)
-            FID = fid.calculate_fid_from_embedding(gen_emb, real_emb)
+            FID = fid.calculate_frechet_distance(gen_stats.mean, gen_stats.cov, real_mu, real_sigma)
             if verbose:
                 print('=> Frechet Inception Distance = {:.4f}\n'.format(FID))
             # -write out to text file
@@ -530,7 +486,20 @@ def run(args, verbose=True):
             output_file.close()
 
             # Calculate "Precision & Recall"-curves
-            precision, recall = pr.compute_prd_from_embedding(gen_emb, real_emb)
+            # -if requested, reuse clusters fitted only on the test-set (which are cached, like the FID-statistics)
+            ref_centers = None
+            if utils.checkattr(args, 'prd_reuse_ref'):
+                centers_file = ref_file.replace("fid-ref-", "prd-ref-c{}-".format(args.prd_clusters)).replace(
+                    ".npz", ".npy"
+                )
+                if os.path.isfile(centers_file):
+                    ref_centers = np.load(centers_file)
+                else:
+                    ref_centers = pr.fit_reference_clusters(real_emb, num_clusters=args.prd_clusters,
+                                                            n_workers=args.prd_workers)
+                    np.save(centers_file, ref_centers)
+            precision, recall = pr.compute_prd_from_embedding(gen_emb, real_emb, num_clusters=args.prd_clusters,
+                                                              n_workers=args.prd_workers, ref_centers=ref_centers)
             # -write out to text files
             file_name = "{}/precision{}-{}.txt".format(args.r_dir, eval_tag, param_stamp)
             with open(file_name, 'w') as f:
@@ -548,19 +517,16 @@ def run(args, verbose=True):
     #----- PLOTTING -----#
     #--------------------#
 
-    # If requested, generate pdf
+    # If requested, generate pdf (the figures are rendered and added to the pdf in a separate process)
     if args.pdf:
         # -open pdf
         plot_name = "{}/{}.pdf".format(args.p_dir, param_stamp)
-        pp = evaluate.visual.plt.open_pdf(plot_name)
+        pp = ReportWriter(plot_name)
 
         # -show metrics reflecting progression during training
         if args.train and (not utils.checkattr(args, 'only_last')):
-            # -create list to store all figures to be plotted.
-            figure_list = []
-            # -generate figures (and store them in [figure_list])
-            figure = evaluate.visual.plt.plot_lines(
-                precision_dict["all_tasks"], x_axes=[
+            pp.plot(
+                'plot_lines', precision_dict["all_tasks"], x_axes=[
                     i*classes_per_task for i in precision_dict["x_task"]
                 ] if args.scenario=="class" else precision_dict["x_task"],
                 line_names=['{} {}'.format(
@@ -568,9 +534,8 @@ def run(args, verbose=True):
                 ) for i in range(args.tasks)],
                 xlabel="# of {}s so far".format("classe" if args.scenario=="class" else "task"), ylabel="Test accuracy"
             )
-            figure_list.append(figure)
-            figure = evaluate.visual.plt.plot_lines(
-                [precision_dict["average"]], x_axes=[
+            pp.plot(
+                'plot_lines', [precision_dict["average"]], x_axes=[
                     i*classes_per_task for i in precision_dict["x_task"]
                 ] if args.scenario=="class" else precision_dict["x_task"],
                 line_names=['Average based on all {}s so far'.format(
@@ -578,10 +543,6 @@ def run(args, verbose=True):
                 )], xlabel="# of {}s so far".format("classe" if args.scenario=="class" else "task"),
                 ylabel="Test accuracy"
             )
-            figure_list.append(figure)
-            # -add figures to pdf
-            for figure in figure_list:
-                pp.savefig(figure)
 
         gen_eval = (utils.checkattr(args, 'feedback') or train_gen)
         # -show samples (from main model or separate generator)
@@ -591,10 +552,9 @@ def run(args, verbose=True):
 
         # -plot "Precision & Recall"-curve
         if gen_eval and args.experiment=="CIFAR100" and args.scenario=="class" and FileFound:
-            figure = evaluate.visual.plt.plot_pr_curves([[precision]], [[recall]])
-            pp.savefig(figure)
+            pp.plot('plot_pr_curves', [[precision]], [[recall]])
 
-        # -close pdf
+        # -close pdf (waits until all figures are rendered)
         pp.close()
 
         # -print name of generated plot on screen
@@ -8,6 +8,8 @@ from param_stamp import get_param_stamp
 from eval import evaluate
 from eval import callbacks as cb
 from visual import plt
+import visual.visdom
+from visual.report import ReportWriter
 import train
 import options
 import define_models as define
@@ -67,6 +69,7 @@ def run(args):
         name=args.experiment, data_dir=args.d_dir, verbose=True,
         normalize = True if utils.checkattr(args, "normalize") else False,
         augment = True if utils.checkattr(args, "augment") else False,
+        synthetic = utils.checkattr(args, "synthetic"),
     )
 
     # Specify "data-loader" (among others for easy random shuffling and 'batchifying')
@@ -127,6 +130,8 @@ def run(args):
     # Prepare for plotting in visdom
     graph_name = cnn.name
     visdom = None if (not args.visdom) else {'env': args.experiment, 'graph': graph_name}
+    if args.visdom and args.visdom_log is not None:
+        visual.visdom.configure(offline_file=args.visdom_log)
 
     #-------------------------------------------------------------------------------------------------#
 
@@ -156,20 +161,21 @@ def run(args):
     # (Pre)train model
     print("\nTraining...")
     train.train(cnn, train_loader, iters, loss_cbs=loss_cbs, eval_cbs=[eval_cb, latent_space_cb],
-                save_every=1000 if args.save else None, m_dir=args.m_dir, args=args)
+                save_every=1000 if args.save else None, m_dir=args.m_dir, args=args, keep_last=args.keep_last)
 
     # Save (pre)trained model
     if args.save:
+        blob_dir = os.path.join(args.m_dir, 'blobs') if utils.checkattr(args, 'blob_store') else None
         # -conv-layers
         save_name = cnn.convE.name if (
             not hasattr(args, 'convE_stag') or args.convE_stag=="none"
         ) else "{}-{}".format(cnn.convE.name, args.convE_stag)
-        utils.save_checkpoint(cnn.convE, args.m_dir, name=save_name)
+        utils.save_checkpoint(cnn.convE, args.m_dir, name=save_name, blob_dir=blob_dir)
         # -full model
         save_name = cnn.name if (
             not hasattr(args, 'full_stag') or args.full_stag=="none"
         ) else "{}-{}".format(cnn.name, args.full_stag)
-        utils.save_checkpoint(cnn, args.m_dir, name=save_name)
+        utils.save_checkpoint(cnn, args.m_dir, name=save_name, blob_dir=blob_dir)
 
 
     #-------------------------------------------------------------------------------------------------#
@@ -182,15 +188,14 @@ def run(args):
     if args.pdf:
         # -open pdf
         plot_name = "{}/{}.pdf".format(args.p_dir, param_stamp)
-        pp = plt.open_pdf(plot_name)
+        pp = ReportWriter(plot_name)
         # -Fig1: show some images
         images, _ = next(iter(train_loader))            #--> get a mini-batch of random training images
         plt.plot_images_from_tensor(images, pp, title="example input images", config=config)
         # -Fig2: precision
-        figure = plt.plot_lines(precision_dict["all_tasks"], x_axes=precision_dict["x_iteration"],
-                                line_names=['ave precision'], xlabel="Iterations", ylabel="Test accuracy")
-        pp.savefig(figure)
-        # -close pdf
+        pp.plot('plot_lines', precision_dict["all_tasks"], x_axes=precision_dict["x_iteration"],
+                line_names=['ave precision'], xlabel="Iterations", ylabel="Test accuracy")
+        # -close pdf (waits until all figures are rendered)
         pp.close()
         # -print name of generated plot on screen
         print("\nGenerated plot: {}\n".format(plot_name))
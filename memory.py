@@ -0,0 +1,307 @@
+import json
+import os
+import sys
+import time
+import torch
+try:
+    import resource
+except ImportError:
+    resource = None    #--> e.g., on Windows, in which case the peak RSS is only based on the samples
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+# Tracker of the current run (None if memory-tracking is disabled)
+_TRACKER = None
+
+
+class MemoryBudgetExceeded(RuntimeError):
+    pass
+
+
+def start(interval=None, budget_mb=None, file_name=None):
+    '''Enable tracking of the memory usage.
+
+    [interval]      None or <int>, also sample every [interval] iterations (otherwise only at the task boundaries)
+    [budget_mb]     None or <float>, refuse to start a task if its projected peak RSS (in MB) exceeds this budget
+    [file_name]     None or <str>, json-file to which the report is written (updated after each task)'''
+    global _TRACKER
+    _TRACKER = MemoryTracker(interval=interval, budget_mb=budget_mb, file_name=file_name)
+    return _TRACKER
+
+
+def stop():
+    '''Disable tracking of the memory usage.'''
+    global _TRACKER
+    _TRACKER = None
+
+
+def active():
+    return _TRACKER is not None
+
+
+def add_component(name, obj):
+    '''Also report the tensor-footprint of [obj] (e.g., cached test-data) as component [name] in all samples.'''
+    if _TRACKER is not None:
+        _TRACKER.components[name] = obj
+
+
+def due(iteration):
+    '''Whether a sample should be taken at [iteration] (if memory-tracking is enabled).'''
+    return (_TRACKER is not None) and (_TRACKER.interval is not None) and (iteration % _TRACKER.interval == 0)
+
+
+def sample(event, task, components=None):
+    '''If memory-tracking is enabled, record the current (and peak) memory usage and the tensor-footprint of the
+    entries in the <dict> returned by [components] (a <function>, so nothing is collected if tracking is disabled;
+    see 'training_components').'''
+    if _TRACKER is not None:
+        _TRACKER.sample(event, task, components)
+
+
+def start_task(task, components=None):
+    '''If memory-tracking is enabled, sample at the start of [task] and check its projected footprint against the
+    budget (raises 'MemoryBudgetExceeded' if it is exceeded).'''
+    if _TRACKER is not None:
+        _TRACKER.start_task(task, components)
+
+
+def end_task(task, components=None):
+    '''If memory-tracking is enabled, sample at the end of [task], print the memory usage during this task and update
+    the report.'''
+    if _TRACKER is not None:
+        _TRACKER.end_task(task, components)
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+def tensor_bytes(obj, seen=None, device_type=None):
+    '''Return total number of bytes of all tensors contained in [obj], which can be a <tensor>, <nn.Module> (parameters
+    and buffers), <optim.Optimizer> (its state) or a (nested) <list>, <tuple> or <dict> with those. Tensors already in
+    [seen] (a <set> with their memory-addresses) are skipped, so memory shared between components is counted once.
+    If [device_type] is provided (e.g., "cpu"), only tensors on a device of that type are counted.'''
+    seen = set() if seen is None else seen
+    if obj is None:
+        return 0
+    if isinstance(obj, torch.Tensor):
+        if device_type is not None and obj.device.type!=device_type:
+            return 0
+        key = (obj.device, obj.data_ptr(), obj.nelement())
+        if key in seen or obj.nelement()==0:
+            return 0
+        seen.add(key)
+        return obj.element_size() * obj.nelement()
+    if isinstance(obj, torch.nn.Module):
+        return sum(tensor_bytes(t, seen, device_type) for t in list(obj.parameters()) + list(obj.buffers()))
+    if isinstance(obj, torch.optim.Optimizer):
+        return tensor_bytes(list(obj.state.values()), seen, device_type)
+    if isinstance(obj, dict):
+        return sum(tensor_bytes(value, seen, device_type) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(tensor_bytes(value, seen, device_type) for value in obj)
+    return 0
+
+
+def _optimizers(model):
+    return [value for value in vars(model).values() if isinstance(value, torch.optim.Optimizer)]
+
+
+def training_components(model, generator=None, previous_model=None, previous_generator=None, si_running=None,
+                        replay_batch=None, eval_replicas=None):
+    '''Return <dict> with the objects holding the tensors of the different components of continual training.
+
+    The SI/EWC buffers are reported separately from the rest of the [model]; the optimizer state of the model(s) being
+    trained separately from their parameters. The teacher snapshot(s) are deep copies of the trained model(s) and so
+    include copies of their optimizer state and SI/EWC buffers. The replay batch contains the replayed inputs (or, with
+    internal replay, the replayed hidden features) and the teacher's scores for them. The [eval_replicas] are the
+    copies of the model(s) used for asynchronous evaluation (see eval/async_eval.py).'''
+    models = [model] if (generator is None or generator is model) else [model, generator]
+    cl_buffers = [b for m in models for n, b in m.named_buffers() if ("_SI_" in n) or ("_EWC_" in n)]
+    teacher = [m for m in (previous_model, previous_generator) if m is not None]
+    return {
+        'cl_buffers': cl_buffers,          #--> counted first, so they are not counted again as part of [model]
+        'model': model,
+        'generator': None if generator is model else generator,
+        'optimizer_state': [opt for m in models for opt in _optimizers(m)],
+        'teacher': teacher + [opt for m in teacher for opt in _optimizers(m)],
+        'si_running': si_running,
+        'replay_batch': replay_batch,
+        'eval_replicas': eval_replicas,
+    }
+
+
+def _cl_buffer_growth_bytes(model, device_type=None):
+    '''Return number of bytes of the SI/EWC buffers that [model] adds at the end of a task (see
+    models/cl/continual_learner.py): for EWC an estimate of the Fisher Information and a copy of each trainable parameter
+    (for online EWC only after the first task), for SI an estimate of the importance of each trainable parameter (only
+    after the first task, as the copy of the parameters is registered at the start of training).'''
+    params = [p for p in model.parameters() if p.requires_grad]
+    buffer_names = [name for name, _ in model.named_buffers()]
+    growth = 0
+    if getattr(model, 'ewc_lambda', 0)>0 and not (
+            getattr(model, 'online', False) and any("_EWC_" in name for name in buffer_names)
+    ):
+        growth += 2*tensor_bytes(params, device_type=device_type)
+    if getattr(model, 'si_c', 0)>0 and not any("_SI_omega" in name for name in buffer_names):
+        growth += tensor_bytes(params, device_type=device_type)
+    return growth
+
+
+def expected_growth_bytes(components, device_type=None):
+    '''Return number of bytes expected to be added to the [components] of continual training (a <dict> returned by
+    'training_components' at the start of a task) by training on the task: the optimizer state (if not yet created,
+    two tensors per parameter for Adam and at most one for other optimizers), the SI/EWC buffers added at the end of the
+    task, the replicas used for asynchronous evaluation (if not yet created) and the new teacher snapshot, which is a
+    copy of the trained model(s) (including their optimizer state and grown SI/EWC buffers) that is made while the
+    previous one still exists. If [device_type] is provided (e.g., "cpu"), only tensors on such a device are counted.'''
+    def size(obj):
+        return tensor_bytes(obj, device_type=device_type)
+    models = [m for m in (components.get('model'), components.get('generator')) if m is not None]
+    # -optimizer state
+    optimizer_state = 0
+    for optimizer in components.get('optimizer_state') or []:
+        params = [p for group in optimizer.param_groups for p in group['params']]
+        n_state = 2 if isinstance(optimizer, (torch.optim.Adam, torch.optim.AdamW)) else 1
+        optimizer_state += max(size(optimizer), n_state*size(params))
+    growth = optimizer_state - size(components.get('optimizer_state'))
+    # -SI/EWC buffers
+    cl_buffers = sum(_cl_buffer_growth_bytes(m, device_type=device_type) for m in models)
+    growth += cl_buffers
+    # -replicas for asynchronous evaluation
+    if components.get('eval_replicas') is not None and len(components['eval_replicas'])==0:
+        growth += size(models)
+    # -new teacher snapshot
+    growth += size(models) + cl_buffers + optimizer_state
+    return growth
+
+
+def _rss_bytes():
+    '''Return current resident set size (in bytes) of this process (or None if it cannot be determined).'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss_bytes():
+    '''Return peak resident set size (in bytes) of this process so far (or None if it cannot be determined).'''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform=="darwin" else peak*1024    #--> [ru_maxrss] is in bytes on macOS, else in KB
+
+
+def _mb(n_bytes):
+    return None if n_bytes is None else n_bytes / 1024.**2
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+class MemoryTracker(object):
+    '''Keeps track of the RSS (and, if cuda is used, the allocated GPU-memory) of this process and of the memory taken
+    by the tensors of the different components of continual training, and reports the peak usage per task.'''
+
+    def __init__(self, interval=None, budget_mb=None, file_name=None):
+        self.interval = interval
+        self.budget_mb = budget_mb
+        self.file_name = file_name
+        self.cuda = torch.cuda.is_available()
+        self.t0 = time.time()
+        self.samples = []
+        self.tasks = {}
+        self.components = {}
+
+    def sample(self, event, task, components=None):
+        rss, peak_rss = _rss_bytes(), _peak_rss_bytes()
+        record = {'time_s': time.time()-self.t0, 'event': event, 'task': task,
+                  'rss_mb': _mb(rss), 'peak_rss_mb': _mb(peak_rss)}
+        if self.cuda:
+            record['cuda_mb'] = _mb(torch.cuda.memory_allocated())
+            record['cuda_peak_mb'] = _mb(torch.cuda.max_memory_allocated())
+        if components is not None:
+            seen = set()
+            components = dict(components(), **self.components)
+            record['components_mb'] = {name: _mb(tensor_bytes(obj, seen)) for name, obj in components.items()}
+            record['components_cpu_mb'] = _mb(tensor_bytes(list(components.values()), device_type='cpu'))
+        self.samples.append(record)
+        # -keep track of the highest usage during this task
+        stats = self.tasks.setdefault(task, {
+            'start_rss_mb': record['rss_mb'], 'start_peak_rss_mb': record['peak_rss_mb'],
+            'start_components_cpu_mb': record.get('components_cpu_mb'),
+        })
+        for key in ('rss_mb', 'cuda_mb'):
+            if record.get(key) is not None:
+                stats['max_'+key] = max(stats.get('max_'+key, 0.), record[key])
+        return record
+
+    def projected_peak_mb(self, task, components=None):
+        '''Projected peak RSS (in MB) for [task], given the <dict> [components] with the objects holding the tensors of
+        the components of continual training at the start of this task (see 'training_components').
+
+        This is the current RSS plus the CPU-memory that the components are expected to grow during this task (see
+        'expected_growth_bytes') plus the working memory of training (e.g., activations and replay batches), which is
+        taken as the largest increase of the RSS during a previous task that is not explained by the growth of its
+        components. Without [components], the largest increase of the RSS during a previous task is used instead.'''
+        current = _mb(_rss_bytes())
+        if current is None:
+            return None
+        previous = [stats for prev_task, stats in self.tasks.items() if (
+            prev_task<task and stats.get('peak_rss_mb') is not None and stats.get('start_rss_mb') is not None
+        )]
+        if components is None:
+            return current + max([stats['peak_rss_mb']-stats['start_rss_mb'] for stats in previous] + [0.])
+        working = [
+            stats['peak_rss_mb'] - stats['start_rss_mb'] - (stats['components_cpu_mb']-stats['start_components_cpu_mb'])
+            for stats in previous if (
+                stats.get('components_cpu_mb') is not None and stats.get('start_components_cpu_mb') is not None
+            )
+        ]
+        return current + _mb(expected_growth_bytes(components, device_type='cpu')) + max(working + [0.])
+
+    def start_task(self, task, components=None):
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats()
+        objects = None if components is None else dict(components(), **self.components)
+        self.sample("start", task, None if objects is None else (lambda: objects))
+        if self.budget_mb is not None:
+            projected = self.projected_peak_mb(task, objects)
+            self.tasks[task]['projected_peak_rss_mb'] = projected
+            if projected is not None and projected>self.budget_mb:
+                self.save()
+                raise MemoryBudgetExceeded(
+                    "Projected peak memory usage for task {} ({:.0f} MB) exceeds the budget of {:.0f} MB.".format(
+                        task, projected, self.budget_mb
+                    ))
+
+    def end_task(self, task, components=None):
+        record = self.sample("end", task, components)
+        stats = self.tasks[task]
+        # -the process-wide peak RSS is only informative about this task if it increased during this task
+        start_peak = stats.pop('start_peak_rss_mb')
+        if record['peak_rss_mb'] is not None and (start_peak is None or start_peak<record['peak_rss_mb']):
+            stats['peak_rss_mb'] = max(record['peak_rss_mb'], stats.get('max_rss_mb', 0.))
+        else:
+            stats['peak_rss_mb'] = stats.get('max_rss_mb')
+        if self.cuda:
+            stats['peak_cuda_mb'] = record['cuda_peak_mb']
+        stats['components_mb'] = record.get('components_mb')
+        stats['components_cpu_mb'] = record.get('components_cpu_mb')
+        self.print_task(task)
+        self.save()
+
+    def print_task(self, task):
+        stats = self.tasks[task]
+        print("\nMemory usage (task {}):".format(task))
+        print(" {:<24} {:>10}".format("", "MB"))
+        for name in ('start_rss_mb', 'peak_rss_mb', 'projected_peak_rss_mb', 'peak_cuda_mb'):
+            if stats.get(name) is not None:
+                print(" {:<24} {:>10.1f}".format(name[:-3], stats[name]))
+        for name, value in (stats.get('components_mb') or {}).items():
+            print(" {:<24} {:>10.1f}".format("  "+name, value))
+
+    def save(self):
+        '''Write all samples and the per-task summaries to [self.file_name] (if provided).'''
+        if self.file_name is not None:
+            with open(self.file_name, 'w') as f:
+                json.dump({'budget_mb': self.budget_mb, 'tasks': self.tasks, 'samples': self.samples}, f, indent=2)
@@ -6,6 +6,7 @@ from models.conv.nets import ConvLayers
 from models.fc.layers import fc_layer
 from models.fc.nets import MLP
 from models.cl.continual_learner import ContinualLearner
+import profiling
 
 
 class Classifier(ContinualLearner):
@@ -168,7 +169,8 @@ class Classifier(ContinualLearner):
             # If XdG is combined with replay, backward-pass needs to be done before new task-mask is applied
             if (self.mask_dict is not None) and (x_ is not None):
                 weighted_current_loss = rnt*loss_cur
-                weighted_current_loss.backward()
+                with profiling.phase("backward"):
+                    weighted_current_loss.backward()
         else:
             precision = predL = None
             # -> it's possible there is only "replay" [i.e., for offline with incremental task learning scenario]
@@ -227,7 +229,8 @@ class Classifier(ContinualLearner):
                 # If task-specific mask, backward pass needs to be performed before next task-mask is applied
                 if self.mask_dict is not None:
                     weighted_replay_loss_this_task = (1-rnt) * loss_replay[replay_id] / n_replays
-                    weighted_replay_loss_this_task.backward()
+                    with profiling.phase("backward"):
+                        weighted_replay_loss_this_task.backward()
 
         # Calculate total loss
         loss_replay = None if (x_ is None) else sum(loss_replay)/n_replays
@@ -249,9 +252,11 @@ class Classifier(ContinualLearner):
 
         # Backpropagate errors (if not yet done)
         if (self.mask_dict is None) or (x_ is None):
-            loss_total.backward()
+            with profiling.phase("backward"):
+                loss_total.backward()
         # Take optimization-step
-        self.optimizer.step()
+        with profiling.phase("step"):
+            self.optimizer.step()
 
 
         # Return the dictionary with different training-loss split in categories
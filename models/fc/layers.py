@@ -72,8 +72,11 @@ class fc_layer_split(nn.Module):
 class fc_layer_fixed_gates(nn.Module):
     '''Fully connected layer, with possibility of returning "pre-activations". Has fixed gates (of specified dimension).
 
-    Input:  [batch_size] x ... x [in_size] tensor         &        [batch_size] x [gate_size]
-    Output: [batch_size] x ... x [out_size] tensor'''
+    Input:  [batch_size] x ... x [in_size] tensor         &        [batch_size] x [gate_size]  ---OR---  [batch_size]
+    Output: [batch_size] x ... x [out_size] tensor
+
+    If [gate_input] is a <1D-tensor> with integer class-/task-IDs, the gates are directly selected as rows of the mask;
+    if it is a <2D-tensor> with a probability for every class-/task-ID, the gates are a weighted sum of these rows.'''
 
     def __init__(self, in_size, out_size, nl=nn.ReLU(),
                  drop=0., bias=True, excitability=False, excit_buffer=False, batch_norm=False,
@@ -86,10 +89,10 @@ class fc_layer_fixed_gates(nn.Module):
         if batch_norm:
             self.bn = nn.BatchNorm1d(out_size)
         if gate_size>0:
-            self.gate_mask = torch.tensor(
+            self.register_buffer('gate_mask', torch.tensor(
                 np.random.choice([0., 1.], size=(gate_size, out_size), p=[gating_prop, 1.-gating_prop]),
                 dtype=torch.float, device=device
-            )
+            ), persistent=False)
         if isinstance(nl, nn.Module):
             self.nl = nl
         elif not nl == "none":
@@ -98,7 +101,10 @@ class fc_layer_fixed_gates(nn.Module):
     def forward(self, x, gate_input=None, return_pa=False):
         input = self.dropout(x) if hasattr(self, 'dropout') else x
         pre_activ = self.bn(self.linear(input)) if hasattr(self, 'bn') else self.linear(input)
-        gate = torch.mm(gate_input, self.gate_mask) if hasattr(self, 'gate_mask') else None
+        if hasattr(self, 'gate_mask'):
+            gate = self.gate_mask[gate_input] if gate_input.dim()<2 else torch.mm(gate_input, self.gate_mask)
+        else:
+            gate = None
         gated_pre_activ = gate * pre_activ if hasattr(self, 'gate_mask') else pre_activ
         output = self.nl(gated_pre_activ) if hasattr(self, 'nl') else gated_pre_activ
         return (output, gated_pre_activ) if return_pa else output
@@ -116,7 +116,7 @@ class MLP_gates(nn.Module):
     Also possible to supply a [skip_first]- or [skip_last]-argument to the forward-function to only pass certain layers.
     With gates controlled by [gate_input] (of size [gate_size]) with a randomly selected masked (prop=[gating_prop]).
 
-    Input:  [batch_size] x ... x [size_per_layer[0]] tensor         &        [batch_size] x [gate_size]
+    Input:  [batch_size] x ... x [size_per_layer[0]] tensor         &        [batch_size] x [gate_size]  ---OR---  [batch_size]
     Output: (tuple of) [batch_size] x ... x [size_per_layer[-1]] tensor'''
 
     def __init__(self, input_size=1000, output_size=10, layers=2, hid_size=1000, hid_smooth=None, size_per_layer=None,
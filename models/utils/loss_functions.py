@@ -1,4 +1,4 @@
-import numpy as np
+import math
 import torch
 from torch.nn import functional as F
 
@@ -94,14 +94,11 @@ def weighted_average(tensor, weights=None, dim=0):
     return mean
 
 def to_one_hot(y, classes, device=None):
-    '''Convert <nd-array> or <tensor> with integers [y] to a 2D "one-hot" <tensor>.'''
+    '''Convert <nd-array> or <tensor> with integers [y] to a 2D "one-hot" <tensor> (on the device of [y] if a <tensor>).'''
     if type(y)==torch.Tensor:
-        device=y.device
-        y = y.cpu()
-    c = np.zeros(shape=[len(y), classes], dtype='float32')
-    c[range(len(y)), y] = 1.
-    c = torch.from_numpy(c)
-    return c if device is None else c.to(device)
+        device = y.device
+    y = torch.as_tensor(y, dtype=torch.long, device=device).view(-1, 1)
+    return torch.zeros(y.size(0), classes, device=device).scatter_(1, y, 1.)
 
 
 ##-------------------------------------------------------------------------------------------------------------------##
@@ -136,6 +133,18 @@ def log_Normal_diag(x, mean, log_var, average=False, dim=None):
     else:
         return torch.sum(log_normal, dim) if dim is not None else torch.sum(log_normal)
 
+def log_Normal_diag_mixture(x, means, log_vars, log_weights=None):
+    '''Calculate log-likelihood of samples [x] under mixture(s) of Gaussians with mu=[means], diag_var=exp[log_vars].
+    All modes are evaluated for all samples in one broadcasted operation, followed by a log-sum-exp over the modes.
+
+    [x]             <2D-tensor> [batch_size]x[dim]
+    [means]         <3D-tensor> [batch_size or 1]x[n_modes]x[dim]
+    [log_vars]      <3D-tensor> [batch_size or 1]x[n_modes]x[dim]
+    [log_weights]   None or <2D-tensor> [batch_size or 1]x[n_modes] with log mixing-weights (if None, uniform weights)'''
+    log_normal = log_Normal_diag(x.unsqueeze(1), mean=means, log_var=log_vars, average=False, dim=2)
+    log_weights = -math.log(means.size(1)) if log_weights is None else log_weights
+    return torch.logsumexp(log_normal + log_weights, dim=1)
+
 def log_Bernoulli(x, mean, average=False, dim=None):
     '''Calculate log-likelihood of sample [x] under Bernoulli distribution(s) with mu=[mean].
     NOTES: [dim]=-1    summing / averaging over all but the first dimension
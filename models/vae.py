@@ -1,6 +1,7 @@
 import math
 import numpy as np
 import torch
+import tqdm
 from torch import nn
 from torch.nn import functional as F
 from models.utils import loss_functions as lf, modules
@@ -8,6 +9,7 @@ from models.conv.nets import ConvLayers,DeconvLayers
 from models.fc.nets import MLP, MLP_gates
 from models.fc.layers import fc_layer,fc_layer_split, fc_layer_fixed_gates
 from models.cl.continual_learner import ContinualLearner
+import profiling
 from utils import get_data_loader
 import functools
 from itertools import chain
@@ -118,7 +120,6 @@ class AutoEncoder(ContinualLearner):
                                 output="none" if no_fnl else "normal", global_pooling=global_pooling,
                                 gated=conv_gated) if (convE is None) else convE
 
-        self.convE.to(self._device())
         self.flatten = modules.Flatten()
         #------------------------------calculate input/output-sizes--------------------------------#
         self.conv_out_units = self.convE.out_units(image_size)
@@ -211,7 +212,13 @@ class AutoEncoder(ContinualLearner):
             # -initialize
             self.z_class_means.data.normal_()
             self.z_class_logvars.data.normal_()
-        
+            # -for each class, the indeces of its modes (not stored in the 'state_dict', as it can always be recomputed)
+            if self.per_class:
+                self.register_buffer('class_modes', torch.arange(self.n_modes).view(classes, self.modes_per_class),
+                                     persistent=False)
+        # -random number generator used for sampling (created, and seeded from global RNG, when first needed)
+        self.sample_generator = None
+
         ### Whether to use JS-divergence instead of KL-divergence...
         self.kl_js = kl_js
         ### Whether to use the repulsion factor & its magnitude...
@@ -321,9 +328,12 @@ class AutoEncoder(ContinualLearner):
             return None
 
     def reparameterize(self, mu, logvar):
-        '''Perform "reparametrization trick" to make these stochastic variables differentiable.'''
+        '''Perform "reparametrization trick" to make these stochastic variables differentiable.
+
+        In eval()-mode the noise is drawn with the sampling-generator of the model (see '_get_sample_generator'), so that
+        evaluating the model or sampling from it does not use the global random number generator.'''
         std = logvar.mul(0.5).exp_()
-        eps = std.new(std.size()).normal_()#.requires_grad_()
+        eps = std.new(std.size()).normal_(generator=None if self.training else self._get_sample_generator())
         return eps.mul(std).add_(mu)
 
     def decode(self, z, gate_input=None):
@@ -335,9 +345,9 @@ class AutoEncoder(ContinualLearner):
 
         OUTPUT: - [image_recon]  <4D-tensor>'''
 
-        # -if needed, convert [gate_input] to one-hot vector
-        if self.dg_gates and (gate_input is not None) and (type(gate_input)==np.ndarray or gate_input.dim()<2):
-            gate_input = lf.to_one_hot(gate_input, classes=self.gate_size, device=self._device())
+        # -if needed, convert [gate_input] to tensor (class-/task-IDs are used to directly select the gates)
+        if self.dg_gates and (gate_input is not None) and type(gate_input)==np.ndarray:
+            gate_input = torch.as_tensor(gate_input, dtype=torch.long, device=self._device())
 
         # -put inputs through decoder
         hD = self.fromZ(z, gate_input=gate_input) if self.dg_gates else self.fromZ(z)
@@ -390,23 +400,66 @@ class AutoEncoder(ContinualLearner):
 
     ##------ SAMPLE FUNCTIONS --------##
 
+    def _get_sample_generator(self):
+        '''Return the random number generator used for sampling (on same device as <self>).'''
+        device = self._device()
+        if (self.sample_generator is None) or (not self.sample_generator.device==device):
+            self.sample_generator = torch.Generator(device=device)
+            self.sample_generator.manual_seed(int(torch.randint(0, 2**62, (1,)).item()))
+        return self.sample_generator
+
+    def __getstate__(self):
+        '''Replace the sampling-generator by its device and state, as older versions of PyTorch cannot copy or pickle
+        <torch.Generator>-objects (e.g., for "copy.deepcopy(model)").'''
+        state = super().__getstate__() if hasattr(super(), '__getstate__') else self.__dict__
+        state = dict(state)
+        generator = state.get('sample_generator')
+        if generator is not None:
+            state['sample_generator'] = None
+            state['_sample_generator_state'] = (str(generator.device), generator.get_state())
+        return state
+
+    def __setstate__(self, state):
+        '''Restore the sampling-generator from its saved device and state (see '__getstate__').'''
+        state = dict(state)
+        generator_state = state.pop('_sample_generator_state', None)
+        super().__setstate__(state)
+        if generator_state is not None:
+            device, rng_state = generator_state
+            self.sample_generator = torch.Generator(device=device)
+            self.sample_generator.set_state(rng_state)
+
+    def _sample_from(self, size, options=None, probs=None, n=None):
+        '''Sample [size] entries (with replacement) from <1D-tensor> [options] (or from range([n]) if [options] is None),
+        possibly weighted by (unnormalized) [probs]. All sampling happens on the device of <self>.'''
+        generator = self._get_sample_generator()
+        device = self._device()
+        n = len(options) if options is not None else n
+        if probs is None:
+            index = torch.randint(0, n, (size,), generator=generator, device=device)
+        else:
+            probs = torch.as_tensor(probs, dtype=torch.float, device=device).view(-1)
+            index = torch.multinomial(probs, size, replacement=True, generator=generator)
+        return index if options is None else options[index]
+
     def sample(self, size, allowed_classes=None, class_probs=None, sample_mode=None, allowed_domains=None, specific_classes=None,
                only_x=False, only_z=False, **kwargs):
         '''Generate [size] samples from the model. Outputs are tensors (not "requiring grad"), on same device as <self>.
 
         INPUT:  - [allowed_classes]     <list> of [class_ids] from which to sample
-                - [class_probs]         <list> with for each class the probability it is sampled from it
+                - [class_probs]         <list> or <1D-tensor> with for each class the probability it is sampled from it
                 - [sample_mode]         <int> to sample from specific mode of [z]-distr'n, overwrites [allowed_classes]
                 - [allowed_domains]     <list> of [task_ids] which are allowed to be used for 'task-gates' (if used)
                                           NOTE: currently only relevant if [scenario]=="domain"
                 - [specific_classes]    <tensor> of specific [class_ids] from which to sample, overwrites [sample_mode]
 
         OUTPUT: - [X]         <4D-tensor> generated images / image-features
-                - [y_used]    <ndarray> labels of classes intended to be sampled  (using <class_ids>)
-                - [task_used] <ndarray> labels of domains/tasks used for task-gates in decoder'''
+                - [y_used]    <1D-tensor> labels of classes intended to be sampled  (using <class_ids>)
+                - [task_used] <1D-tensor> labels of domains/tasks used for task-gates in decoder'''
 
         # set model to eval()-mode
         self.eval()
+        device = self._device()
 
         # pick for each sample the prior-mode to be used
         if self.prior=="GMM":
@@ -414,29 +467,22 @@ class AutoEncoder(ContinualLearner):
                 if sample_mode is None:
                     if (allowed_classes is None and class_probs is None) or (not self.per_class):
                         # -randomly sample modes from all possible modes (and find their corresponding class, if applicable)
-                        sampled_modes = np.random.randint(0, self.n_modes, size)
-                        y_used = np.array(
-                            [int(mode / self.modes_per_class) for mode in sampled_modes]
-                        ) if self.per_class else None
+                        sampled_modes = self._sample_from(size, n=self.n_modes)
                     else:
                         if allowed_classes is None:
-                            allowed_classes = [i for i in range(len(class_probs))]
+                            allowed_classes = list(range(len(class_probs)))
                         # -sample from modes belonging to [allowed_classes], possibly weighted according to [class_probs]
-                        allowed_modes = []     # -collect all allowed modes
-                        unweighted_probs = []  # -collect unweighted sample-probabilities of those modes
-                        for index, class_id in enumerate(allowed_classes):
-                            allowed_modes += list(range(class_id * self.modes_per_class, (class_id+1)*self.modes_per_class))
-                            if class_probs is not None:
-                                for i in range(self.modes_per_class):
-                                    unweighted_probs.append(class_probs[index].item())
-                        mode_probs = None if class_probs is None else [p / sum(unweighted_probs) for p in unweighted_probs]
-                        sampled_modes = np.random.choice(allowed_modes, size, p=mode_probs, replace=True)
-                        y_used = np.array([int(mode / self.modes_per_class) for mode in sampled_modes])
-                            
+                        allowed_modes = self.class_modes[
+                            torch.as_tensor(allowed_classes, dtype=torch.long, device=device)
+                        ].view(-1)
+                        mode_probs = None if class_probs is None else torch.as_tensor(
+                            class_probs, dtype=torch.float, device=device
+                        ).repeat_interleave(self.modes_per_class)
+                        sampled_modes = self._sample_from(size, options=allowed_modes, probs=mode_probs)
                 else:
                     # -always sample from the provided mode
-                    sampled_modes = np.repeat(sample_mode, size)
-                    y_used = np.repeat(int(sample_mode / self.modes_per_class), size) if self.per_class else None
+                    sampled_modes = torch.full((size,), sample_mode, dtype=torch.long, device=device)
+                y_used = torch.div(sampled_modes, self.modes_per_class, rounding_mode='floor') if self.per_class else None
 
             else: #### Getting random modes from specific list of classes...
                 sampled_modes = specific_classes
@@ -469,27 +515,28 @@ class AutoEncoder(ContinualLearner):
                 z = self.reparameterize(z_means, z_logvars)
 
         else:
-            z = torch.randn(size, self.z_dim).to(self._device())
+            z = torch.randn(size, self.z_dim, device=device, generator=self._get_sample_generator())
 
         # if no classes are selected yet, but they are needed for the "decoder-gates", select classes to be sampled
         if (y_used is None) and (self.dg_gates):
             if allowed_classes is None and class_probs is None:
-                y_used = np.random.randint(0, self.classes, size)
+                y_used = self._sample_from(size, n=self.classes)
             else:
                 if allowed_classes is None:
-                    allowed_classes = [i for i in range(len(class_probs))]
-                y_used = np.random.choice(allowed_classes, size, p=class_probs, replace=True)
+                    allowed_classes = list(range(len(class_probs)))
+                y_used = self._sample_from(size, options=torch.as_tensor(allowed_classes, dtype=torch.long, device=device),
+                                           probs=class_probs)
         # if the gates in the decoder are "task-gates", convert [y_used] to corresponding tasks (if Task-IL or Class-IL)
         #   or simply sample which tasks should be generated (if Domain-IL) from [allowed_domains]
         task_used = None
         if self.dg_gates and self.dg_type=="task":
             if self.scenario=="domain":
-                task_used = np.random.randint(0,self.gate_size,size) if (allowed_domains is None) else np.random.choice(
-                    allowed_domains, size, replace=True
+                task_used = self._sample_from(size, n=self.gate_size) if (allowed_domains is None) else self._sample_from(
+                    size, options=torch.as_tensor(allowed_domains, dtype=torch.long, device=device)
                 )
             else:
                 classes_per_task = int(self.classes/self.gate_size)
-                task_used = np.array([int(class_id / classes_per_task) for class_id in y_used])
+                task_used = torch.div(y_used, classes_per_task, rounding_mode='floor')
 
         # decode z into image X
         with torch.no_grad():
@@ -506,6 +553,33 @@ class AutoEncoder(ContinualLearner):
 
 
 
+    def sample_iter(self, total, chunk_size=128, out=None, memmap_file=None, **kwargs):
+        '''Generate [total] samples from the model in chunks of (at most) [chunk_size] samples, which are yielded in turn.
+        This way only the decoder activations of a single chunk need to be kept in memory at any time.
+
+        INPUT:  - [out]                 None or <tensor> / <np-array> with [total] as first dimension, into which all
+                                          generated samples are (also) written (e.g., a preallocated buffer or np.memmap)
+                - [memmap_file]         None or <str> with path of a (new) .npy-file into which all generated samples
+                                          are written (as memory-mapped array, so they don't all need to fit in memory)
+                - [**kwargs]            other arguments are passed on to 'sample' (e.g., [allowed_classes], [class_probs])
+
+        OUTPUT: (per chunk) - [X], [y_used], [task_used] (see 'sample')'''
+
+        n_done = 0
+        while n_done < total:
+            n = min(chunk_size, total-n_done)
+            X, y_used, task_used = self.sample(n, **kwargs)[:3]
+            # -if requested, write the samples of this chunk to memory-mapped file and/or into provided output
+            if (memmap_file is not None) and (out is None):
+                out = np.lib.format.open_memmap(memmap_file, mode='w+', dtype=np.float32, shape=(total, *X.shape[1:]))
+            if out is not None:
+                out[n_done:(n_done+n)] = X.cpu().numpy() if isinstance(out, np.ndarray) else X.to(out.device)
+            n_done += n
+            yield X, y_used, task_used
+        if isinstance(out, np.memmap):
+            out.flush()
+
+
     ##------ LOSS FUNCTIONS --------##
 
     def calculate_recon_loss(self, x, x_recon, average=False):
@@ -549,49 +623,35 @@ class AutoEncoder(ContinualLearner):
             log_p_z = lf.log_Normal_standard(z, average=False, dim=1)   # [batch_size]
 
         if self.prior == "GMM":
-            ## Get [means] and [logvars] of all (possible) modes
-            allowed_modes = list(range(self.n_modes))
-            # -if we don't use the specific modes of a target, we could select modes based on list of classes
-            if (y is None) and (allowed_classes is not None) and self.per_class:
-                allowed_modes = []
-                for class_id in allowed_classes:
-                    allowed_modes += list(range(class_id * self.modes_per_class, (class_id + 1) * self.modes_per_class))
-            # -calculate/retireve the means and logvars for the selected modes
-            prior_means = self.z_class_means[allowed_modes, :]
-            prior_logvars = self.z_class_logvars[allowed_modes, :]
-            # -rearrange / select for each batch prior-modes to be used
-            z_expand = z.unsqueeze(1)  # [batch_size] x 1 x [z_dim]
-            means = prior_means.unsqueeze(0)  # 1 x [n_modes] x [z_dim]
-            logvars = prior_logvars.unsqueeze(0)  # 1 x [n_modes] x [z_dim]
-
-            ## Calculate "log_p_z" (log-likelihood of "reparameterized" [z] based on selected priors)
-            n_modes = self.modes_per_class if (
-                ((y is not None) or (y_prob is not None)) and self.per_class
-            ) else len(allowed_modes)
-            a = lf.log_Normal_diag(z_expand, mean=means, log_var=logvars, average=False, dim=2) - math.log(n_modes)
-            # --> for each element in batch, calculate log-likelihood for all pseudoinputs: [batch_size] x [n_modes]
             if (y is not None) and self.per_class:
-                modes_list = list()
-                for i in range(len(y)):
-                    target = y[i].item()
-                    modes_list.append(list(range(target * self.modes_per_class, (target + 1) * self.modes_per_class)))
-                modes_tensor = torch.LongTensor(modes_list).to(self._device())
-                a = a.gather(dim=1, index=modes_tensor)
-                # --> reduce [a] to size [batch_size]x[modes_per_class] (ie, per batch only keep modes of [y])
-                #     but within the batch, elements can have different [y], so this reduction couldn't be done before
-            a_max, _ = torch.max(a, dim=1)  # [batch_size]
-            # --> for each element in batch, take highest log-likelihood over all pseudoinputs
-            #     this is calculated and used to avoid underflow in the below computation
-            a_exp = torch.exp(a - a_max.unsqueeze(1))  # [batch_size] x [n_modes]
-            if (y is None) and (y_prob is not None) and self.per_class:
-                batch_size = y_prob.size(0)
-                y_prob = y_prob.view(-1, 1).repeat(1, self.modes_per_class).view(batch_size, -1)
-                # ----> extend probabilities per class to probabilities per mode; y_prob: [batch_size] x [n_modes]
-                a_logsum = torch.log(torch.clamp(torch.sum(y_prob * a_exp, dim=1), min=1e-40))
+                # -for each element in batch, only use the modes of its target-class: [batch_size] x [modes_per_class]
+                modes = y.view(-1, 1) * self.modes_per_class + torch.arange(self.modes_per_class, device=y.device)
+                means = self.z_class_means[modes]      # [batch_size] x [modes_per_class] x [z_dim]
+                logvars = self.z_class_logvars[modes]  # [batch_size] x [modes_per_class] x [z_dim]
+                log_weights = None
             else:
-                a_logsum = torch.log(torch.clamp(torch.sum(a_exp, dim=1), min=1e-40))  # -> sum over modes: [batch_size]
-            log_p_z = a_logsum + a_max  # [batch_size]
-            
+                # -if we don't use the specific modes of a target, we could select modes based on list of classes
+                if (allowed_classes is not None) and self.per_class:
+                    modes = self.class_modes[
+                        torch.as_tensor(allowed_classes, dtype=torch.long, device=z.device)
+                    ].view(-1)
+                    means = self.z_class_means[modes].unsqueeze(0)      # 1 x [n_modes] x [z_dim]
+                    logvars = self.z_class_logvars[modes].unsqueeze(0)  # 1 x [n_modes] x [z_dim]
+                else:
+                    means = self.z_class_means.unsqueeze(0)             # 1 x [n_modes] x [z_dim]
+                    logvars = self.z_class_logvars.unsqueeze(0)         # 1 x [n_modes] x [z_dim]
+                # -if provided, weigh the modes of each class by the probability of that class
+                if (y_prob is not None) and self.per_class:
+                    log_weights = torch.log(torch.clamp(y_prob, min=1e-40)).repeat_interleave(
+                        self.modes_per_class, dim=1
+                    ) - math.log(self.modes_per_class)                  # [batch_size] x [n_modes]
+                else:
+                    log_weights = None
+
+            ## Calculate "log_p_z" (log-likelihood of "reparameterized" [z] based on selected priors)
+            log_p_z = lf.log_Normal_diag_mixture(z, means=means, log_vars=logvars, log_weights=log_weights)
+            # --> all modes are evaluated for all elements in one go, followed by log-sum-exp over modes: [batch_size]
+
         return log_p_z
 
 
@@ -830,7 +890,7 @@ class AutoEncoder(ContinualLearner):
 
         ###-----Variational loss-----###
         if logvar is not None:
-            actual_y = torch.tensor([allowed_classes[i.item()] for i in y]).to(self._device()) if (
+            actual_y = torch.as_tensor(allowed_classes, dtype=torch.long, device=y.device)[y] if (
                 (allowed_classes is not None) and (y is not None)
             ) else y
             if (y is None and scores is not None):
@@ -933,10 +993,17 @@ class AutoEncoder(ContinualLearner):
 
     ##------ EVALUATION FUNCTIONS --------##
 
-    def calculate_recon_error(self, dataset, batch_size=128, max_repatches=None, average=False):
+    def calculate_recon_error(self, dataset, batch_size=128, max_repatches=None, average=False, from_hidden=False,
+                              summary=False):
         '''Calculate reconstruction error of the model for each datapoint in [dataset].
 
-        [average]     <bool>, if True, reconstruction-error is averaged over all pixels/units; otherwise it is summed'''
+        [average]       <bool>, if True, reconstruction-error is averaged over all pixels/units; otherwise it is summed
+        [from_hidden]   <bool>, if True, [dataset] already contains hidden feature representations (see 'input_to_hidden')
+        [summary]       <bool>, if True, only running statistics are kept and the (mean, std) over datapoints is returned
+
+        OUTPUT:         <np-array> with reconstruction error of each evaluated datapoint in [dataset]  ---OR---
+                        <tuple> (mean, std) of the reconstruction errors (if [summary] is True; both are NaN if
+                                [dataset] is empty)'''
 
         # This function currently does not (always) work for Task-IL scenario or for decoder-gates with [dg_type]="task"
         if self.scenario=="task" or (self.dg_gates and self.dg_prop>0. and self.dg_type=="task"):
@@ -945,43 +1012,97 @@ class AutoEncoder(ContinualLearner):
             )
 
         # Create data-loader
-        data_loader = get_data_loader(dataset, batch_size=batch_size, cuda=self._is_on_cuda())
+        data_loader = get_data_loader(dataset, batch_size=batch_size, cuda=self._is_on_cuda(), shuffle=False)
+        n_total = len(dataset) if max_repatches is None else min(len(dataset), max_repatches*batch_size)
 
-        # Break loop if max number of batches has been reached
+        # Preallocate output (or, if only the summary is needed, initiate running mean and sum of squared differences)
+        if summary:
+            mean, M2 = 0., 0.
+        else:
+            all_res = np.zeros(n_total, dtype=np.float32)
+
+        n_done = 0
         for index, (x, y) in enumerate(data_loader):
+            # Break loop if max number of batches has been reached
             if max_repatches is not None and index >= max_repatches:
                 break
 
             # Move [x] and [y] to correct device
             x = x.to(self._device())
-            y = y.to(self._device())
+            y = y.to(self._device()).view(-1)   #--> the collate-function squeezes [y] of a batch with a single datapoint
+            n = x.size(0)
 
-            # If internal replay, convert inputs to hidden feature representations
-            if self.hidden:
-                with torch.no_grad():
+            with torch.no_grad():
+                # If internal replay, convert inputs to hidden feature representations
+                if self.hidden and not from_hidden:
                     x = self.input_to_hidden(x)
 
-            # Run forward pass of model to get [z_mean]
-            with torch.no_grad():
+                # Run forward pass of model to get [z_mean]
                 z_mean, _, _, _, _ = self.encode(x)
 
-            # Run backward pass of model to reconstruct input
-            gate_input = y.expand(x.size(0)) if self.dg_gates else None
-            with torch.no_grad():
+                # Run backward pass of model to reconstruct input
+                gate_input = y.expand(n) if self.dg_gates else None
                 x_recon = self.decode(z_mean, gate_input=gate_input)
 
-            # Calculate reconstruction error
-            recon_error = self.calculate_recon_loss(x.view(x.size(0), -1), x_recon.view(x.size(0), -1), average=average)
-
-            # Concatanate the calculated reconstruction errors for all evaluated samples
-            all_res = torch.cat([all_res, recon_error]) if index > 0 else recon_error
-
-        # Convert to <np-array> (with one entry for each evaluated sample in [dataset]) and return
-        return all_res.cpu().numpy()
-
-
-    def estimate_loglikelihood(self, dataset, S=5000, batch_size=128, max_n=None):
-        '''Estimate average marginal log-likelihood for x|y of the model on [dataset] using [S] importance samples.'''
+                # Calculate reconstruction error
+                recon_error = self.calculate_recon_loss(x.view(n, -1), x_recon.view(n, -1), average=average)
+
+            if summary:
+                # Update running mean and variance (Welford's algorithm, with each batch merged in at once)
+                recon_error = recon_error.double()
+                batch_mean = recon_error.mean().item()
+                batch_M2 = (recon_error - batch_mean).pow(2).sum().item()
+                delta = batch_mean - mean
+                mean += delta * n / (n_done + n)
+                M2 += batch_M2 + delta**2 * n_done * n / (n_done + n)
+            else:
+                # Write the calculated reconstruction errors into the output array
+                all_res[n_done:(n_done+n)] = recon_error.cpu().numpy()
+            n_done += n
+
+        # Return (mean, std) or <np-array> (with one entry for each evaluated sample in [dataset])
+        if summary and n_done==0:
+            return float('nan'), float('nan')    #--> no datapoints were evaluated
+        return (mean, np.sqrt(M2 / n_done)) if summary else all_res
+
+
+    def _floats_per_importance_sample(self, y):
+        '''Return the # of floats computed for each importance sample in 'estimate_loglikelihood': the outputs of all
+        layers of the decoder (measured by decoding a single sample with class [y]), the sample itself and the terms
+        of the prior's log-likelihood (which for a GMM-prior are computed for all its (selected) modes at once).'''
+        n_floats = [0]
+        def count_output(module, input, output):
+            if isinstance(output, torch.Tensor):
+                n_floats[0] += output.numel()
+        decoder = [self.fromZ, self.fcD, self.to_image, self.convD]
+        hooks = [module.register_forward_hook(count_output) for part in decoder for module in part.modules() if (
+            len(list(module.children()))==0
+        )]
+        try:
+            with torch.no_grad():
+                self.decode(torch.zeros(1, self.z_dim, device=self._device()), gate_input=y if self.dg_gates else None)
+        finally:
+            for hook in hooks:
+                hook.remove()
+        modes = 0 if self.prior!="GMM" else (self.modes_per_class if self.per_class else self.n_modes)
+        return n_floats[0] + self.z_dim + 3 * modes * self.z_dim
+
+    def estimate_loglikelihood(self, dataset, S=5000, batch_size=128, max_n=None, max_mb=256, tol=None, from_hidden=False,
+                               verbose=False):
+        '''Estimate average marginal log-likelihood for x|y of the model on [dataset] using [S] importance samples.
+
+        The datapoints are processed in batches of [batch_size], whereby the importance samples for all datapoints in a
+        batch are drawn together (as [batch_size] x [S_chunk] x [z_dim]), with [S_chunk] chosen such that the tensors
+        computed for these importance samples (i.e., all activations of the decoder and the prior's log-likelihood terms,
+        see '_floats_per_importance_sample') take up roughly at most [max_mb] MB.
+
+        [max_n]         <int>; if provided, only the first [max_n] datapoints of [dataset] are evaluated
+        [tol]           <float>; if provided, stop drawing importance samples for a batch once the estimates of all its
+                                 datapoints changed less than [tol] (in nats) with the last chunk (i.e., [S] is a budget)
+        [from_hidden]   <bool>; if True, [dataset] already contains hidden feature representations (see 'input_to_hidden')
+        [verbose]       <bool>; if True, a progress-bar is shown
+
+        OUTPUT:         <np-array> with the estimated log-likelihood of each evaluated datapoint in [dataset]'''
 
         # This function currently does not (always) work for Task-IL scenario or for decoder-gates with [dg_type]="task"
         if self.scenario=="task" or (self.dg_gates and self.dg_prop>0. and self.dg_type=="task"):
@@ -989,67 +1110,82 @@ class AutoEncoder(ContinualLearner):
                 "Function 'estimate_loglikelihood' not yet implemented for Task-IL scenario or task-based decoder-gates"
             )
 
-        # Create data-loader to give batches of size 1
-        data_loader = get_data_loader(dataset, batch_size=1, cuda=self._is_on_cuda())
-
-        # List to store estimated log-likelihood for each datapoint
-        ll_per_datapoint = []
-
-        # Break loop if max number of samples has been reached
-        for index, (x, y) in enumerate(data_loader):
-            if max_n is not None and index >= max_n:
+        # Create data-loader
+        data_loader = get_data_loader(dataset, batch_size=batch_size, cuda=self._is_on_cuda(), shuffle=False)
+        n_total = len(dataset) if max_n is None else min(max_n, len(dataset))
+
+        # Array to store estimated log-likelihood for each datapoint
+        ll_per_datapoint = np.zeros(n_total, dtype=np.float32)
+
+        n_done = 0
+        floats_per_sample = None
+        progress = tqdm.tqdm(total=n_total, desc="Log-likelihood", disable=not verbose)
+        for x, y in data_loader:
+            # Break loop if max number of samples has been reached
+            if n_done >= n_total:
                 break
+            y = y.view(-1)   #--> the collate-function squeezes [y] of a batch with a single datapoint
+            x = x[:(n_total-n_done)].to(self._device())
+            y = y[:(n_total-n_done)].to(self._device())
+            n = x.size(0)
 
-            # Move [x] and [y] to correct device
-            x = x.to(self._device())
-            y = y.to(self._device())
-
-            # If hidden replay, convert inputs to hidden feature representations
-            if self.hidden:
-                with torch.no_grad():
+            with torch.no_grad():
+                # If hidden replay, convert inputs to hidden feature representations
+                if self.hidden and not from_hidden:
                     x = self.input_to_hidden(x)
 
-            # Run forward pass of model to get [z_mu] and [z_logvar]
-            with torch.no_grad():
+                # Run forward pass of model to get [z_mu] and [z_logvar]
                 z_mu, z_logvar, _, _, _ = self.encode(x)
-
-            # Importance samples will be calcualted in batches, get number of required batches
-            repeats = int(np.ceil(S / batch_size))
-
-            # For each importance sample, calculate log_likelihood
-            for rep in range(repeats):
-                batch_size_current = (S % batch_size) if rep==(repeats-1) else batch_size
-
-                # Reparameterize (i.e., sample z_s)
-                z = self.reparameterize(z_mu.expand(batch_size_current, -1), z_logvar.expand(batch_size_current, -1))
-
-                # Calculate log_p_z
-                with torch.no_grad():
-                    log_p_z = self.calculate_log_p_z(z, y=y.expand(batch_size_current))
-
-                # Calculate log_q_z_x
-                log_q_z_x = lf.log_Normal_diag(z, mean=z_mu, log_var=z_logvar, average=False, dim=1)
-
-                # Calcuate p_x_z
-                # -reconstruct input
-                gate_input = y.expand(batch_size_current) if self.dg_gates else None
-                with torch.no_grad():
-                    x_recon = self.decode(z, gate_input=gate_input)
-                # -calculate p_x_z (under Gaussian observation model with unit variance)
-                log_p_x_z = lf.log_Normal_standard(x=x, mean=x_recon, average=False, dim=-1)
-
-                # Calculate log-likelihood for each importance sample
-                log_likelihoods = log_p_x_z + log_p_z - log_q_z_x
-
-                # Concatanate the log-likelihoods of all importance samples
-                all_lls = torch.cat([all_lls, log_likelihoods]) if rep > 0 else log_likelihoods
-
-            # Calculate average log-likelihood over all importance samples for this test sample
-            #  (for this, convert log-likelihoods back to likelihoods before summing them!)
-            log_likelihood = all_lls.logsumexp(dim=0) - np.log(S)
-
-            # Add it to list
-            ll_per_datapoint.append(log_likelihood.cpu().numpy())
+                z_mu = z_mu.unsqueeze(1)          # [n] x 1 x [z_dim]
+                z_logvar = z_logvar.unsqueeze(1)  # [n] x 1 x [z_dim]
+                x = x.view(n, 1, -1)              # [n] x 1 x [x_dim]
+
+                # Importance samples are calculated in chunks, get number of samples per datapoint in each chunk
+                if floats_per_sample is None:
+                    floats_per_sample = self._floats_per_importance_sample(y[:1])
+                S_chunk = int(max(1, min(S, max_mb * 2**20 // (4 * n * floats_per_sample))))
+
+                # Tensor to store log-likelihood of each importance sample: [n] x [S]
+                all_lls = torch.empty(n, S, device=self._device())
+                S_done = 0
+                ll_estimate = None
+                while S_done < S:
+                    s = min(S_chunk, S-S_done)
+
+                    # Reparameterize (i.e., sample z_s): [n] x [s] x [z_dim]
+                    z = self.reparameterize(z_mu.expand(-1, s, -1), z_logvar.expand(-1, s, -1))
+
+                    # Calculate log_p_z and log_q_z_x
+                    log_p_z = self.calculate_log_p_z(z.view(n*s, -1), y=y.repeat_interleave(s)).view(n, s)
+                    log_q_z_x = lf.log_Normal_diag(z, mean=z_mu, log_var=z_logvar, average=False, dim=2)
+
+                    # Calcuate p_x_z
+                    # -reconstruct input
+                    gate_input = y.repeat_interleave(s) if self.dg_gates else None
+                    x_recon = self.decode(z.view(n*s, -1), gate_input=gate_input)
+                    # -calculate p_x_z (under Gaussian observation model with unit variance)
+                    log_p_x_z = lf.log_Normal_standard(x=x, mean=x_recon.view(n, s, -1), average=False, dim=2)
+
+                    # Store log-likelihood for each importance sample
+                    all_lls[:, S_done:(S_done+s)] = log_p_x_z + log_p_z - log_q_z_x
+                    S_done += s
+
+                    # If requested, stop early once the estimates of all datapoints have converged
+                    if tol is not None:
+                        previous_estimate = ll_estimate
+                        ll_estimate = all_lls[:, :S_done].logsumexp(dim=1) - np.log(S_done)
+                        if (previous_estimate is not None) and (ll_estimate-previous_estimate).abs().max().item()<tol:
+                            break
+
+                # Calculate average log-likelihood over all importance samples for each datapoint
+                #  (for this, convert log-likelihoods back to likelihoods before summing them!)
+                log_likelihood = all_lls[:, :S_done].logsumexp(dim=1) - np.log(S_done)
+
+            # Add them to array
+            ll_per_datapoint[n_done:(n_done+n)] = log_likelihood.cpu().numpy()
+            n_done += n
+            progress.update(n)
+        progress.close()
 
         return ll_per_datapoint
 
@@ -1169,7 +1305,8 @@ class AutoEncoder(ContinualLearner):
                             param.requires_grad = False
 
                 # Update gradients...
-                weighted_current_loss.backward()
+                with profiling.phase("backward"):
+                    weighted_current_loss.backward()
 
 
         ##--(2)-- REPLAYED DATA --##
@@ -1555,7 +1692,8 @@ class AutoEncoder(ContinualLearner):
                                 param.requires_grad = False
 
                     # Update gradients...
-                    weighted_replay_loss_this_task.backward()
+                    with profiling.phase("backward"):
+                        weighted_replay_loss_this_task.backward()
         
         # Calculate total loss
         loss_replay = None if (x_ is None) else sum(loss_replay)/n_replays
@@ -1616,7 +1754,8 @@ class AutoEncoder(ContinualLearner):
                         param.requires_grad = False
 
             # Update gradients...
-            loss_total.backward(retain_graph=True)
+            with profiling.phase("backward"):
+                loss_total.backward(retain_graph=True)
 
         #### Before encoder optimisation step, set requires_grad = True for encoder &
         #### encoder & projection head, and requires_grad = False for
@@ -1635,13 +1774,16 @@ class AutoEncoder(ContinualLearner):
     
             #### Update encoder gradients...
             if self.simsiam:
-                loss_total_ssl.backward()
+                with profiling.phase("backward"):
+                    loss_total_ssl.backward()
             else:
-                loss_total_contr.backward()
+                with profiling.phase("backward"):
+                    loss_total_contr.backward()
 
             
             #### Take encoder optimization-step...
-            self.E_optimizer.step()
+            with profiling.phase("step"):
+                self.E_optimizer.step()
 
         if self.contrastive:
             for param in self.parameters():
@@ -1655,11 +1797,13 @@ class AutoEncoder(ContinualLearner):
                     param.requires_grad = False
             
             # Take optimization-step
-            self.optimizer.step()
+            with profiling.phase("step"):
+                self.optimizer.step()
 
         else:
             # Take optimization-step
-            self.optimizer.step()
+            with profiling.phase("step"):
+                self.optimizer.step()
 
         # Return the dictionary with different training-loss split in categories ###
         return {
@@ -26,18 +26,33 @@ def add_general_options(parser, single_task=False, generative=False, compare_cod
 
     if single_task and generative:
             parser.add_argument('--save-all', action='store_true', help="also store conv- and deconv-layers")
+    if single_task:
+        parser.add_argument('--keep-last', type=int, default=None, metavar='K',
+                            help="keep last K checkpoints saved during training (default: only the latest)")
     if not only_MNIST:
         parser.add_argument('--convE-stag', type=str, metavar='STAG', default='none',help="tag for saving convE-layers")
     parser.add_argument('--full-stag', type=str, metavar='STAG', default='none', help="tag for saving full model")
+    parser.add_argument('--blob-store', action='store_true',
+                        help="save models as manifest with their tensors in shared, deduplicated blobs in [m_dir]/blobs")
     parser.add_argument('--full-ltag', type=str, metavar='LTAG', default='none', help="tag for loading full model")
     parser.add_argument('--test', action='store_false', dest='train', help='evaluate previously saved model')
     if not single_task:
         parser.add_argument('--get-stamp', action='store_true', help='print param-stamp & exit')
+        parser.add_argument('--checkpoint', action='store_true',
+                            help="save resumable training-state in [m_dir] after each task")
+        parser.add_argument('--checkpoint-every', type=int, default=None, metavar='N',
+                            help="also save the training-state every N iters (implies --checkpoint)")
+        parser.add_argument('--resume', action='store_true', help="continue training from saved training-state")
     if compare_code in ("none"):
         parser.add_argument('--seed', type=int, default=0, help='random seed (for each random-module used)')
     else:
         parser.add_argument('--seed', type=int, default=11, help='[first] random seed (for each random-module used)')
         parser.add_argument('--n-seeds', type=int, default=1, help='how often to repeat?')
+    if compare_code in ("all", "hyper", "replay", "bir"):
+        parser.add_argument('--workers', type=int, default=1,
+                            help="# of experiments to run in parallel processes (with GPUs, each worker uses its own)")
+        parser.add_argument('--threads-per-job', type=int, default=None, metavar='N',
+                            help="# of threads per experiment (default: # of cores / workers)")
     parser.add_argument('--no-gpus', action='store_false', dest='cuda', help="don't use GPUs")
     parser.add_argument('--data-dir', type=str, default='./store/datasets', dest='d_dir', help="default: %(default)s")
     parser.add_argument('--model-dir', type=str, default='./store/models', dest='m_dir', help="default: %(default)s")
@@ -53,6 +68,8 @@ def add_eval_options(parser, single_task=False, generative=False, compare_code="
     eval = parser.add_argument_group('Evaluation Parameters')
     eval.add_argument('--pdf', action='store_true', help="generate pdf with plots for individual experiment(s)")
     eval.add_argument('--visdom', action='store_true', help="use visdom for on-the-fly plots")
+    eval.add_argument('--visdom-log', type=str, metavar="FILE", default=None,
+                      help="write visdom-plots to JSONL-file (replay with 'python -m visual.visdom FILE')")
     if compare_code=="none" and not single_task:
         eval.add_argument('--log-per-task', action='store_true', help="set all visdom-logs to [iters]")
     if compare_code=="none":
@@ -60,6 +77,18 @@ def add_eval_options(parser, single_task=False, generative=False, compare_code="
         eval.add_argument('--prec-log', type=int, default=None if single_task else 500, metavar="N",
                           help="# iters after which to plot precision")
     eval.add_argument('--prec-n', type=int, default=1024, help="# samples for evaluating accuracy (visdom-plots)")
+    if not single_task:
+        eval.add_argument('--async-eval', action='store_true',
+                          help="run evaluation callbacks on a separate thread (on snapshots of the weights)")
+        eval.add_argument('--profile', action='store_true',
+                          help="time the phases of each training iteration (per-task summaries are saved in [r_dir])")
+        eval.add_argument('--profile-trace', action='store_true', help="with --profile, also save a Chrome-trace")
+        eval.add_argument('--memory', action='store_true',
+                          help="track memory usage at task boundaries (per-run report is saved in [r_dir])")
+        eval.add_argument('--memory-log', type=int, default=None, metavar="N",
+                          help="with --memory, also sample memory usage every N iters")
+        eval.add_argument('--memory-budget', type=float, default=None, metavar="MB",
+                          help="with --memory, don't start a task if its projected peak RSS exceeds this budget")
     if compare_code=="none" and generative:
             eval.add_argument('--sample-log', type=int, default=1000, metavar="N",
                               help="# iters after which to plot samples")
@@ -68,6 +97,12 @@ def add_eval_options(parser, single_task=False, generative=False, compare_code="
         eval.add_argument('--no-samples', action='store_true', help="don't plot generated/reconstructed images")
         if not only_MNIST:
             eval.add_argument('--eval-tag', type=str, metavar="ETAG", default="none", help="tag for evaluation model")
+            eval.add_argument('--prd-clusters', type=int, default=20, metavar="N",
+                              help="# clusters for computing Precision & Recall")
+            eval.add_argument('--prd-workers', type=int, default=1, metavar="N",
+                              help="# processes for the clustering runs of Precision & Recall")
+            eval.add_argument('--prd-reuse-ref', action='store_true',
+                              help="Precision & Recall: assign samples to (cached) clusters fitted on test-set only")
         if (not only_MNIST) and compare_code=="bir":
             eval.add_argument('--eval-gen', action='store_true',
                               help="instead of accuracy, evaluate quality of generators")
@@ -86,6 +121,8 @@ def add_task_options(parser, only_MNIST=False, single_task=False, compare_code="
         task_choices = MNIST_tasks if only_MNIST else MNIST_tasks+image_tasks
         task_default = 'splitMNIST' if only_MNIST else 'CIFAR100'
     task_params.add_argument('--experiment', type=str, default=task_default, choices=task_choices)
+    task_params.add_argument('--synthetic', action='store_true',
+                             help="use synthetic images with the same shapes & classes (no download needed)")
     if not single_task:
         task_params.add_argument('--scenario', type=str, default='task', choices=['task', 'domain', 'class'])
         # 'task':   each task has own output-units, always only those units are considered
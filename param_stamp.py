@@ -39,8 +39,9 @@ def get_param_stamp(args, model_name, verbose=True, replay=False, replay_model_n
     multi_n_stamp = "{n}-{set}{of}".format(
         n=args.tasks, set=args.scenario, of="OL" if checkattr(args, 'only_last') else ""
     ) if hasattr(args, "tasks") else ""
-    task_stamp = "{exp}{norm}{aug}{multi_n}".format(
-        exp=args.experiment, norm="-N" if hasattr(args, 'normalize') and args.normalize else "",
+    task_stamp = "{exp}{syn}{norm}{aug}{multi_n}".format(
+        exp=args.experiment, syn="-synth" if checkattr(args, 'synthetic') else "",
+        norm="-N" if hasattr(args, 'normalize') and args.normalize else "",
         aug="+" if hasattr(args, "augment") and args.augment else "", multi_n=multi_n_stamp
     )
     if verbose:
@@ -0,0 +1,173 @@
+import contextlib
+import json
+import threading
+import time
+import weakref
+import torch
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+# Timer of the current run (None if profiling is disabled, in which case 'phase' returns a shared no-op context)
+_TIMER = None
+_NULL_PHASE = contextlib.nullcontext()
+# Models whose forward passes are timed (copies of these models, e.g. made by 'copy.deepcopy', also get the hooks
+#  registered by 'time_forward', but as they are not in this set their forward passes are not timed)
+_TIMED_MODELS = weakref.WeakSet()
+
+
+def start(sync_cuda=False, trace=False):
+    '''Enable timing of the phases marked with 'phase' (from the calling thread).
+
+    [sync_cuda]     <bool>, synchronize cuda at the start and end of each phase (needed for correct GPU-timings)
+    [trace]         <bool>, also store all individual phases (needed for 'save_trace')'''
+    global _TIMER
+    _TIMER = PhaseTimer(sync_cuda=sync_cuda, trace=trace)
+    return _TIMER
+
+
+def stop():
+    '''Disable timing of phases.'''
+    global _TIMER
+    _TIMER = None
+
+
+def active():
+    return _TIMER is not None
+
+
+def phase(name):
+    '''Return context within which the time spent is added to phase [name] (which is nested in the enclosing phase).'''
+    if (_TIMER is None) or (threading.get_ident()!=_TIMER.thread):
+        return _NULL_PHASE
+    return _Phase(_TIMER, name)
+
+
+def report(title="Time per phase", file_name=None, **info):
+    '''If profiling is enabled, print (and if [file_name] is provided, save as json-file together with the entries in
+    [info]) the time spent per phase since the previous report, after which these statistics are reset.'''
+    if _TIMER is not None:
+        _TIMER.print_summary(title=title)
+        if file_name is not None:
+            _TIMER.save_summary(file_name, **info)
+        _TIMER.reset()
+
+
+def save_trace(file_name):
+    '''If profiling is enabled (with [trace]=True), write all timed phases so far to [file_name] as Chrome-trace.'''
+    if _TIMER is not None:
+        _TIMER.save_trace(file_name)
+
+
+def time_forward(model):
+    '''Time all forward passes of [model] as phase "forward" (if profiling is enabled).'''
+    _TIMED_MODELS.add(model)
+    return [model.register_forward_pre_hook(_forward_pre_hook), model.register_forward_hook(_forward_hook)]
+
+
+def _forward_pre_hook(module, input):
+    if (_TIMER is not None) and (threading.get_ident()==_TIMER.thread) and (module in _TIMED_MODELS):
+        _TIMER.push("forward")
+
+
+def _forward_hook(module, input, output):
+    if (_TIMER is not None) and (threading.get_ident()==_TIMER.thread) and (module in _TIMED_MODELS) and (
+            len(_TIMER.stack)>0 and _TIMER.stack[-1][0].endswith("forward")
+    ):
+        _TIMER.pop()
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+class _Phase(object):
+    __slots__ = ('timer', 'name')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer.push(self.name)
+
+    def __exit__(self, *args):
+        self.timer.pop()
+        return False
+
+
+class PhaseTimer(object):
+    '''Keeps track of the wall-clock time spent in (nested) named phases. Each phase is also marked as a range for
+    'torch.profiler' (using 'record_function'), so the same names show up when running under the PyTorch profiler.'''
+
+    train_phases = ("train_a_batch", "generator")
+
+    def __init__(self, sync_cuda=False, trace=False):
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.thread = threading.get_ident()
+        self.stack = []
+        self.events = [] if trace else None
+        self.t0 = time.perf_counter()
+        self.reset()
+
+    def reset(self):
+        '''Reset the statistics (but not the stored events for the trace).'''
+        self.stats = {}
+        self.t_reset = time.perf_counter()
+
+    def push(self, name):
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        name = name if len(self.stack)==0 else "{}/{}".format(self.stack[-1][0], name)
+        torch_range = torch.profiler.record_function(name)
+        torch_range.__enter__()
+        self.stack.append((name, torch_range, time.perf_counter()))
+
+    def pop(self):
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        end = time.perf_counter()
+        name, torch_range, start = self.stack.pop()
+        torch_range.__exit__(None, None, None)
+        stat = self.stats.setdefault(name, [0, 0., 0.])
+        stat[0] += 1
+        stat[1] += end-start
+        stat[2] = max(stat[2], end-start)
+        if self.events is not None:
+            self.events.append({'name': name.split("/")[-1], 'cat': name, 'ph': 'X', 'pid': 0, 'tid': 0,
+                                'ts': (start-self.t0)*1e6, 'dur': (end-start)*1e6})
+
+    def summary(self):
+        '''Return <dict> with for each phase its count, total time (s), mean and max time (ms) and the percentage of the
+        wall-clock time since the last reset. For the phases in which a model is trained on a batch (i.e., those in
+        [self.train_phases]), the time not spent in their "forward", "backward" or "step" sub-phases is reported as
+        their "loss" sub-phase (this also includes small amounts of bookkeeping).'''
+        wall_time = time.perf_counter() - self.t_reset
+        stats = {name: list(stat) for name, stat in self.stats.items()}
+        for name, stat in self.stats.items():
+            if name.split("/")[-1] in self.train_phases:
+                timed = sum(stats[sub][1] for sub in ("{}/forward".format(name), "{}/backward".format(name),
+                                                      "{}/step".format(name)) if sub in stats)
+                stats["{}/loss".format(name)] = [stat[0], stat[1]-timed, float('nan')]
+        return {name: {
+            'count': stat[0], 'total_s': stat[1], 'mean_ms': 1000.*stat[1]/stat[0],
+            'max_ms': 1000.*stat[2] if stat[2]==stat[2] else None, 'percent': 100.*stat[1]/wall_time,
+        } for name, stat in sorted(stats.items())}
+
+    def print_summary(self, title="Time per phase"):
+        summary = self.summary()
+        print("\n{}:".format(title))
+        print(" {:<48} {:>8} {:>10} {:>10} {:>7}".format("phase", "count", "total (s)", "mean (ms)", "%"))
+        for name, stat in summary.items():
+            print(" {:<48} {:>8} {:>10.2f} {:>10.2f} {:>7.1f}".format(
+                "  "*name.count("/") + name.split("/")[-1], stat['count'], stat['total_s'], stat['mean_ms'],
+                stat['percent']
+            ))
+
+    def save_summary(self, file_name, **info):
+        '''Write summary (see 'summary') to json-file [file_name], together with the entries in [info].'''
+        with open(file_name, 'w') as f:
+            json.dump({'info': info, 'phases': self.summary()}, f, indent=2)
+
+    def save_trace(self, file_name):
+        '''Write all timed phases to [file_name], in the Chrome-trace format (open with "chrome://tracing").'''
+        with open(file_name, 'w') as f:
+            json.dump({'traceEvents': self.events if self.events is not None else [], 'displayTimeUnit': 'ms'}, f)
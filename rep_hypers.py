@@ -7,7 +7,7 @@ Created on Thu Jun 24 16:25:19 2021
 
 #! /usr/bin/env python3
 
-import subprocess
+import jobqueue
 
 # Whether to use KL or JS divergence...
 kl_js_list = ['kl', 'js']
@@ -15,21 +15,15 @@ kl_js_list = ['kl', 'js']
 # Selectrion factors...
 f_list = [1.25, 1.5, 2, 2.5, 3, 3.5, 4, 5]
 
+db = jobqueue.connect()
+
 #for kl_js in kl_js_list:
 #    for f in f_list:
-#        subprocess.run(['tsp', '-S 1', 'hare', 'run', '--rm', '-d', '--workdir /app', '-v "$(pwd)":/app', \
-#         '--user $(id', '-u):$(id', '-g)', '--gpus', '\'\"device=3,4\"\'', 'jlm67/project', \
-#         'python3', 'main_cl.py', '--experiment=splitMNIST', '--scenario=class', \
+#        jobqueue.add_job(db, ['--experiment=splitMNIST', '--scenario=class', \
 #         '--replay=generative', '--brain-inspired', '--si', '--repulsion', '--kl-js={}'.format(kl_js), \
-#         '--use-rep-f', '--rep-f={}'.format(f), '--tuning', 'iters=500'], )
-try:
-    result = subprocess.run(['tsp', '-S 1', 'hare', 'run', '--rm', '--workdir /app', '-v "$(pwd)":/app', \
-         '--user $(id', '-u):$(id', '-g)', '--gpus', '\'\"device=3,4\"\'', 'jlm67/project', \
-         'python3', 'main_cl.py', '--experiment=splitMNIST', '--scenario=class', \
+#         '--use-rep-f', '--rep-f={}'.format(f), '--tuning', '--iters=500'])
+job_id = jobqueue.add_job(db, ['--experiment=splitMNIST', '--scenario=class', \
          '--replay=generative', '--brain-inspired', '--si', '--repulsion', '--kl-js={}'.format('js'), \
-         '--use-rep-f', '--rep-f={}'.format(1.5), '--tuning', 'iters=50'], universal_newlines=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    print("stdout:", result.stdout)
-    print("stderr:", result.stderr)
-    print("code:", result.returncode)
-except FileNotFoundError as e:
-    print(e)
\ No newline at end of file
+         '--use-rep-f', '--rep-f={}'.format(1.5), '--tuning', '--iters=50'])
+jobqueue.work(db)
+jobqueue.inspect_job(db, job_id)
@@ -0,0 +1,140 @@
+import contextlib
+import copy
+import multiprocessing
+import os
+import time
+import traceback
+from multiprocessing import connection
+import torch
+from param_stamp import get_param_stamp_from_args
+
+
+##-------------------------------------------------------------------------------------------------------------------##
+
+def _run_job(function, args, threads, log_file, conn, gpu=None):
+    '''Run [function]([args]) in a worker-process using [threads] threads (and if [gpu] is provided, only that GPU),
+    with all its output written to [log_file]. Send ("done", result, seconds) or ("failed", error) over [conn].'''
+    if gpu is not None:
+        os.environ['CUDA_VISIBLE_DEVICES'] = gpu    #--> before CUDA is initialized in this process
+    torch.set_num_threads(threads)
+    start = time.time()
+    with open(log_file, 'a') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            result = function(args)
+        except Exception as e:
+            traceback.print_exc()
+            conn.send(("failed", "{}: {}".format(type(e).__name__, e)))
+            return
+    conn.send(("done", result, time.time()-start))
+
+
+class ExperimentRunner(object):
+    '''Runs the experiments of a comparison (e.g., all methods and random seeds) in parallel worker-processes.
+
+    Each experiment is submitted as a function (e.g., 'get_results' of the compare-script, which checks whether the
+    experiment was already run and if not runs it, and returns its results) and its arguments. The return value of
+    the function is stored in a provided <dict>, either directly (if [workers]==1, in which case the experiments are run
+    one after the other in this process, as before) or when the experiment finishes (see 'finish').
+
+    With multiple [workers], at most [workers] experiments run at the same time, each in a new (spawned) process that
+    exits when the experiment is finished. Each experiment uses [threads_per_job] threads (so that together the workers
+    do not use more threads than there are cores) and, if GPUs are available, only the GPU of its worker (the visible
+    GPUs are divided over the workers). Its output is written to "[r_dir]/log-[stamp].txt". Experiments with the same
+    param-stamp are only run once, and experiments that were already run are not sent to the workers (see 'submit').'''
+
+    def __init__(self, workers=1, threads_per_job=None):
+        self.workers = workers
+        self.threads = max(1, (os.cpu_count() or 1)//workers) if (
+            threads_per_job is None and workers>1
+        ) else threads_per_job
+        self.jobs = {}       #--> for each submitted param-stamp: its arguments and the (results, key)-pairs to fill in
+        self.queued = []     #--> param-stamps of the submitted experiments that are not yet started
+        self.running = {}    #--> for each worker-slot that is in use: (param-stamp, <Process>, <Connection>)
+        self.gpus = None
+        if workers>1:
+            self.context = multiprocessing.get_context('spawn')
+            if torch.cuda.is_available():
+                visible = os.environ.get('CUDA_VISIBLE_DEVICES')
+                self.gpus = visible.split(',') if visible else [str(i) for i in range(torch.cuda.device_count())]
+        elif self.threads is not None:
+            torch.set_num_threads(self.threads)
+
+    def submit(self, function, args, results, key, result_file=None):
+        '''Run [function]([args]) and store its return value in [results][key].
+
+        [result_file]   None or <str>, name of file in [args.r_dir] (with "{}" for the param-stamp) that exists if this
+                          experiment was already run; if so, [function] is called directly in this process (as it then
+                          only needs to collect the results)'''
+        if self.workers<=1:
+            results[key] = function(args)
+            return
+        args = copy.deepcopy(args)    #--> [args] is changed by the compare-script after submitting
+        param_stamp = get_param_stamp_from_args(args)
+        if result_file is not None and os.path.isfile(os.path.join(args.r_dir, result_file.format(param_stamp))):
+            results[key] = function(args)
+            return
+        if param_stamp in self.jobs:
+            self.jobs[param_stamp]['targets'].append((results, key))
+            print("{}: ...already queued...".format(param_stamp))
+            return
+        if not os.path.isdir(args.r_dir):
+            os.makedirs(args.r_dir, exist_ok=True)
+        self.jobs[param_stamp] = {'function': function, 'args': args, 'targets': [(results, key)]}
+        self.queued.append(param_stamp)
+        print("{}: ...queued...".format(param_stamp))
+        self._start_jobs()
+
+    def _start_jobs(self):
+        '''Start queued experiments in all free worker-slots.'''
+        for slot in range(self.workers):
+            if len(self.queued)==0:
+                break
+            if slot in self.running:
+                continue
+            param_stamp = self.queued.pop(0)
+            job = self.jobs[param_stamp]
+            gpu = None if not self.gpus else self.gpus[slot % len(self.gpus)]
+            receiver, sender = self.context.Pipe(duplex=False)
+            process = self.context.Process(target=_run_job, args=(
+                job['function'], job['args'], self.threads, "{}/log-{}.txt".format(job['args'].r_dir, param_stamp),
+                sender, gpu,
+            ))
+            process.start()
+            sender.close()    #--> so that receiving fails (instead of blocking) if the process dies
+            self.running[slot] = (param_stamp, process, receiver)
+
+    def finish(self):
+        '''Wait for all submitted experiments (reporting each one as soon as it finishes) and store their results.'''
+        if self.workers<=1:
+            return
+        n_total = len(self.jobs)
+        print("\nRunning {} experiments with {} workers ({} threads each{})...".format(
+            n_total, self.workers, self.threads, "" if not self.gpus else ", GPUs: {}".format(",".join(self.gpus))
+        ))
+        failed = []
+        n_done = 0
+        self._start_jobs()
+        while len(self.running)>0:
+            ready = connection.wait([receiver for _, _, receiver in self.running.values()])
+            for slot, (param_stamp, process, receiver) in list(self.running.items()):
+                if receiver not in ready:
+                    continue
+                try:
+                    message = receiver.recv()
+                except EOFError:
+                    message = ("failed", "process exited with code {}".format(process.exitcode))
+                receiver.close()
+                process.join()
+                del self.running[slot]
+                n_done += 1
+                if message[0]=="failed":
+                    failed.append(param_stamp)
+                    print("[{}/{}] {}: FAILED ({})".format(n_done, n_total, param_stamp, message[1]))
+                    continue
+                for results, key in self.jobs[param_stamp]['targets']:
+                    results[key] = message[1]
+                print("[{}/{}] {}: done ({:.0f}s)".format(n_done, n_total, param_stamp, message[2]))
+            self._start_jobs()
+        self.jobs = {}
+        if len(failed)>0:
+            raise RuntimeError("{} experiment(s) failed (see their log-files): {}".format(len(failed), failed))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of this repository are imported from its root-directory (as done by the scripts themselves)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,58 @@
+import os
+import torch
+import checkpoint
+
+
+def _blob_files(blob_dir):
+    return sorted(name for sub_dir in os.listdir(blob_dir) for name in os.listdir(os.path.join(blob_dir, sub_dir)))
+
+
+def test_remove_unreferenced_blobs_keeps_referenced_blobs(tmp_path):
+    blob_dir = str(tmp_path / "blobs")
+    shared = torch.randn(10)
+    checkpoint.write_manifest({'state': {'shared': shared, 'a': torch.ones(3)}}, str(tmp_path / "keep.pt"), blob_dir)
+    checkpoint.write_manifest({'state': {'shared': shared, 'b': torch.zeros(4)}}, str(tmp_path / "old.pt"), blob_dir)
+    checkpoint.write_flat({'c': torch.arange(3)}, str(tmp_path / "flat.pt"))
+    assert len(_blob_files(blob_dir)) == 3
+    os.remove(str(tmp_path / "old.pt"))
+
+    checkpoint.remove_unreferenced_blobs(str(tmp_path), dry_run=True)
+    assert len(_blob_files(blob_dir)) == 3
+    checkpoint.remove_unreferenced_blobs(str(tmp_path))
+    assert len(_blob_files(blob_dir)) == 2
+    state = checkpoint.load(str(tmp_path / "keep.pt"))['state']
+    assert torch.equal(state['shared'], shared)
+    assert torch.equal(state['a'], torch.ones(3))
+
+
+def test_flat_round_trip(tmp_path):
+    state = {'float': torch.randn(3, 4), 'double': torch.randn(2, dtype=torch.float64), 'half': torch.randn(5).half(),
+             'bfloat16': torch.randn(3).bfloat16(), 'long': torch.arange(7), 'int8': torch.tensor([-1, 2], dtype=torch.int8),
+             'bool': torch.tensor([True, False, True]), 'scalar': torch.tensor(2.5), 'empty': torch.zeros(0, 3),
+             'non_contiguous': torch.randn(4, 3).t()}
+    path = str(tmp_path / "state.pt")
+    checkpoint.write_flat(state, path)
+    loaded = checkpoint.read_flat(path)
+    assert set(loaded) == set(state)
+    for key, value in state.items():
+        assert loaded[key].dtype == value.dtype
+        assert loaded[key].shape == value.shape
+        assert torch.equal(loaded[key], value)
+
+
+def test_load_into_copies_into_existing_storage_and_adds_buffers(tmp_path):
+    torch.manual_seed(0)
+    source = torch.nn.Sequential(torch.nn.Linear(4, 3), torch.nn.BatchNorm1d(3))
+    source(torch.randn(8, 4))    #--> update the running statistics of the batchnorm-layer
+    source.register_buffer('weight_SI_omega', torch.rand(3, 4))
+    path = str(tmp_path / "model.pt")
+    checkpoint.write_flat(source.state_dict(), path)
+
+    target = torch.nn.Sequential(torch.nn.Linear(4, 3), torch.nn.BatchNorm1d(3))
+    weight = target[0].weight
+    data_ptr = weight.data_ptr()
+    checkpoint.load_into(target, path)
+    assert target[0].weight is weight and weight.data_ptr() == data_ptr
+    assert set(target.state_dict()) == set(source.state_dict())
+    for key, value in source.state_dict().items():
+        assert torch.equal(target.state_dict()[key], value)
@@ -0,0 +1,37 @@
+import pytest
+import torch
+from torch.utils.data import TensorDataset
+from eval import evaluate
+from models.classifier import Classifier
+
+
+def _datasets(n_tasks=3, classes_per_task=2, n=50):
+    generator = torch.Generator().manual_seed(0)
+    return [TensorDataset(
+        torch.randn(n, 1, 8, 8, generator=generator),
+        torch.randint(classes_per_task*task, classes_per_task*(task+1), (n,), generator=generator),
+    ) for task in range(n_tasks)]
+
+
+@pytest.mark.parametrize("scenario", ["task", "class", "domain"])
+def test_precision_per_task_matches_validate(scenario):
+    torch.manual_seed(0)
+    n_tasks, classes_per_task = 3, 2
+    model = Classifier(image_size=8, image_channels=1, classes=n_tasks*classes_per_task, fc_layers=2, fc_units=20,
+                       h_dim=16)
+    datasets = _datasets(n_tasks, classes_per_task)
+    cache = evaluate.cache_test_sets(datasets, batch_size=16)
+    for current_task in range(1, n_tasks+1):
+        expected = []
+        for i in range(current_task):
+            if scenario=='task':
+                allowed_classes = list(range(classes_per_task*i, classes_per_task*(i+1)))
+            elif scenario=='class':
+                allowed_classes = list(range(classes_per_task*current_task))
+            else:
+                allowed_classes = None
+            expected.append(evaluate.validate(model, datasets[i], test_size=None, verbose=False,
+                                              allowed_classes=allowed_classes))
+        precs = evaluate.precision_per_task(model, cache, current_task, classes_per_task=classes_per_task,
+                                            scenario=scenario, batch_size=32)
+        assert precs == pytest.approx(expected)
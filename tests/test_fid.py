@@ -0,0 +1,26 @@
+import numpy as np
+from scipy import linalg
+from eval import fid
+
+
+def test_running_statistics_match_numpy():
+    rng = np.random.RandomState(0)
+    embeddings = rng.randn(103, 5) * np.arange(1., 6.) + 10.
+    stats = fid.RunningStatistics()
+    for start in range(0, len(embeddings), 16):
+        stats.update(embeddings[start:start+16])
+    stats.update(embeddings[:0])
+    assert stats.n == len(embeddings)
+    np.testing.assert_allclose(stats.mean, embeddings.mean(axis=0))
+    np.testing.assert_allclose(stats.cov, np.cov(embeddings, rowvar=False))
+
+
+def test_frechet_distance_matches_sqrtm():
+    rng = np.random.RandomState(1)
+    x, y = rng.randn(200, 4), rng.randn(300, 4) * 2. + 1.
+    mu1, sigma1 = x.mean(axis=0), np.cov(x, rowvar=False)
+    mu2, sigma2 = y.mean(axis=0), np.cov(y, rowvar=False)
+    diff = mu1 - mu2
+    expected = diff.dot(diff) + np.trace(sigma1) + np.trace(sigma2) - 2*np.trace(linalg.sqrtm(sigma1.dot(sigma2)).real)
+    assert np.isclose(fid.calculate_frechet_distance(mu1, sigma1, mu2, sigma2), expected)
+    assert np.isclose(fid.calculate_frechet_distance(mu1, sigma1, mu1, sigma1), 0., atol=1e-8)
@@ -0,0 +1,37 @@
+import subprocess
+import sys
+import jobqueue
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_requeue_orphans_requeues_jobs_of_dead_workers(tmp_path):
+    db = jobqueue.connect(str(tmp_path / "jobs.db"))
+    orphan = jobqueue.add_job(db, ["--experiment=splitMNIST", "--seed=1"])
+    alive = jobqueue.add_job(db, ["--experiment=splitMNIST", "--seed=2"])
+    assert jobqueue.claim_job(db)['id'] == orphan
+    assert jobqueue.claim_job(db)['id'] == alive
+    db.execute("UPDATE jobs SET worker_pid=? WHERE id=?", (_dead_pid(), orphan))
+
+    assert jobqueue.requeue_orphans(db) == 1
+    rows = {row['id']: row for row in db.execute("SELECT * FROM jobs")}
+    assert rows[orphan]['state'] == "queued"
+    assert rows[orphan]['attempts'] == 0    #--> the interrupted attempt is not counted
+    assert rows[alive]['state'] == "running"
+    assert jobqueue.claim_job(db)['id'] == orphan
+
+
+def test_failed_jobs_are_retried_until_max_attempts(tmp_path):
+    db = jobqueue.connect(str(tmp_path / "jobs.db"))
+    job_id = jobqueue.add_job(db, ["--experiment=splitMNIST"], max_attempts=2)
+    assert jobqueue.add_job(db, ["--experiment=splitMNIST"]) == job_id    #--> same run is only added once
+
+    assert jobqueue.claim_job(db)['id'] == job_id
+    assert jobqueue.finish_job(db, job_id, returncode=1) == "queued"
+    assert jobqueue.claim_job(db)['id'] == job_id
+    assert jobqueue.finish_job(db, job_id, returncode=1) == "failed"
+    assert jobqueue.claim_job(db) is None
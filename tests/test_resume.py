@@ -0,0 +1,75 @@
+import pytest
+import torch
+import numpy as np
+from torch import nn
+import checkpoint
+import define_models as define
+import options
+import utils
+from data.load import get_multitask_experiment
+from eval import callbacks as cb, evaluate
+from train import train_cl
+
+
+class _Interrupted(Exception):
+    pass
+
+
+def _args():
+    kwargs = {'single_task': False, 'only_MNIST': False, 'generative': True, 'compare_code': 'none'}
+    parser = options.define_args(filename="main_cl", description='test')
+    for add_options in (options.add_general_options, options.add_eval_options, options.add_task_options,
+                        options.add_model_options, options.add_train_options, options.add_replay_options,
+                        options.add_bir_options, options.add_allocation_options):
+        parser = add_options(parser, **kwargs)
+    args = parser.parse_args([
+        '--experiment=splitMNIST', '--scenario=class', '--tasks=3', '--replay=generative', '--feedback', '--si',
+        '--iters=4', '--batch=16', '--fc-units=20', '--z-dim=5', '--no-gpus', '--async-eval',
+    ])
+    options.set_defaults(args, **kwargs)
+    return args
+
+
+def _train(tmp_path, interrupt_after=None, resume=False):
+    '''Train on (synthetic) splitMNIST and return the final state of the model; if [interrupt_after] is provided,
+    training is stopped right after the training-state is saved for the [interrupt_after]-th time.'''
+    args = _args()
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    (train_datasets, test_datasets), config, classes_per_task = get_multitask_experiment(
+        args.experiment, args.scenario, args.tasks, synthetic=True,
+    )
+    model = define.define_main_model(args, config, torch.device('cpu'), verbose=False)
+    precision_dict = evaluate.initiate_precision_dict(args.tasks)
+    eval_cb = cb._eval_cb(log=2, test_datasets=test_datasets, precision_dict=precision_dict, iters_per_task=args.iters,
+                          test_size=32, classes_per_task=classes_per_task, scenario=args.scenario)
+    if resume:
+        torch.manual_seed(1234)    #--> the random state should be restored from the training-state
+    train_cl(model, train_datasets, replay_mode=args.replay, scenario=args.scenario, classes_per_task=classes_per_task,
+             iters=args.iters, batch_size=args.batch, feedback=True, eval_cbs=[eval_cb], args=args,
+             criterion=nn.CosineSimilarity(dim=1), checkpoint_file=str(tmp_path / "state.pt"),
+             checkpoint_every=3 if interrupt_after is not None or resume else None, resume=resume,
+             extra_state={'precision_dict': precision_dict})
+    return model.state_dict(), precision_dict
+
+
+@pytest.mark.parametrize("interrupt_after", [3, 4])    #--> halfway task 2, and at the end of task 2
+def test_resumed_training_equals_uninterrupted_training(tmp_path, monkeypatch, interrupt_after):
+    expected_state, expected_precs = _train(tmp_path / "uninterrupted")
+
+    n_saved = []
+    def save_and_interrupt(state, path, writer=None):
+        checkpoint.write_atomic(state, path)
+        n_saved.append(path)
+        if len(n_saved)==interrupt_after:
+            raise _Interrupted()
+    monkeypatch.setattr(utils, 'save_state_atomic', save_and_interrupt)
+    with pytest.raises(_Interrupted):
+        _train(tmp_path, interrupt_after=interrupt_after)
+    monkeypatch.undo()
+    state, precs = _train(tmp_path, resume=True)
+
+    assert set(state) == set(expected_state)
+    for key, value in expected_state.items():
+        assert torch.equal(state[key], value), key
+    assert precs == expected_precs
@@ -1,3 +1,4 @@
+import os
 import numpy as np
 import torch
 from torch.utils.data import ConcatDataset
@@ -6,6 +7,11 @@ import tqdm
 import copy
 import utils
 from models.cl.continual_learner import ContinualLearner
+from eval.async_eval import AsyncEvaluator
+from checkpoint import CheckpointWriter
+import profiling
+import memory
+import visual.visdom
 import torch.nn as nn
 import torchmetrics
 from torch import Tensor
@@ -58,17 +64,24 @@ transform = DataAugmentation() # Batch tensor (image) augmentation
 
 
 def train(model, train_loader, iters, loss_cbs=list(), eval_cbs=list(), save_every=None, m_dir="./store/models",
-          args=None):
+          args=None, keep_last=None, criterion=None):
     '''Train a model with a "train_a_batch" method for [iters] iterations on data from [train_loader].
 
     [model]             model to optimize
     [train_loader]      <dataloader> for training [model] on
     [iters]             <int> (max) number of iterations (i.e., batches) to train for
     [loss_cbs]          <list> of callback-<functions> to keep track of training progress
-    [eval_cbs]          <list> of callback-<functions> to evaluate model on separate data-set'''
+    [eval_cbs]          <list> of callback-<functions> to evaluate model on separate data-set
+    [save_every]        None or <int>, save checkpoint of [model] to [m_dir] every [save_every] iterations (this is
+                          done in the background); if [keep_last] is None, each checkpoint replaces the previous one,
+                          otherwise the iteration is added to their names and only the last [keep_last] are kept'''
 
     device = model._device()
 
+    # Checkpoints are written in the background
+    blob_dir = os.path.join(m_dir, 'blobs') if utils.checkattr(args, 'blob_store') else None
+    writer = CheckpointWriter(keep_last=keep_last, blob_dir=blob_dir) if save_every is not None else None
+
     # Should convolutional layers be frozen?
     freeze_convE = (utils.checkattr(args, "freeze_convE") and hasattr(args, "depth") and args.depth>0)
 
@@ -104,11 +117,40 @@ def train(model, train_loader, iters, loss_cbs=list(), eval_cbs=list(), save_eve
 
             # Save checkpoint?
             if (save_every is not None) and (iteration % save_every) == 0:
-                utils.save_checkpoint(model, model_dir=m_dir)
+                utils.save_checkpoint(
+                    model, model_dir=m_dir, writer=writer, series=model.name,
+                    name=model.name if keep_last is None else "{}-it{}".format(model.name, iteration),
+                )
+
+    # Finish the evaluation-callbacks (e.g., plot the latent-space projection that is still running in the background)
+    _close_callbacks(eval_cbs)
+
+    # Wait until all checkpoints are written
+    if writer is not None:
+        writer.close()
+
+
+def _close_callbacks(callbacks):
+    '''Call the 'close'-function of each callback-function in [callbacks] that has one.'''
+    for callback in callbacks:
+        if callback is not None and hasattr(callback, 'close'):
+            callback.close()
+
+
+def _resume_data_loader(dataset, batch_size, cuda, rng_state, iters_left):
+    '''Recreate the iterator over a (shuffled) data-loader for [dataset] that was created when the torch-RNG was in
+    [rng_state], and advance it to the point where [iters_left] is as indicated (see the "data"-phase of 'train_cl').'''
+    torch.set_rng_state(rng_state)
+    data_loader = iter(utils.get_data_loader(dataset, batch_size, cuda=cuda, drop_last=True))
+    for _ in range(len(data_loader)-iters_left+1):
+        next(data_loader)
+    return data_loader
+
 
 def train_cl(model, train_datasets, replay_mode="none", scenario="task", rnt=None, classes_per_task=None,
              iters=2000, batch_size=32, batch_size_replay=None, loss_cbs=list(), eval_cbs=list(), sample_cbs=list(),
-             generator=None, gen_iters=0, gen_loss_cbs=list(), feedback=False, reinit=False, args=None, only_last=False, criterion=None):
+             generator=None, gen_iters=0, gen_loss_cbs=list(), feedback=False, reinit=False, args=None, only_last=False, criterion=None,
+             profile_file=None, checkpoint_file=None, checkpoint_every=None, resume=False, extra_state=None):
     '''Train a model (with a "train_a_batch" method) on multiple tasks, with replay-strategy specified by [replay_mode].
 
     [model]             <nn.Module> main model to optimize across all tasks
@@ -122,7 +164,24 @@ def train_cl(model, train_datasets, replay_mode="none", scenario="task", rnt=Non
     [generator]         None or <nn.Module>, if a seperate generative model should be trained (for [gen_iters] per task)
     [feedback]          <bool>, if True and [replay_mode]="generative", the main model is used for generating replay
     [only_last]         <bool>, only train on final task / episode
-    [*_cbs]             <list> of call-back functions to evaluate training-progress'''
+    [*_cbs]             <list> of call-back functions to evaluate training-progress
+    [profile_file]      None or <str>, if profiling is enabled (see profiling.py), the time spent per phase during each
+                          task is written to "[profile_file]-task<X>.json"
+    [checkpoint_file]   None or <str>, if provided, the full training-state is saved to this file after each task
+    [checkpoint_every]  None or <int>, if provided (with [checkpoint_file]), the training-state is also saved every
+                          [checkpoint_every] iterations
+    [resume]            <bool>, if True and [checkpoint_file] exists, continue training from the saved training-state
+    [extra_state]       None or <dict> with further objects that are saved with (and restored from) the training-state
+                          (e.g., the [precision_dict] filled by the evaluation callbacks); <dicts> and <lists> are
+                          restored in place, as the callbacks keep references to them
+
+    When training is resumed from a training-state saved halfway a task, it continues exactly as it would have without
+    interruption (i.e., with the same random numbers and thus the same parameters), also with asynchronous evaluation.
+    This is not the case for visualizations that use random numbers (e.g., generated samples or the selection of the
+    examples to reconstruct), which are not part of the saved state.
+
+    If memory-tracking is enabled (see memory.py), the memory usage is sampled at the start and end of each task (and
+    every [interval] iterations), and a task is not started if its projected peak memory usage exceeds the budget.'''
     
     #### Should augmented views be created?...
     use_views = args.contrastive
@@ -133,6 +192,19 @@ def train_cl(model, train_datasets, replay_mode="none", scenario="task", rnt=Non
     # Should convolutional layers be frozen?
     freeze_convE = (utils.checkattr(args, "freeze_convE") and hasattr(args, "depth") and args.depth>0)
 
+    # Should evaluation callbacks be run asynchronously (on snapshots of the weights)?
+    evaluator = AsyncEvaluator(seed=args.seed) if utils.checkattr(args, "async_eval") else None
+
+    # Training-states are written in the background
+    writer = CheckpointWriter() if checkpoint_file is not None else None
+
+    # If profiling is enabled, also time the forward passes of the model(s) being trained
+    profile_hooks = list()
+    if profiling.active():
+        profile_hooks += profiling.time_forward(model)
+        if generator is not None:
+            profile_hooks += profiling.time_forward(generator)
+
     # Use cuda?
     device = model._device()
     cuda = model._is_on_cuda()
@@ -144,6 +216,17 @@ def train_cl(model, train_datasets, replay_mode="none", scenario="task", rnt=Non
     Generative = Current = Offline_TaskIL = False
     previous_model = None
     precision_dict = {}
+    x_ = y_ = scores_ = None
+
+    # Components of which the memory-footprint is reported (if memory-tracking is enabled)
+    def memory_components():
+        return memory.training_components(
+            model, generator=generator, previous_model=previous_model,
+            previous_generator=previous_generator if Generative else None,
+            si_running=[W, p_old] if (isinstance(model, ContinualLearner) and model.si_c>0) else None,
+            replay_batch=[x_, y_, scores_],
+            eval_replicas=None if evaluator is None else list(evaluator.replicas.values()),
+        )
 
     # Register starting param-values (needed for "intelligent synapses").
     if isinstance(model, ContinualLearner) and model.si_c>0:
@@ -152,9 +235,74 @@ def train_cl(model, train_datasets, replay_mode="none", scenario="task", rnt=Non
                 n = n.replace('.', '__')
                 model.register_buffer('{}_SI_prev_task'.format(n), p.detach().clone())
 
+    # Save everything needed to continue training from the current iteration (or from the end of the current task)
+    def save_training_state(task, batch_index, task_done):
+        if evaluator is not None:
+            evaluator.wait()    #--> make sure the results of all evaluations so far are included in [extra_state]
+        utils.save_state_atomic({
+            'task': task, 'batch_index': batch_index, 'task_done': task_done,
+            'model': utils.get_training_state(model),
+            'generator': None if generator is None else utils.get_training_state(generator),
+            'previous_model': None if previous_model is None else utils.get_training_state(
+                previous_model, optimizers=False
+            ),
+            'previous_generator': utils.get_training_state(
+                previous_generator, optimizers=False
+            ) if (Generative and not feedback) else None,
+            'si': {'W': W, 'p_old': p_old} if (
+                    isinstance(model, ContinualLearner) and model.si_c>0 and not task_done
+            ) else None,
+            'data': None if task_done else {'iters_left': iters_left, 'loader_rng': loader_rng},
+            'precision_dict': precision_dict, 'extra_state': extra_state, 'rng': utils.get_rng_state(),
+            'eval_rng': None if evaluator is None else evaluator.generator.get_state(),
+            'visdom': visual.visdom.get_state(),
+        }, checkpoint_file, writer=writer)
+
+    # If requested, restore saved training-state
+    resumed = None
+    first_task = 1
+    if resume and (checkpoint_file is not None) and os.path.isfile(checkpoint_file):
+        resumed = utils.load_state(checkpoint_file)
+        utils.set_training_state(model, resumed['model'])
+        if resumed['generator'] is not None:
+            utils.set_training_state(generator, resumed['generator'])
+        if resumed['previous_model'] is not None:
+            previous_model = copy.deepcopy(model).eval()
+            utils.set_training_state(previous_model, resumed['previous_model'])
+            if replay_mode=="generative":
+                Generative = True
+                previous_generator = previous_model if feedback else copy.deepcopy(generator).eval()
+                if not feedback:
+                    utils.set_training_state(previous_generator, resumed['previous_generator'])
+            elif replay_mode=='current':
+                Current = True
+        precision_dict.update(resumed['precision_dict'])
+        for key, value in (resumed['extra_state'] or {}).items():
+            if isinstance(extra_state.get(key), dict):
+                extra_state[key].clear()
+                extra_state[key].update(value)
+            elif isinstance(extra_state.get(key), list):
+                extra_state[key][:] = value
+            else:
+                extra_state[key] = value
+        if evaluator is not None and resumed.get('eval_rng') is not None:
+            evaluator.generator.set_state(resumed['eval_rng'])
+        visual.visdom.set_state(resumed.get('visdom') or {})
+        first_task = resumed['task']+1 if resumed['task_done'] else resumed['task']
+        if resumed['task_done']:
+            utils.set_rng_state(resumed['rng'])
+        print(" --> resuming training at task {}, iteration {}".format(
+            first_task, 1 if resumed['task_done'] else resumed['batch_index']+1
+        ))
+
     # Loop over all tasks.
     for task, train_dataset in enumerate(train_datasets, 1):
 
+        # If training was resumed, skip the tasks that were already finished
+        if task<first_task:
+            continue
+        resume_in_task = (resumed is not None) and (not resumed['task_done']) and task==resumed['task']
+
         # If offline replay-setting, create large database of all tasks so far
         if replay_mode=="offline" and (not scenario=="task"):
             train_dataset = ConcatDataset(train_datasets[:task])
@@ -165,9 +313,23 @@ def train_cl(model, train_datasets, replay_mode="none", scenario="task", rnt=Non
 
         # Initialize # iters left on data-loader(s)
         iters_left = 1 if (not Offline_TaskIL) else [1]*task
+        loader_rng = None if (not Offline_TaskIL) else [None]*task
+        # -if training is resumed halfway this task, recreate the data-loader(s) at the point where they were
+        if resume_in_task:
+            iters_left, loader_rng = resumed['data']['iters_left'], resumed['data']['loader_rng']
+            if not Offline_TaskIL:
+                data_loader = _resume_data_loader(train_dataset, batch_size, cuda, loader_rng, iters_left)
+            else:
+                for task_id in range(task):
+                    data_loader[task_id] = _resume_data_loader(train_datasets[task_id], int(np.ceil(batch_size/task)),
+                                                               cuda, loader_rng[task_id], iters_left[task_id])
+            utils.set_rng_state(resumed['rng'])
 
         # Prepare <dicts> to store running importance estimates and parameter-values before update
-        if isinstance(model, ContinualLearner) and model.si_c>0:
+        if resume_in_task and (resumed['si'] is not None):
+            W = {n: value.to(device) for n, value in resumed['si']['W'].items()}
+            p_old = {n: value.to(device) for n, value in resumed['si']['p_old'].items()}
+        elif isinstance(model, ContinualLearner) and model.si_c>0:
             W = {}
             p_old = {}
             for n, p in model.named_parameters():
@@ -187,8 +349,11 @@ def train_cl(model, train_datasets, replay_mode="none", scenario="task", rnt=Non
             active_classes = list(range(classes_per_task*task))
             print('Active Classes =', active_classes)
 
+        # Check whether this task is expected to fit within the memory-budget (if memory-tracking is enabled)
+        memory.start_task(task, components=memory_components)
+
         # Reinitialize the model's parameters (if requested)
-        if reinit:
+        if reinit and not resume_in_task:
             from define_models import init_params
             init_params(model, args)
             if generator is not None:
@@ -206,24 +371,27 @@ def train_cl(model, train_datasets, replay_mode="none", scenario="task", rnt=Non
         # -if only the final task should be trained on:
         if only_last and not task==len(train_datasets):
             iters_to_use = 0
-        for batch_index in range(1, iters_to_use+1):
+        for batch_index in range(resumed['batch_index']+1 if resume_in_task else 1, iters_to_use+1):
 
             # Update # iters left on current data-loader(s) and, if needed, create new one(s)
-            if not Offline_TaskIL:
-                iters_left -= 1
-                if iters_left==0:
-                    data_loader = iter(utils.get_data_loader(train_dataset, batch_size, cuda=cuda, drop_last=True))
-                    iters_left = len(data_loader)
-            else:
-                # -with "offline replay" in Task-IL scenario, there is a separate data-loader for each task
-                batch_size_to_use = int(np.ceil(batch_size/task))
-                for task_id in range(task):
-                    iters_left[task_id] -= 1
-                    if iters_left[task_id]==0:
-                        data_loader[task_id] = iter(utils.get_data_loader(
-                            train_datasets[task_id], batch_size_to_use, cuda=cuda, drop_last=True
-                        ))
-                        iters_left[task_id] = len(data_loader[task_id])
+            with profiling.phase("data"):
+                if not Offline_TaskIL:
+                    iters_left -= 1
+                    if iters_left==0:
+                        loader_rng = torch.get_rng_state()
+                        data_loader = iter(utils.get_data_loader(train_dataset, batch_size, cuda=cuda, drop_last=True))
+                        iters_left = len(data_loader)
+                else:
+                    # -with "offline replay" in Task-IL scenario, there is a separate data-loader for each task
+                    batch_size_to_use = int(np.ceil(batch_size/task))
+                    for task_id in range(task):
+                        iters_left[task_id] -= 1
+                        if iters_left[task_id]==0:
+                            loader_rng[task_id] = torch.get_rng_state()
+                            data_loader[task_id] = iter(utils.get_data_loader(
+                                train_datasets[task_id], batch_size_to_use, cuda=cuda, drop_last=True
+                            ))
+                            iters_left[task_id] = len(data_loader[task_id])
 
 
 
@@ -231,29 +399,32 @@ def train_cl(model, train_datasets, replay_mode="none", scenario="task", rnt=Non
 
             #####-----CURRENT BATCH-----#####
             if not Offline_TaskIL:
-                x, y = next(data_loader)                                    #--> sample training data of current task
-                y = y-classes_per_task*(task-1) if scenario=="task" else y  #--> ITL: adjust y-targets to 'active range'
-                x, y = x.to(device), y.to(device)                           #--> transfer them to correct device
+                with profiling.phase("data"):
+                    x, y = next(data_loader)                                    #--> sample training data of current task
+                    y = y-classes_per_task*(task-1) if scenario=="task" else y  #--> ITL: adjust y-targets to 'active range'
+                    x, y = x.to(device), y.to(device)                           #--> transfer them to correct device
                 #### Create two views by augmenting data...
                 if use_views and contrast_current:
                     # Return two views...
-                    torch.manual_seed(0)
-                    x1 = transform(x)
-                    torch.manual_seed(1)
-                    x2 = transform(x)
-                    x = [x1, x2]
+                    with profiling.phase("views"):
+                        with utils.seeded_rng(0):
+                            x1 = transform(x)
+                        with utils.seeded_rng(1):
+                            x2 = transform(x)
+                        x = [x1, x2]
                 #y = y.expand(1) if len(y.size())==1 else y                 #--> hack for if batch-size is 1
             else:
                 x = y = task_used = None  #--> all tasks are "treated as replay"
                 # -sample training data for all tasks so far, move to correct device and store in lists
-                x_, y_ = list(), list()
-                for task_id in range(task):
-                    x_temp, y_temp = next(data_loader[task_id])
-                    x_.append(x_temp.to(device))
-                    y_temp = y_temp - (classes_per_task * task_id) #--> adjust y-targets to 'active range'
-                    if batch_size_to_use == 1:
-                        y_temp = torch.tensor([y_temp])            #--> correct dimensions if batch-size is 1
-                    y_.append(y_temp.to(device))
+                with profiling.phase("data"):
+                    x_, y_ = list(), list()
+                    for task_id in range(task):
+                        x_temp, y_temp = next(data_loader[task_id])
+                        x_.append(x_temp.to(device))
+                        y_temp = y_temp - (classes_per_task * task_id) #--> adjust y-targets to 'active range'
+                        if batch_size_to_use == 1:
+                            y_temp = torch.tensor([y_temp])            #--> correct dimensions if batch-size is 1
+                        y_.append(y_temp.to(device))
 
 
             #####-----REPLAYED BATCH-----#####
@@ -270,122 +441,126 @@ def train_cl(model, train_datasets, replay_mode="none", scenario="task", rnt=Non
 
             ##-->> Generative Replay <<--##
             if Generative:
-                #---> Only with generative replay, the resulting [x_] will be at the "hidden"-level
-                conditional_gen = True if (
-                    (previous_generator.per_class and previous_generator.prior=="GMM") or
-                    utils.checkattr(previous_generator, 'dg_gates')
-                ) else False
-
-                # Sample [x_]
-                if conditional_gen and scenario=="task":
-                    # -if a conditional generator is used with task-IL scenario, generate data per previous task
-                    x_ = list()
-                    task_used = list()
-                    for task_id in range(task-1):
-                        allowed_classes = list(range(classes_per_task*task_id, classes_per_task*(task_id+1)))
-                        batch_size_replay_to_use = int(np.ceil(batch_size_replay / (task-1)))
-                        x_temp_ = previous_generator.sample(batch_size_replay_to_use, allowed_classes=allowed_classes,
-                                                            only_x=False)
-                        x_.append(x_temp_[0])
-                        task_used.append(x_temp_[2])
-                else: ###
-                    # -which classes are allowed to be generated? (relevant if conditional generator / decoder-gates)
-                    allowed_classes = None if scenario=="domain" else list(range(classes_per_task*(task-1)))
-                    # -which tasks/domains are allowed to be generated? (only relevant if "Domain-IL" with task-gates)
-                    allowed_domains = list(range(task-1))
-                    # -generate inputs representative of previous tasks
-                    x_temp_ = previous_generator.sample(
-                        batch_size_replay, allowed_classes=allowed_classes, allowed_domains=allowed_domains,
-                        only_x=False,
-                    )
-
-                    x_ = x_temp_[3] if (use_views and contrast_replayed) or args.contr_not_hidden else x_temp_[0]
-
-                    task_used = x_temp_[2]
-
-                    #### Create two views by augmenting data...
-                    if (use_views and contrast_replayed) or args.contr_not_hidden:
-                        # Return two views...
-                        #torch.manual_seed(0)
-                        #x1_ = model.convE(transform(x_))
-                        x1_ = x_temp_[0]
-                        torch.manual_seed(1)
-                        x2_ = model.convE(transform(x_))
-                        x_ = [x1_, x2_]
+                with profiling.phase("replay_sampling"):
+                    #---> Only with generative replay, the resulting [x_] will be at the "hidden"-level
+                    conditional_gen = True if (
+                        (previous_generator.per_class and previous_generator.prior=="GMM") or
+                        utils.checkattr(previous_generator, 'dg_gates')
+                    ) else False
+
+                    # Sample [x_]
+                    if conditional_gen and scenario=="task":
+                        # -if a conditional generator is used with task-IL scenario, generate data per previous task
+                        x_ = list()
+                        task_used = list()
+                        for task_id in range(task-1):
+                            allowed_classes = list(range(classes_per_task*task_id, classes_per_task*(task_id+1)))
+                            batch_size_replay_to_use = int(np.ceil(batch_size_replay / (task-1)))
+                            x_temp_ = previous_generator.sample(batch_size_replay_to_use, allowed_classes=allowed_classes,
+                                                                only_x=False)
+                            x_.append(x_temp_[0])
+                            task_used.append(x_temp_[2])
+                    else: ###
+                        # -which classes are allowed to be generated? (relevant if conditional generator / decoder-gates)
+                        allowed_classes = None if scenario=="domain" else list(range(classes_per_task*(task-1)))
+                        # -which tasks/domains are allowed to be generated? (only relevant if "Domain-IL" with task-gates)
+                        allowed_domains = list(range(task-1))
+                        # -generate inputs representative of previous tasks
+                        x_temp_ = previous_generator.sample(
+                            batch_size_replay, allowed_classes=allowed_classes, allowed_domains=allowed_domains,
+                            only_x=False,
+                        )
+
+                        x_ = x_temp_[3] if (use_views and contrast_replayed) or args.contr_not_hidden else x_temp_[0]
+
+                        task_used = x_temp_[2]
+
+                        #### Create two views by augmenting data...
+                        if (use_views and contrast_replayed) or args.contr_not_hidden:
+                            # Return two views...
+                            #torch.manual_seed(0)
+                            #x1_ = model.convE(transform(x_))
+                            x1_ = x_temp_[0]
+                            with profiling.phase("views"):
+                                with utils.seeded_rng(1):
+                                    x2_ = model.convE(transform(x_))
+                            x_ = [x1_, x2_]
 
 
             #--------------------------------------------OUTPUTS----------------------------------------------------#
 
             if Generative or Current:
-                # Get target scores & possibly labels (i.e., [scores_] / [y_]) -- use previous model, with no_grad()
-                if scenario in ("domain", "class") and previous_model.mask_dict is None:
-                    # -if replay does not need to be evaluated for each task (ie, not Task-IL and no task-specific mask)
-                    with torch.no_grad():
-                        all_scores_ = previous_model.classify(x_ if not (use_views or args.contr_not_hidden) else x_[0], not_hidden=False if Generative else True, current=Current)
-                    scores_ = all_scores_[:, :(classes_per_task*(task-1))] if (
-                            scenario=="class"
-                    ) else all_scores_ # -> when scenario=="class", zero probs will be added in [loss_fn_kd]-function
-                    # -also get the 'hard target'
-                    _, y_ = torch.max(scores_, dim=1) ###
-                else:
-                    # -[x_] needs to be evaluated according to each previous task, so make list with entry per task
-                    scores_ = list()
-                    y_ = list()
-                    # -if no task-mask and no conditional generator, all scores can be calculated in one go
-                    if previous_model.mask_dict is None and not type(x_)==list:
+                with profiling.phase("teacher_scoring"):
+                    # Get target scores & possibly labels (i.e., [scores_] / [y_]) -- use previous model, with no_grad()
+                    if scenario in ("domain", "class") and previous_model.mask_dict is None:
+                        # -if replay does not need to be evaluated for each task (ie, not Task-IL and no task-specific mask)
                         with torch.no_grad():
-                            all_scores_ = previous_model.classify(x_, not_hidden=False if Generative else True, current=Current)
-                    for task_id in range(task-1):
-                        # -if there is a task-mask (i.e., XdG is used), obtain predicted scores for each task separately
-                        if previous_model.mask_dict is not None:
-                            previous_model.apply_XdGmask(task=task_id+1)
-                        if previous_model.mask_dict is not None or type(x_)==list:
+                            all_scores_ = previous_model.classify(x_ if not (use_views or args.contr_not_hidden) else x_[0], not_hidden=False if Generative else True, current=Current)
+                        scores_ = all_scores_[:, :(classes_per_task*(task-1))] if (
+                                scenario=="class"
+                        ) else all_scores_ # -> when scenario=="class", zero probs will be added in [loss_fn_kd]-function
+                        # -also get the 'hard target'
+                        _, y_ = torch.max(scores_, dim=1) ###
+                    else:
+                        # -[x_] needs to be evaluated according to each previous task, so make list with entry per task
+                        scores_ = list()
+                        y_ = list()
+                        # -if no task-mask and no conditional generator, all scores can be calculated in one go
+                        if previous_model.mask_dict is None and not type(x_)==list:
                             with torch.no_grad():
-                                all_scores_ = previous_model.classify(x_[task_id] if type(x_)==list else x_,
-                                                                      not_hidden=False if Generative else True, current=Current)
-                        if scenario=="domain":
-                            # NOTE: if scenario=domain with task-mask, it's of course actually the Task-IL scenario!
-                            #       this can be used as trick to run the Task-IL scenario with singlehead output layer
-                            temp_scores_ = all_scores_
-                        else:
-                            temp_scores_ = all_scores_[:, (classes_per_task*task_id):(classes_per_task*(task_id+1))]
-                        scores_.append(temp_scores_)
-                        # - also get hard target
-                        _, temp_y_ = torch.max(temp_scores_, dim=1)
-                        y_.append(temp_y_)
+                                all_scores_ = previous_model.classify(x_, not_hidden=False if Generative else True, current=Current)
+                        for task_id in range(task-1):
+                            # -if there is a task-mask (i.e., XdG is used), obtain predicted scores for each task separately
+                            if previous_model.mask_dict is not None:
+                                previous_model.apply_XdGmask(task=task_id+1)
+                            if previous_model.mask_dict is not None or type(x_)==list:
+                                with torch.no_grad():
+                                    all_scores_ = previous_model.classify(x_[task_id] if type(x_)==list else x_,
+                                                                          not_hidden=False if Generative else True, current=Current)
+                            if scenario=="domain":
+                                # NOTE: if scenario=domain with task-mask, it's of course actually the Task-IL scenario!
+                                #       this can be used as trick to run the Task-IL scenario with singlehead output layer
+                                temp_scores_ = all_scores_
+                            else:
+                                temp_scores_ = all_scores_[:, (classes_per_task*task_id):(classes_per_task*(task_id+1))]
+                            scores_.append(temp_scores_)
+                            # - also get hard target
+                            _, temp_y_ = torch.max(temp_scores_, dim=1)
+                            y_.append(temp_y_)
             # -only keep predicted y_/scores_ if required (as otherwise unnecessary computations will be done)
             y_ = y_ if (model.replay_targets=="hard") else None
             scores_ = scores_ if (model.replay_targets=="soft") else None
 
             if args.repulsion or args.recon_repulsion or args.recon_attraction:
-                #### Finding top 2 scores predicted by classifier for each replay 'image'...
-                if scores_ is not None:
-                    ###lym
-                    scores_ = scores_.to(device)
-                    scores_1 = scores_.type(torch.DoubleTensor)
-                    scores_mean = torch.mean(scores_1, 0)
-                    scores_std = torch.std(scores_1, 0)
-                    scores_threshold = scores_mean + scores_std
-                    threshold_all = scores_threshold.expand(batch_size, -1)
-                    threshold_all = threshold_all.to(device) if threshold_all is not None else None
-
-                    if not args.use_rep_factor:
-                        tk = int(args.n_rep + 1) if scores_.size()[1] > args.n_rep else scores_.size()[1]
+                with profiling.phase("topk_threshold"):
+                    #### Finding top 2 scores predicted by classifier for each replay 'image'...
+                    if scores_ is not None:
+                        ###lym
+                        scores_ = scores_.to(device)
+                        scores_1 = scores_.type(torch.DoubleTensor)
+                        scores_mean = torch.mean(scores_1, 0)
+                        scores_std = torch.std(scores_1, 0)
+                        scores_threshold = scores_mean + scores_std
+                        threshold_all = scores_threshold.expand(batch_size, -1)
+                        threshold_all = threshold_all.to(device) if threshold_all is not None else None
+
+                        if not args.use_rep_factor:
+                            tk = int(args.n_rep + 1) if scores_.size()[1] > args.n_rep else scores_.size()[1]
+                        else:
+                            tk = 4 if scores_.size()[1] > 3 else scores_.size()[1]
                     else:
-                        tk = 4 if scores_.size()[1] > 3 else scores_.size()[1]
-                else:
-                    tk = None
-                # top_scores_ the index(1,2,3) of the classes
-                top_scores_ = torch.topk(scores_, tk, dim=1)[1] if scores_ is not None else None
-                top_scores_ = top_scores_.to(device) if scores_ is not None else None
-
-                if top_scores_ is not None:
-                    top_index = torch.reshape(top_scores_[:, 0], (-1, 1))
-                    top_threshold = torch.gather(threshold_all, 1, top_index.detach().clone())
-                else:
-                    top_threshold = None
+                        tk = None
+                    # top_scores_ the index(1,2,3) of the classes
+                    top_scores_ = torch.topk(scores_, tk, dim=1)[1] if scores_ is not None else None
+                    top_scores_ = top_scores_.to(device) if scores_ is not None else None
+
+                    if top_scores_ is not None:
+                        top_index = torch.reshape(top_scores_[:, 0], (-1, 1))
+                        top_threshold = torch.gather(threshold_all, 1, top_index.detach().clone())
+                    else:
+                        top_threshold = None
 
-                ####
+                    ####
             else:
                 top_scores_ = None
                 top_threshold = None
@@ -399,13 +574,14 @@ def train_cl(model, train_datasets, replay_mode="none", scenario="task", rnt=Non
             if batch_index <= iters_main:
 
                 # Train the main model with this batch
-                loss_dict = model.train_a_batch(x, y=y, x_=x_, y_=y_, scores_=scores_, top_scores_=top_scores_, top_threshold=top_threshold, batch_index=batch_index,
-                                                tasks_=task_used, active_classes=active_classes, task=task, rnt=(
-                                                    1. if task==1 else 1./task
-                                                ) if rnt is None else rnt, freeze_convE=freeze_convE,
-                                                replay_not_hidden=False if Generative else True, batch_size=batch_size, 
-                                                batch_size_replay=batch_size_replay, task_n=task, use_views=use_views, 
-                                                contrast_current=contrast_current, contrast_replayed=contrast_replayed, criterion=criterion)
+                with profiling.phase("train_a_batch"):
+                    loss_dict = model.train_a_batch(x, y=y, x_=x_, y_=y_, scores_=scores_, top_scores_=top_scores_, top_threshold=top_threshold, batch_index=batch_index,
+                                                    tasks_=task_used, active_classes=active_classes, task=task, rnt=(
+                                                        1. if task==1 else 1./task
+                                                    ) if rnt is None else rnt, freeze_convE=freeze_convE,
+                                                    replay_not_hidden=False if Generative else True, batch_size=batch_size, 
+                                                    batch_size_replay=batch_size_replay, task_n=task, use_views=use_views, 
+                                                    contrast_current=contrast_current, contrast_replayed=contrast_replayed, criterion=criterion)
 
                 if args.contrastive:
                     for n, param in model.named_parameters():
@@ -420,62 +596,94 @@ def train_cl(model, train_datasets, replay_mode="none", scenario="task", rnt=Non
 
                 # Update running parameter importance estimates in W
                 if isinstance(model, ContinualLearner) and model.si_c>0:
-                    for n, p in model.convE.named_parameters():
-                        if p.requires_grad:
-                            n = "convE."+n
-                            n = n.replace('.', '__')
-                            if p.grad is not None:
-                                W[n].add_(-p.grad*(p.detach()-p_old[n]))
-                            p_old[n] = p.detach().clone()
-                    for n, p in model.fcE.named_parameters():
-                        if p.requires_grad:
-                            n = "fcE."+n
-                            n = n.replace('.', '__')
-                            if p.grad is not None:
-                                W[n].add_(-p.grad * (p.detach() - p_old[n]))
-                            p_old[n] = p.detach().clone()
-                    for n, p in model.classifier.named_parameters():
-                        if p.requires_grad:
-                            n = "classifier."+n
-                            n = n.replace('.', '__')
-                            if p.grad is not None:
-                                W[n].add_(-p.grad * (p.detach() - p_old[n]))
-                            p_old[n] = p.detach().clone()
+                    with profiling.phase("si_update"):
+                        for n, p in model.convE.named_parameters():
+                            if p.requires_grad:
+                                n = "convE."+n
+                                n = n.replace('.', '__')
+                                if p.grad is not None:
+                                    W[n].add_(-p.grad*(p.detach()-p_old[n]))
+                                p_old[n] = p.detach().clone()
+                        for n, p in model.fcE.named_parameters():
+                            if p.requires_grad:
+                                n = "fcE."+n
+                                n = n.replace('.', '__')
+                                if p.grad is not None:
+                                    W[n].add_(-p.grad * (p.detach() - p_old[n]))
+                                p_old[n] = p.detach().clone()
+                        for n, p in model.classifier.named_parameters():
+                            if p.requires_grad:
+                                n = "classifier."+n
+                                n = n.replace('.', '__')
+                                if p.grad is not None:
+                                    W[n].add_(-p.grad * (p.detach() - p_old[n]))
+                                p_old[n] = p.detach().clone()
 
                 # Fire callbacks (for visualization of training-progress / evaluating performance after each task)
                 for loss_cb in loss_cbs:
                     if loss_cb is not None:
-                        loss_cb(progress, batch_index, loss_dict, task=task)
-                for eval_cb in eval_cbs:
-                    if eval_cb is not None:
-                        eval_cb(model, batch_index, task=task)
-                if model.label=="VAE":
-                    for sample_cb in sample_cbs:
-                        if sample_cb is not None:
-                            sample_cb(model, batch_index, task=task, allowed_classes=None if (
+                        with profiling.phase(loss_cb.__name__):
+                            loss_cb(progress, batch_index, loss_dict, task=task)
+                if evaluator is not None:
+                    with profiling.phase("async_eval_submit"):
+                        evaluator.submit(model, eval_cbs, batch_index, task=task)
+                        if model.label=="VAE":
+                            evaluator.submit(model, sample_cbs, batch_index, task=task, allowed_classes=None if (
                                     scenario=="domain"
                             ) else list(range(classes_per_task*task)))
+                else:
+                    for eval_cb in eval_cbs:
+                        if eval_cb is not None:
+                            with profiling.phase(eval_cb.__name__):
+                                eval_cb(model, batch_index, task=task)
+                    if model.label=="VAE":
+                        for sample_cb in sample_cbs:
+                            if sample_cb is not None:
+                                with profiling.phase(sample_cb.__name__):
+                                    sample_cb(model, batch_index, task=task, allowed_classes=None if (
+                                            scenario=="domain"
+                                    ) else list(range(classes_per_task*task)))
 
 
             #---> Train GENERATOR
             if generator is not None and batch_index <= iters_gen:
 
-                loss_dict = generator.train_a_batch(x, y=y, x_=x_, y_=y_, scores_=scores_,
-                                                    tasks_=task_used, active_classes=active_classes, rnt=(
-                                                        1. if task==1 else 1./task
-                                                    ) if rnt is None else rnt, task=task,
-                                                    freeze_convE=freeze_convE,
-                                                    replay_not_hidden=False if Generative else True, criterion=criterion)
+                with profiling.phase("generator"):
+                    loss_dict = generator.train_a_batch(x, y=y, x_=x_, y_=y_, scores_=scores_,
+                                                        tasks_=task_used, active_classes=active_classes, rnt=(
+                                                            1. if task==1 else 1./task
+                                                        ) if rnt is None else rnt, task=task,
+                                                        freeze_convE=freeze_convE,
+                                                        replay_not_hidden=False if Generative else True, criterion=criterion)
 
                 # Fire callbacks on each iteration
                 for loss_cb in gen_loss_cbs:
                     if loss_cb is not None:
-                        loss_cb(progress_gen, batch_index, loss_dict, task=task)
-                for sample_cb in sample_cbs:
-                    if sample_cb is not None:
-                        sample_cb(generator, batch_index, task=task, allowed_classes=None if (
-                                    scenario=="domain"
-                            ) else list(range(classes_per_task*task)))
+                        with profiling.phase(loss_cb.__name__):
+                            loss_cb(progress_gen, batch_index, loss_dict, task=task)
+                if evaluator is not None:
+                    with profiling.phase("async_eval_submit"):
+                        evaluator.submit(generator, sample_cbs, batch_index, task=task, allowed_classes=None if (
+                                scenario=="domain"
+                        ) else list(range(classes_per_task*task)))
+                else:
+                    for sample_cb in sample_cbs:
+                        if sample_cb is not None:
+                            with profiling.phase(sample_cb.__name__):
+                                sample_cb(generator, batch_index, task=task, allowed_classes=None if (
+                                            scenario=="domain"
+                                    ) else list(range(classes_per_task*task)))
+
+            # Sample memory usage (if memory-tracking is enabled)
+            if memory.due(batch_index):
+                memory.sample("iter {}".format(batch_index), task, components=memory_components)
+
+            # Save training-state (if requested), so training can be resumed from here
+            if (checkpoint_file is not None) and (checkpoint_every is not None) and (
+                    batch_index % checkpoint_every == 0 and batch_index < iters_to_use
+            ):
+                with profiling.phase("checkpoint"):
+                    save_training_state(task, batch_index, task_done=False)
 
 
         # Close progres-bar(s)
@@ -499,18 +707,47 @@ def train_cl(model, train_datasets, replay_mode="none", scenario="task", rnt=Non
             if model.mask_dict is not None:
                 model.apply_XdGmask(task=task)
             # -estimate FI-matrix
-            model.estimate_fisher(train_dataset, allowed_classes=allowed_classes)
+            with profiling.phase("ewc_fisher"):
+                model.estimate_fisher(train_dataset, allowed_classes=allowed_classes)
 
         # SI: calculate and update the normalized path integral
         if isinstance(model, ContinualLearner) and model.si_c>0:
-            model.update_omega(W, model.epsilon)
+            with profiling.phase("si_omega"):
+                model.update_omega(W, model.epsilon)
 
         # REPLAY: update source for replay
-        previous_model = copy.deepcopy(model).eval()
-        if replay_mode=="generative":
-            Generative = True
-            previous_generator = previous_model if feedback else copy.deepcopy(generator).eval()
-        elif replay_mode=='current':
-            Current = True
+        with profiling.phase("replay_update"):
+            previous_model = copy.deepcopy(model).eval()
+            if replay_mode=="generative":
+                Generative = True
+                previous_generator = previous_model if feedback else copy.deepcopy(generator).eval()
+            elif replay_mode=='current':
+                Current = True
+
+        # MEMORY: report memory usage during this task
+        memory.end_task(task, components=memory_components)
+
+        # PROFILING: report time spent per phase during this task (and reset the statistics)
+        profiling.report(title="Time per phase (task {})".format(task), task=task,
+                         file_name=None if profile_file is None else "{}-task{}.json".format(profile_file, task))
+
+        # CHECKPOINT: save training-state (if requested), so training can be resumed from the next task
+        if checkpoint_file is not None:
+            save_training_state(task, iters_to_use, task_done=True)
+
+    # Wait until all evaluations are finished (so their results are available to the caller)
+    if evaluator is not None:
+        evaluator.close()
+
+    # Finish the evaluation-callbacks (e.g., plot the latent-space projection that is still running in the background)
+    _close_callbacks(eval_cbs)
+
+    # Wait until the last training-state is written
+    if writer is not None:
+        writer.close()
+
+    # Remove profiling-hooks
+    for hook in profile_hooks:
+        hook.remove()
 
     return precision_dict
\ No newline at end of file
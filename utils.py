@@ -1,10 +1,14 @@
+import contextlib
+import inspect
 import os
 import pickle
+import numpy as np
 import torch
 from torch import nn
 from torch.utils.data import DataLoader
 from torch.utils.data.dataloader import default_collate
 from models.fc import excitability_modules as em
+import checkpoint
 
 ##-------------------------------------------------------------------------------------------------------------------##
 
@@ -28,15 +32,27 @@ def label_squeezing_collate_fn(batch):
     return x, y.long().squeeze()
 
 
-def get_data_loader(dataset, batch_size, cuda=False, collate_fn=label_squeezing_collate_fn, drop_last=False, augment=False):
-    '''Return <DataLoader>-object for the provided <DataSet>-object [dataset].'''
+def get_data_loader(dataset, batch_size, cuda=False, collate_fn=label_squeezing_collate_fn, drop_last=False, augment=False,
+                    shuffle=True, generator=None):
+    '''Return <DataLoader>-object for the provided <DataSet>-object [dataset].
+
+    [generator]     None or <torch.Generator> to shuffle with (if None, the global random number generator is used)'''
 
     # Create and return the <DataLoader>-object
     return DataLoader(
-        dataset, batch_size=batch_size, shuffle=True, collate_fn=collate_fn, drop_last=drop_last,
+        dataset, batch_size=batch_size, shuffle=shuffle, collate_fn=collate_fn, drop_last=drop_last, generator=generator,
         **({'num_workers': 0, 'pin_memory': True} if cuda else {})
     )
 
+def cache_dataset(dataset, batch_size=128, cuda=False):
+    '''Make a single (non-shuffled) pass over [dataset] and return all its inputs and labels as two (CPU) <tensors>.'''
+    data_loader = get_data_loader(dataset, batch_size=batch_size, cuda=cuda, shuffle=False)
+    x_list, y_list = [], []
+    for x, y in data_loader:
+        x_list.append(x)
+        y_list.append(y.view(-1))
+    return torch.cat(x_list), torch.cat(y_list)
+
 
 ##-------------------------------------------------------------------------------------------------------------------##
 
@@ -59,45 +75,130 @@ def load_object(path):
 ## Model-saving and -loading functions ##
 #########################################
 
-def save_checkpoint(model, model_dir, verbose=True, name=None):
-    '''Save state of [model] as dictionary to [model_dir] (if name is None, use "model.name").'''
+def save_checkpoint(model, model_dir, verbose=True, name=None, writer=None, series=None, blob_dir=None):
+    '''Save state of [model] as dictionary to [model_dir] (if name is None, use "model.name").
+
+    The checkpoint is saved in a flat format that can be memory-mapped when loading; if [blob_dir] is provided, it is
+    instead saved as manifest with its tensors in shared content-addressed blobs in [blob_dir] (see checkpoint.py). If a
+    <CheckpointWriter> is provided as [writer], the checkpoint is written in the background (possibly as part of
+    [series]); otherwise it is written before returning.'''
     # -name/path to store the checkpoint
     name = model.name if name is None else name
     path = os.path.join(model_dir, name)
     # -if required, create directory in which to save checkpoint
     if not os.path.exists(model_dir):
         os.makedirs(model_dir)
+    # -if a writer is provided, let it save the checkpoint (errors are raised by the writer)
+    if writer is not None:
+        writer.save(model.state_dict(), path, series=series, flat=True)
+        return
     # -(try to) save the checkpoint
     try:
-        torch.save({'state': model.state_dict()}, path)
+        if blob_dir is None:
+            checkpoint.write_flat(model.state_dict(), path)
+        else:
+            checkpoint.write_manifest({'state': model.state_dict()}, path, blob_dir)
         if verbose:
             print(' --> saved model {name} to {path}'.format(name=name, path=model_dir))
     except OSError:
         print(" --> saving model '{}' failed!!".format(name))
 
 
-def load_checkpoint(model, model_dir, verbose=True, name=None, add_si_buffers=False):
-    '''Load saved state (in form of dictionary) at [model_dir] (if name is None, use "model.name") to [model].'''
+def load_checkpoint(model, model_dir, verbose=True, name=None):
+    '''Load saved state (in form of dictionary) at [model_dir] (if name is None, use "model.name") to [model].
+
+    Buffers that are in the saved state but not yet in [model] (e.g., SI- or EWC-buffers) are added to [model].'''
     # -path from where to load checkpoint
     name = model.name if name is None else name
     path = os.path.join(model_dir, name)
-    # -if required, add buffers to [model] to make sure its 'state_dict' matches the 'state_dict' of model to be loaded
-    if add_si_buffers:
-        for n, p in model.named_parameters():
-            if p.requires_grad:
-                n = n.replace('.', '__')
-                p_current = p.detach().clone()
-                omega = p.detach().clone().zero_()
-                model.register_buffer('{}_SI_prev_task'.format(n), p_current)
-                model.register_buffer('{}_SI_omega'.format(n), omega)
     # load parameters (i.e., [model] will now have the state of the loaded model)
-    checkpoint = torch.load(path)
-    model.load_state_dict(checkpoint['state'])
+    checkpoint.load_into(model, path)
     # notify that we succesfully loaded the checkpoint
     if verbose:
         print(' --> loaded checkpoint of {name} from {path}'.format(name=name, path=model_dir))
 
 
+def load_state_with_buffers(model, state):
+    '''Load [state] into [model], after first registering buffers that are in [state] but not yet in [model] (e.g.,
+    the SI- or EWC-buffers that are added to the model after each task).'''
+    own_state = model.state_dict()
+    for key, value in state.items():
+        if (key not in own_state) and ("." not in key):
+            model.register_buffer(key, value.detach().clone().to(model._device()))
+    model.load_state_dict(state)
+
+
+def get_training_state(model, optimizers=True):
+    '''Return <dict> with the state of [model], of the random number generator(s) and (if [optimizers]) the optimizer(s)
+    that are attributes of [model], and of the number of quadratic EWC-terms (if any), which together are needed to
+    continue training (or sampling from) [model].'''
+    return {
+        'state': model.state_dict(),
+        'generators': {name: value.get_state() for name, value in vars(model).items() if isinstance(
+            value, torch.Generator
+        )},
+        'optimizers': {name: value.state_dict() for name, value in vars(model).items() if isinstance(
+            value, torch.optim.Optimizer
+        )} if optimizers else {},
+        'EWC_task_count': getattr(model, 'EWC_task_count', None),
+    }
+
+
+def set_training_state(model, training_state):
+    '''Restore state of [model], its random number generator(s) and its optimizer(s) from [training_state] (see
+    'get_training_state').'''
+    load_state_with_buffers(model, training_state['state'])
+    for name, generator_state in training_state['generators'].items():
+        generator = torch.Generator(device=model._device())
+        generator.set_state(generator_state)
+        setattr(model, name, generator)
+    for name, optimizer_state in training_state['optimizers'].items():
+        getattr(model, name).load_state_dict(optimizer_state)
+    if training_state['EWC_task_count'] is not None:
+        model.EWC_task_count = training_state['EWC_task_count']
+
+
+def get_rng_state():
+    '''Return <dict> with the states of all random number generators in use.'''
+    return {'torch': torch.get_rng_state(), 'numpy': np.random.get_state(),
+            'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None}
+
+
+def set_rng_state(rng_state):
+    '''Restore the states of all random number generators from [rng_state] (see 'get_rng_state').'''
+    torch.set_rng_state(rng_state['torch'])
+    np.random.set_state(rng_state['numpy'])
+    if rng_state['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng_state['cuda'])
+
+
+@contextlib.contextmanager
+def seeded_rng(seed):
+    '''Within this context the torch-RNGs are seeded with [seed], after which their previous states are restored (so that
+    the random numbers drawn within this context do not change the random numbers drawn elsewhere).'''
+    with torch.random.fork_rng(devices=list(range(torch.cuda.device_count()))):
+        torch.manual_seed(seed)
+        yield
+
+
+def save_state_atomic(state, path, writer=None):
+    '''Save [state] to [path], by first writing it to a temporary file which then replaces [path] (so a previously
+    saved state is never left half-overwritten if the process is killed while saving). If a <CheckpointWriter> is
+    provided as [writer], this is done in the background.'''
+    if writer is not None:
+        writer.save(state, path)
+    else:
+        checkpoint.write_atomic(state, path)
+
+
+def load_state(path):
+    '''Load state saved with 'save_state_atomic' (all tensors are loaded on the cpu).'''
+    # -the state also contains non-tensor objects (e.g., the state of numpy's random number generator), which newer
+    #  versions of PyTorch only load with [weights_only]=False (older versions do not have this argument)
+    kwargs = {'weights_only': False} if 'weights_only' in inspect.signature(torch.load).parameters else {}
+    return torch.load(path, map_location='cpu', **kwargs)
+
+
 ##-------------------------------------------------------------------------------------------------------------------##
 
 ################################
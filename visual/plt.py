@@ -5,6 +5,7 @@ matplotlib.use('Agg')
 #  is defined (e.g., when running in basic Docker-container)
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
+import torch
 from torchvision.utils import make_grid
 import numpy as np
 
@@ -13,24 +14,38 @@ def open_pdf(full_path):
     return PdfPages(full_path)
 
 
+def add_to_pdf(pdf, plot_name, *args, **kwargs):
+    '''Add page with the figure returned by [plot_name](*args, **kwargs) to [pdf] and close the figure. If [pdf] is a
+    'ReportWriter' (see visual/report.py), the figure is rendered in its worker-process instead.'''
+    if hasattr(pdf, 'plot'):
+        pdf.plot(plot_name, *args, **kwargs)
+    else:
+        figure = globals()[plot_name](*args, **kwargs)
+        pdf.savefig(figure)
+        plt.close(figure)
+
+
 def plot_images_from_tensor(image_tensor, pdf=None, nrow=8, title=None, config=None):
-    '''Plot images in [image_tensor] as a grid with [nrow] into [pdf].
+    '''Plot images in [image_tensor] as a grid with [nrow] into [pdf] (if [pdf] is None, the figure is returned).
 
-    [image_tensor]      <tensor> [batch_size]x[channels]x[width]x[height]'''
+    [image_tensor]      <tensor> or <np-array> [batch_size]x[channels]x[width]x[height]'''
 
     # -denormalize images if needed
     if config is not None and config['normalize']:
         image_tensor = config['denormalize'](image_tensor).clamp(min=0, max=1)
+    # -if [pdf] is provided, the figure is made (and closed) by 'add_to_pdf' or by the worker-process of [pdf]
+    if pdf is not None:
+        add_to_pdf(pdf, 'plot_images_from_tensor', image_tensor, nrow=nrow, title=title)
+        return
     # -create image-grad and plot
-    image_grid = make_grid(image_tensor, nrow=nrow, pad_value=1)  # pad_value=0 gives black borders
-    _ = plt.figure()
+    image_grid = make_grid(torch.as_tensor(image_tensor), nrow=nrow, pad_value=1)  # pad_value=0 gives black borders
+    f = plt.figure()
     plt.imshow(np.transpose(image_grid.numpy(), (1,2,0)))
     # -add title if provided
     if title:
         plt.title(title)
-    # -save figure into pdf
-    if pdf is not None:
-        pdf.savefig()
+    # return the figure
+    return f
 
 
 def plot_scatter_groups(x, y, colors=None, ylabel=None, xlabel=None, title=None, top_title=None, names=None,
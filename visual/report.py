@@ -0,0 +1,56 @@
+import multiprocessing
+import traceback
+
+
+def _to_numpy(value):
+    '''Move <tensors> to cpu and convert them to <np-arrays> (so they can be cheaply sent to another process).'''
+    if hasattr(value, 'detach'):
+        return value.detach().cpu().numpy()
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_numpy(v) for v in value)
+    return value
+
+
+def _render_pages(full_path, jobs):
+    '''Worker-process: render all figures received over [jobs] and append each as a page to the pdf at [full_path].'''
+    import visual.plt
+    pdf = visual.plt.open_pdf(full_path)
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            plot_name, args, kwargs = job
+            try:
+                figure = getattr(visual.plt, plot_name)(*args, **kwargs)
+                pdf.savefig(figure)
+                visual.plt.plt.close(figure)
+            except Exception:
+                traceback.print_exc()
+    finally:
+        pdf.close()
+
+
+class ReportWriter(object):
+    '''Writes a pdf-report in a separate process. Plots are requested by the name of a plotting-function in visual/plt.py
+    (which should return the <figure>) together with its arguments (e.g., image-tensors or lists with metrics); these are
+    sent over a queue, and the worker-process renders the figure, appends it as a page to the pdf and closes it. The
+    pages are added in the order in which they were requested.
+
+    This object can be passed as [pdf] to the plotting-functions in eval/evaluate.py and visual/plt.py.'''
+
+    def __init__(self, full_path):
+        context = multiprocessing.get_context("spawn")
+        self.full_path = full_path
+        self.jobs = context.Queue()
+        self.process = context.Process(target=_render_pages, args=(full_path, self.jobs), daemon=True)
+        self.process.start()
+
+    def plot(self, plot_name, *args, **kwargs):
+        '''Add page with the figure returned by 'visual.plt.[plot_name](*args, **kwargs)' to the report.'''
+        self.jobs.put((plot_name, _to_numpy(args), {key: _to_numpy(value) for key, value in kwargs.items()}))
+
+    def close(self):
+        '''Wait until all requested pages are rendered and close the pdf.'''
+        self.jobs.put(None)
+        self.process.join()
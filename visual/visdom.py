@@ -1,12 +1,85 @@
+import atexit
+import json
+import queue
+import sys
+import threading
+import time
 import numpy as np
 from visdom import Visdom
 
 
 _WINDOW_CASH = {}
 
+# One persistent client per environment (or None if the visdom-server could not be reached)
+_CLIENTS = {}
+# Buffered scalar-points per window, which are sent together to the visdom-server
+_SCALAR_BUFFER = {}
+_LOCK = threading.RLock()          #--> only guards [_SCALAR_BUFFER], nothing is sent while holding it
+_CLIENT_LOCK = threading.Lock()
+_FILE_LOCK = threading.Lock()
+_CONFIG = {'flush_every': 20, 'flush_seconds': 10., 'offline_file': None}
+# Full buffers are sent by a background thread, so that the training thread never waits for the visdom-server
+_SEND_QUEUE = queue.Queue()
+_SEND_THREAD = None
+
+
+def configure(flush_every=20, flush_seconds=10., offline_file=None):
+    '''Set how plots are sent to visdom.
+
+    [flush_every]      <int>, scalar-points are buffered per window and sent once [flush_every] points are collected
+    [flush_seconds]    <float>, buffered scalar-points are (also) sent at least every [flush_seconds] seconds
+    [offline_file]     None or <str>; if provided, nothing is sent to a visdom-server, but all plotting-calls are
+                         appended to this JSONL-file (which can later be send to visdom using 'replay')'''
+    flush()
+    _CONFIG.update(flush_every=flush_every, flush_seconds=flush_seconds, offline_file=offline_file)
+
 
 def _vis(env='main'):
-    return Visdom(env=env)
+    '''Return persistent client for [env] (or None if no visdom-server is running).'''
+    with _CLIENT_LOCK:
+        if env not in _CLIENTS:
+            client = Visdom(env=env)
+            if not client.check_connection():
+                print(" --> no visdom-server found (env '{}'); plots are not shown!".format(env))
+                client = None
+            _CLIENTS[env] = client
+        return _CLIENTS[env]
+
+
+def _to_json(value):
+    if hasattr(value, 'cpu'):
+        value = value.cpu().numpy()
+    return value.tolist() if isinstance(value, (np.ndarray, np.generic)) else value
+
+
+def _send(env, method, **kwargs):
+    '''Call [method] (e.g., 'line', 'images') of the client for [env], or, if an [offline_file] is set, append it there.'''
+    if _CONFIG['offline_file'] is not None:
+        record = {'env': env, 'method': method, 'kwargs': {key: _to_json(value) for key, value in kwargs.items()}}
+        with _FILE_LOCK, open(_CONFIG['offline_file'], 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        return kwargs.get('win')
+    client = _vis(env)
+    if client is None:
+        return None
+    try:
+        return getattr(client, method)(**kwargs)
+    except Exception as e:
+        print(" --> sending plot to visdom failed: {}".format(e))
+        return None
+
+
+def replay(offline_file, server=None):
+    '''Send all plotting-calls stored in [offline_file] (see 'configure') to the visdom-server.'''
+    with open(offline_file) as f:
+        for line in f:
+            record = json.loads(line)
+            kwargs = record['kwargs']
+            for key in ('X', 'Y', 'tensor'):
+                if key in kwargs and kwargs[key] is not None:
+                    kwargs[key] = np.array(kwargs[key])
+            client = Visdom(env=record['env'], **({} if server is None else {'server': server}))
+            getattr(client, record['method'])(**kwargs)
 
 
 def visualize_images(tensor, title, win=None, env='main', w=400, h=400, nrow=8):
@@ -15,21 +88,21 @@ def visualize_images(tensor, title, win=None, env='main', w=400, h=400, nrow=8):
     win = title if win is None else win
     # if name in _WINDOW_CASH:
     #     _vis(env).close(win=_WINDOW_CASH.get(name))
-    _WINDOW_CASH[win] = _vis(env).images(tensor, win=_WINDOW_CASH.get(win), nrow=nrow, opts=options)
+    _WINDOW_CASH[win] = _send(env, 'images', tensor=tensor, win=_WINDOW_CASH.get(win, win), nrow=nrow, opts=options)
 
 
 def scatter_plot(X, title, colors=None, env='main', win=None,  w=400, h=400):
     '''Plot scatter-diagram of entries contained in 2D-tensor [X] to visdom-server.'''
     options = dict(title=title, width=w, height=h)
     win = title if win is None else win
-    _WINDOW_CASH[win] = _vis(env).scatter(X, win=_WINDOW_CASH.get(win), Y=colors, opts=options)
+    _WINDOW_CASH[win] = _send(env, 'scatter', X=X, win=_WINDOW_CASH.get(win, win), Y=colors, opts=options)
 
 
 def visualize_hist(X, title, win=None, env='main', w=400, h=400):
     '''Plot histogram of entries contained in 1D-tensor [X] to visdom-server.'''
     options = dict(title=title, width=w, height=h)
     win = title if win is None else win
-    _WINDOW_CASH[win] = _vis(env).histogram(X, win=_WINDOW_CASH.get(win), opts=options)
+    _WINDOW_CASH[win] = _send(env, 'histogram', X=X, win=_WINDOW_CASH.get(win, win), opts=options)
 
 
 def visualize_scalars(scalars, names, iteration, title, win=None, env='main', ylabel=None):
@@ -47,11 +120,85 @@ def visualize_scalars(scalars, names, iteration, title, win=None, env='main', yl
         marginleft=30, marginright=30, marginbottom=80, margintop=30,
     )
 
-    X = ( np.column_stack(np.array([iteration] * num)) if (num>1) else np.array([iteration] * num) )
-    Y = np.column_stack(scalars) if (num>1) else scalars[0]
+    X = np.array([iteration] * num, dtype=float).reshape(1, num)
+    Y = np.array([float(np.asarray(s).reshape(-1)[0]) for s in scalars]).reshape(1, num)
 
+    # Add point to buffer of this window (which is sent to the visdom-server once enough points are collected)
     win = title if win is None else win
+    with _LOCK:
+        buffer = _SCALAR_BUFFER.setdefault((env, win), {'X': [], 'Y': [], 'opts': options, 'time': time.time()})
+        buffer['X'].append(X)
+        buffer['Y'].append(Y)
+        buffer['opts'] = options
+        full = _SCALAR_BUFFER.pop((env, win)) if len(buffer['X']) >= _CONFIG['flush_every'] else None
+    _start_send_thread()
+    if full is not None:
+        _SEND_QUEUE.put((env, win, full))
+
+
+def _send_buffer(env, win, buffer):
+    '''Send all scalar-points in [buffer] of window [win] to visdom (in a single call).'''
+    X, Y = np.concatenate(buffer['X']), np.concatenate(buffer['Y'])
+    X, Y = (X, Y) if X.shape[1]>1 else (X[:, 0], Y[:, 0])
     if win in _WINDOW_CASH:
-        _vis(env).line(X=X, Y=Y, win=_WINDOW_CASH[win], opts=options, update='append')
+        _send(env, 'line', X=X, Y=Y, win=_WINDOW_CASH[win], opts=buffer['opts'], update='append')
     else:
-        _WINDOW_CASH[win] = _vis(env).line(X=X, Y=Y, opts=options)
+        _WINDOW_CASH[win] = _send(env, 'line', X=X, Y=Y, win=win, opts=buffer['opts'])
+
+
+def _take_buffers(min_age=None):
+    '''Remove and return all buffers (or, if [min_age] is provided, those older than [min_age] seconds).'''
+    with _LOCK:
+        keys = [key for key, buffer in _SCALAR_BUFFER.items() if (
+            min_age is None or time.time() - buffer['time'] >= min_age
+        )]
+        return [key + (_SCALAR_BUFFER.pop(key),) for key in keys]
+
+
+def flush():
+    '''Send all buffered scalar-points to visdom (and wait until they are sent).'''
+    for item in _take_buffers():
+        _SEND_QUEUE.put(item)
+    if _SEND_THREAD is not None:
+        _SEND_QUEUE.join()
+
+
+def get_state():
+    '''Return <dict> with the windows plotted in so far (after sending all buffered scalar-points), so that a resumed
+    run continues plotting in the same windows (see 'set_state').'''
+    flush()
+    return dict(_WINDOW_CASH)
+
+
+def set_state(state):
+    '''Continue plotting in the windows in [state] (see 'get_state').'''
+    _WINDOW_CASH.update(state)
+
+
+def _send_periodically():
+    '''Send the buffers put on [_SEND_QUEUE], and those with points that are older than [flush_seconds] seconds.'''
+    while True:
+        try:
+            item = _SEND_QUEUE.get(timeout=max(_CONFIG['flush_seconds'] / 4., 0.1))
+        except queue.Empty:
+            for stale_item in _take_buffers(min_age=_CONFIG['flush_seconds']):
+                _send_buffer(*stale_item)
+            continue
+        try:
+            _send_buffer(*item)
+        finally:
+            _SEND_QUEUE.task_done()
+
+
+def _start_send_thread():
+    global _SEND_THREAD
+    with _LOCK:
+        if _SEND_THREAD is None:
+            _SEND_THREAD = threading.Thread(target=_send_periodically, daemon=True)
+            _SEND_THREAD.start()
+            atexit.register(flush)
+
+
+if __name__ == '__main__':
+    # Send plots stored in an offline JSONL-file to the visdom-server (usage: python -m visual.visdom FILE [SERVER])
+    replay(sys.argv[1], server=sys.argv[2] if len(sys.argv)>2 else None)